@@ -0,0 +1,174 @@
+# async_pipeline.py
+# This module runs the master as a pipeline of asyncio tasks.
+# In the default master the MQTT callback decodes, solves and publishes inside
+# paho's network thread, so a slow solve also stalls socket reads and
+# keepalives. Here the callback only queues the raw message; decoding, solving
+# and publishing happen in their own stages connected by bounded queues.
+#
+#   paho thread --> ingest queue --> ingest task (decode + fuse)
+#                                      |
+#               expire task ------> solve queue --> solve task (executor)
+#                                                      |
+#                   results from the solver --> publish queue --> publish task
+
+import asyncio
+import concurrent.futures
+
+
+# --- Pipeline ---
+class AsyncMasterPipeline:
+    """
+    This class connects the master's stages with bounded asyncio queues.
+
+    ingest_fn(topic, payload) decodes one raw message and returns the list of
+    fused rounds that became ready. solve_fn(rounds) hands rounds to the
+    solver; it runs in a worker thread so it may block. Results come back
+    through post_result() (from any thread) and are passed to publish_fn.
+    expire_fn() is called every expire_interval seconds and returns rounds
+    whose deadline passed.
+
+    When the ingest queue is full, new messages are dropped and counted
+    instead of blocking paho's network thread. The later queues apply back
+    pressure: a full solve queue pauses the ingest task, which then lets the
+    ingest queue absorb the burst.
+    """
+
+    def __init__(self, ingest_fn, solve_fn, publish_fn, expire_fn=None, expire_interval=0.05,
+                 ingest_queue_size=10000, solve_queue_size=1000, publish_queue_size=1000,
+                 max_batch=512):
+        self.ingest_fn = ingest_fn
+        self.solve_fn = solve_fn
+        self.publish_fn = publish_fn
+        self.expire_fn = expire_fn
+        self.expire_interval = expire_interval
+        self.ingest_queue_size = ingest_queue_size
+        self.solve_queue_size = solve_queue_size
+        self.publish_queue_size = publish_queue_size
+        self.max_batch = max_batch
+
+        self._loop = None
+        self._ingest_queue = None
+        self._solve_queue = None
+        self._publish_queue = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+        # Counters for monitoring
+        self.dropped_messages = 0
+        self.dropped_results = 0
+        self.errors = 0
+
+    # --- Entry points called from other threads ---
+    def on_message(self, client, userdata, msg):
+        """
+        This function is the MQTT on_message callback. It only hands the raw
+        message over to the event loop.
+        """
+        loop = self._loop
+        if loop is None:
+            self.dropped_messages += 1
+            return
+        loop.call_soon_threadsafe(self._enqueue, self._ingest_queue, (msg.topic, msg.payload), "message")
+
+    def post_result(self, result):
+        """
+        This function queues one solver result for publishing. It is safe to
+        call from any thread.
+        """
+        loop = self._loop
+        if loop is None:
+            self.dropped_results += 1
+            return
+        loop.call_soon_threadsafe(self._enqueue, self._publish_queue, result, "result")
+
+    def _enqueue(self, target, item, kind):
+        try:
+            target.put_nowait(item)
+        except asyncio.QueueFull:
+            if kind == "message":
+                self.dropped_messages += 1
+            else:
+                self.dropped_results += 1
+
+    # --- Running ---
+    async def run(self, on_ready=None):
+        """
+        This function runs all pipeline tasks until it is cancelled.
+
+        on_ready is called once the queues exist, which is the right moment
+        to start the MQTT network loop.
+        """
+        self._ingest_queue = asyncio.Queue(self.ingest_queue_size)
+        self._solve_queue = asyncio.Queue(self.solve_queue_size)
+        self._publish_queue = asyncio.Queue(self.publish_queue_size)
+        self._loop = asyncio.get_running_loop()
+        if on_ready is not None:
+            on_ready()
+
+        tasks = [
+            asyncio.create_task(self._ingest_task()),
+            asyncio.create_task(self._solve_task()),
+            asyncio.create_task(self._publish_task()),
+        ]
+        if self.expire_fn is not None:
+            tasks.append(asyncio.create_task(self._expire_task()))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            self._loop = None
+            for task in tasks:
+                task.cancel()
+            self._executor.shutdown(wait=False)
+
+    def queue_sizes(self):
+        """
+        This function returns how many items wait in each queue.
+        """
+        return {
+            "ingest": self._ingest_queue.qsize() if self._ingest_queue else 0,
+            "solve": self._solve_queue.qsize() if self._solve_queue else 0,
+            "publish": self._publish_queue.qsize() if self._publish_queue else 0,
+        }
+
+    # --- Stages ---
+    async def _ingest_task(self):
+        while True:
+            messages = [await self._ingest_queue.get()]
+            while len(messages) < self.max_batch and not self._ingest_queue.empty():
+                messages.append(self._ingest_queue.get_nowait())
+
+            rounds = []
+            for topic, payload in messages:
+                try:
+                    rounds.extend(self.ingest_fn(topic, payload))
+                except Exception as e:
+                    self.errors += 1
+                    print(f"Error decoding message from '{topic}': {e}")
+            if rounds:
+                await self._solve_queue.put(rounds)
+
+    async def _expire_task(self):
+        while True:
+            await asyncio.sleep(self.expire_interval)
+            rounds = self.expire_fn()
+            if rounds:
+                await self._solve_queue.put(rounds)
+
+    async def _solve_task(self):
+        while True:
+            rounds = list(await self._solve_queue.get())
+            while len(rounds) < self.max_batch and not self._solve_queue.empty():
+                rounds.extend(self._solve_queue.get_nowait())
+            try:
+                await self._loop.run_in_executor(self._executor, self.solve_fn, rounds)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error solving rounds: {e}")
+
+    async def _publish_task(self):
+        while True:
+            result = await self._publish_queue.get()
+            try:
+                self.publish_fn(result)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error publishing result: {e}")
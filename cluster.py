@@ -0,0 +1,219 @@
+# cluster.py
+# This module lets several master instances share the work of one site.
+#
+# A round needs the samples of all nodes for one tag, so the traffic cannot be
+# split per message (which is what an MQTT shared subscription does). Instead
+# every tag is hashed into one of a fixed number of partitions, and nodes
+# publish on a per-partition topic:
+#     home/nodes/+          ->  home/nodes/<partition>/<node>
+# Each partition is owned by exactly one master instance, which subscribes to
+# home/nodes/<partition>/+ only.
+#
+# Instances announce themselves with a retained "online" on the members topic
+# (home/cluster/members/<instance>) and a last will "offline". Every instance
+# sees the same member list and computes the same owner for every partition
+# with rendezvous hashing, so when an instance joins or leaves only the
+# partitions it gains or loses move.
+#
+# A starting instance owns nothing until it knows the other members. It
+# subscribes to the members topic before announcing itself, so the broker
+# sends it the retained messages of the others first and its own "online"
+# after them; once that comes back the list is complete. If it never does,
+# the instance claims its partitions after a grace period with the members it
+# knows by then.
+#
+# Running this file prints the member list and partition owners as they
+# change, which is handy when testing several local masters:
+#     python cluster.py --broker localhost --partitions 16
+
+import argparse
+import hashlib
+import threading
+import zlib
+
+import paho.mqtt.client as mqtt
+
+# Status payloads on the members topic
+MEMBER_ONLINE = "online"
+MEMBER_OFFLINE = "offline"
+
+
+# --- Partitioning ---
+def partition_of(tag, partitions):
+    """
+    This function maps a tag uuid to its partition in range(partitions).
+    It uses CRC32 so nodes and masters agree whatever process they run in.
+    """
+    return zlib.crc32(str(tag).encode()) % partitions
+
+
+def partition_topic(raw_data_topic, partition, node="+"):
+    """
+    This function returns the partition topic for a raw data topic such as
+    "home/nodes/+": "home/nodes/<partition>/<node>". The default node "+"
+    gives the subscription of the whole partition.
+    """
+    base = raw_data_topic.rsplit("/", 1)[0]
+    return f"{base}/{partition}/{node}"
+
+
+def owner_of(partition, members):
+    """
+    This function returns the member that owns a partition: the one with the
+    highest hash of (member, partition). Removing a member only moves the
+    partitions it owned; adding one only moves the partitions it now wins.
+    """
+    return max(members, key=lambda member: (_weight(member, partition), member))
+
+
+def _weight(member, partition):
+    # CRC32 mixes similar names poorly, which would give uneven shares
+    digest = hashlib.blake2b(f"{member}/{partition}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def assign(partitions, members):
+    """
+    This function returns {member: sorted list of owned partitions}.
+    """
+    owned = {member: [] for member in members}
+    if members:
+        for partition in range(partitions):
+            owned[owner_of(partition, members)].append(partition)
+    return owned
+
+
+# --- Membership ---
+class ClusterMembership:
+    """
+    This class tracks the members of the cluster and the partitions owned by
+    this instance.
+
+    update() records a message from the members topic and returns the
+    partitions this instance gained and lost, so the caller can subscribe to
+    and unsubscribe from their topics. This instance always counts as a
+    member, but owns no partition until the member list is settled: when its
+    own "online" comes back, or when the caller calls settle() after a grace
+    period. Messages that arrive before can be held with hold() and taken
+    back with take_held() once settled.
+    """
+
+    def __init__(self, instance, partitions):
+        self.instance = instance
+        self.partitions = partitions
+        self.members = {instance}
+        self.owned = set()
+        self.settled = False
+        self._held = []
+        self._lock = threading.Lock()
+
+    def update(self, member, payload):
+        """
+        This function records a member going online or offline. Returns a
+        tuple (gained, lost) of sorted partition lists.
+        """
+        if isinstance(payload, bytes):
+            payload = payload.decode(errors="replace")
+        online = payload.strip().lower() == MEMBER_ONLINE
+
+        with self._lock:
+            if member == self.instance:
+                # A stale "offline" from our previous run must not remove us.
+                # Our own "online" arrives after the retained list.
+                if not online or self.settled:
+                    return [], []
+                self.settled = True
+            elif online:
+                self.members.add(member)
+            else:
+                self.members.discard(member)
+            if not self.settled:
+                return [], []
+            return self._rebalance()
+
+    def settle(self):
+        """
+        This function claims the partitions of this instance with the members
+        known so far, if the member list is not settled yet. Returns a tuple
+        (gained, lost) like update().
+        """
+        with self._lock:
+            if self.settled:
+                return [], []
+            self.settled = True
+            return self._rebalance()
+
+    def _rebalance(self):
+        # Called with the lock held
+        owned = {p for p in range(self.partitions) if owner_of(p, self.members) == self.instance}
+        gained = sorted(owned - self.owned)
+        lost = sorted(self.owned - owned)
+        self.owned = owned
+        return gained, lost
+
+    def hold(self, message):
+        """
+        This function keeps a message that arrived before the member list was
+        settled, such as a sample from the subscriptions of a resumed broker
+        session. Returns False, keeping nothing, once the list is settled.
+        """
+        with self._lock:
+            if self.settled:
+                return False
+            self._held.append(message)
+            return True
+
+    def take_held(self):
+        """
+        This function returns the held messages, in arrival order, and forgets
+        them.
+        """
+        with self._lock:
+            held, self._held = self._held, []
+        return held
+
+    def owns(self, tag):
+        """
+        This function returns True if this instance solves the given tag.
+        """
+        return partition_of(tag, self.partitions) in self.owned
+
+
+# --- Monitor Program ---
+def main():
+    parser = argparse.ArgumentParser(description="Show the members of a master cluster and their partitions.")
+    parser.add_argument("--broker", default="localhost", help="MQTT broker address")
+    parser.add_argument("--port", type=int, default=1883, help="MQTT broker port")
+    parser.add_argument("--partitions", type=int, default=16, help="number of partitions (cluster_partitions)")
+    parser.add_argument("--members-topic", default="home/cluster/members/+", help="members topic of the masters")
+    args = parser.parse_args()
+
+    members = set()
+
+    def on_connect(client, userdata, flags, rc):
+        client.subscribe(args.members_topic)
+        print(f"Watching '{args.members_topic}'")
+
+    def on_message(client, userdata, msg):
+        member = msg.topic.split("/")[-1]
+        if msg.payload.decode(errors="replace").strip().lower() == MEMBER_ONLINE:
+            members.add(member)
+        else:
+            members.discard(member)
+        print("-" * 40)
+        for name, owned in sorted(assign(args.partitions, sorted(members)).items()):
+            print(f"{name}: {len(owned)} partitions {owned}")
+
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_message = on_message
+    try:
+        client.connect(args.broker, args.port, 60)
+        client.loop_forever()
+    except KeyboardInterrupt:
+        print("Exiting...")
+    finally:
+        client.disconnect()
+
+if __name__ == "__main__":
+    main()
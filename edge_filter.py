@@ -0,0 +1,165 @@
+# edge_filter.py
+# This module filters the ranges on the node before they are published.
+# Multipath reflections make a UWB module report ranges that are far too
+# long now and then. Sent as-is they cost uplink bandwidth and master CPU,
+# and then pull the fix away from the tag. Here every range is compared with
+# the recent ranges of the same tag and dropped if it is an outlier, and the
+# node can also publish only every n-th round.
+
+import bisect
+from collections import deque
+
+import wire_codec
+
+# Scales the MAD to the standard deviation of normally distributed noise
+MAD_SCALE = 1.4826
+
+
+# --- Sliding Window ---
+class SlidingMedian:
+    """
+    This class keeps the last window values and their median and MAD
+    (median absolute deviation).
+
+    The values are kept both in arrival order and sorted. Adding a value
+    removes the oldest one and inserts the new one with a binary search, so
+    an update costs O(log window) comparisons plus one memmove of at most
+    window pointers. The cost does not grow with the length of the stream.
+    median() is a lookup. mad() finds the middle of the deviations below and
+    above the median, which are two sorted sequences, with a binary search
+    instead of sorting them.
+    """
+
+    def __init__(self, window=15):
+        self.window = window
+        self._order = deque()
+        self._sorted = []
+
+    def add(self, value):
+        """
+        This function adds a value, dropping the oldest once the window is full.
+        """
+        if len(self._order) == self.window:
+            old = self._order.popleft()
+            del self._sorted[bisect.bisect_left(self._sorted, old)]
+        self._order.append(value)
+        bisect.insort(self._sorted, value)
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def median(self):
+        """
+        This function returns the median of the window.
+        """
+        values = self._sorted
+        middle = len(values) // 2
+        if len(values) % 2:
+            return values[middle]
+        return (values[middle - 1] + values[middle]) / 2.0
+
+    def mad(self):
+        """
+        This function returns the median absolute deviation of the window.
+        """
+        values = self._sorted
+        count = len(values)
+        median = self.median()
+        split = bisect.bisect_left(values, median)
+
+        # Deviations of the values below the median, smallest first, and of
+        # the values at or above it, smallest first
+        def below(i):
+            return median - values[split - 1 - i]
+
+        def above(j):
+            return values[split + j] - median
+
+        middle = count // 2
+        upper = _kth_smallest(below, split, above, count - split, middle)
+        if count % 2:
+            return upper
+        return (_kth_smallest(below, split, above, count - split, middle - 1) + upper) / 2.0
+
+
+def _kth_smallest(a, a_count, b, b_count, k):
+    # k-th smallest (from 0) of two sorted sequences given as index functions.
+    # Binary search for how many of the k + 1 smallest come from a.
+    lo, hi = max(0, k + 1 - b_count), min(k + 1, a_count)
+    while lo < hi:
+        i = (lo + hi) // 2
+        j = k + 1 - i
+        if j > 0 and b(j - 1) > a(i):
+            lo = i + 1
+        else:
+            hi = i
+    i, j = lo, k + 1 - lo
+    if i == 0:
+        return b(j - 1)
+    if j == 0:
+        return a(i - 1)
+    return max(a(i - 1), b(j - 1))
+
+
+# --- Edge Filter ---
+class EdgeFilter:
+    """
+    This class decides which samples a node publishes.
+
+    A sample is rejected as an outlier when its range is more than threshold
+    scaled MADs away from the median of the last window ranges of its tag
+    (a Hampel filter). Every range enters the window, rejected or not, so a
+    real jump in range becomes the new median after half a window. The MAD is
+    never taken as less than min_mad metres, so perfectly steady ranges do not
+    make the next bit of noise an outlier.
+
+    With decimation n only samples whose session ID is a multiple of n are
+    published. Every node drops the same sessions, so the rounds that remain
+    are still complete at the master.
+
+    Samples without a range are always published.
+    """
+
+    def __init__(self, window=15, threshold=3.0, decimation=1, min_mad=0.02, min_samples=5):
+        self.window = window
+        self.threshold = threshold
+        self.decimation = max(1, decimation)
+        self.min_mad = min_mad
+        self.min_samples = min_samples
+        self._windows = {}
+
+        # Counters for monitoring
+        self.published = 0
+        self.rejected = 0
+        self.decimated = 0
+
+    def accept(self, sample):
+        """
+        This function returns True if the sample should be published.
+        """
+        distance = sample.get('range')
+        if distance is not None:
+            window = self._windows.get(sample['tag'])
+            if window is None:
+                window = self._windows[sample['tag']] = SlidingMedian(self.window)
+            outlier = False
+            if len(window) >= self.min_samples:
+                spread = max(window.mad(), self.min_mad) * MAD_SCALE
+                outlier = abs(distance - window.median()) > self.threshold * spread
+            window.add(distance)
+            if outlier:
+                self.rejected += 1
+                return False
+
+        if self.decimation > 1 and wire_codec.session_counter(sample['session_id']) % self.decimation:
+            self.decimated += 1
+            return False
+        self.published += 1
+        return True
+
+    def stats(self):
+        """
+        This function returns the counters as a printable line.
+        """
+        return (f"Filter: {self.published} published, {self.rejected} outliers rejected, "
+                f"{self.decimated} decimated")
@@ -0,0 +1,418 @@
+# fleet_sim.py
+# This program simulates a whole site of UWB nodes in one process, to load
+# test the masters without running one rpi_node*.py copy (and one MQTT
+# connection) per node.
+#
+# Anchors are laid out on a grid and tags follow smooth ground-truth paths.
+# Every sample period each tag is ranged by its nearest anchors, with
+# Gaussian range noise and random dropouts, and every anchor publishes the
+# samples it took on its own raw data topic, exactly like a node with
+# batching. The program also listens to the master's position topic and
+# compares every fix with the ground truth at the fix's timestamp, so it
+# reports both the master's throughput and its accuracy under load.
+#
+# Configure the master to match the simulation before starting it: with the
+# default --anchors-per-tag 6 set expected_nodes = 6 and adapt_to_alive_nodes
+# = False (a tag is never ranged by every alive anchor). With only the 4
+# nearest anchors of a grid, tags near a row of anchors see them nearly in a
+# line and their fixes get much worse. The anchor positions are
+# published on the anchor config topic, so the master picks them up itself.
+#
+# Examples:
+#   python fleet_sim.py --broker localhost --anchors 200 --tags 500
+#   python fleet_sim.py --prefix uwb --format json --noise 0.05 --dropout 0.1
+#   python fleet_sim.py --anchors 2000 --tags 5000 --rate 5 --duration 60
+
+import argparse
+import asyncio
+import json
+import math
+import threading
+import time
+
+import numpy as np
+import paho.mqtt.client as mqtt
+
+import cluster
+import position_codec
+import wire_codec
+
+# --- MQTT Broker Configuration ---
+broker_address = "192.168.106.249"
+broker_port = 1883
+
+# --- Topics ---
+# The topics of both master variants, selected with --prefix
+TOPICS = {
+    "home": {"raw": "home/nodes/+", "status": "home/status/+",
+             "position": "home/position", "anchors": "home/config/anchors"},
+    "uwb": {"raw": "uwb/raw_data/+", "status": "uwb/status/+",
+            "position": "uwb/position", "anchors": "uwb/config/anchors"},
+}
+
+# Number of tags whose distances to all anchors are computed at once
+distance_chunk = 256
+
+
+# --- Site Geometry ---
+def tag_name(index):
+    """
+    This function returns the UUID of simulated tag number index.
+    """
+    return f"00000000-0000-4000-8000-{index:012x}"
+
+
+def tag_index(name):
+    """
+    This function returns the number of a simulated tag from its UUID, or
+    None for any other tag.
+    """
+    if not str(name).startswith("00000000-0000-4000-8000-"):
+        return None
+    return int(str(name).rsplit("-", 1)[1], 16)
+
+
+def anchor_grid(count, width, depth, heights=(2.0, 3.0)):
+    """
+    This function places count anchors on a grid covering a width x depth
+    metre floor. Neighbouring anchors alternate between the given
+    mounting heights so the tags' height can be observed.
+
+    Returns an array of shape (count, 3).
+    """
+    columns = max(1, math.ceil(math.sqrt(count * width / depth)))
+    rows = max(1, math.ceil(count / columns))
+    anchors = np.zeros((count, 3))
+    for i in range(count):
+        row, column = divmod(i, columns)
+        anchors[i] = ((column + 0.5) * width / columns, (row + 0.5) * depth / rows,
+                      heights[(row + column) % len(heights)])
+    return anchors
+
+
+class Trajectories:
+    """
+    This class holds the ground-truth path of every tag.
+
+    Each tag moves on its own Lissajous curve inside the floor, at a height
+    of tag_height, with an average speed of roughly speed m/s. The paths are
+    closed-form functions of time, so the true position of a tag is known at
+    any timestamp a fix carries.
+    """
+
+    def __init__(self, tags, width, depth, tag_height=1.0, speed=1.0, seed=1):
+        rng = np.random.default_rng(seed)
+        size = np.array([width, depth])
+        self.centre = rng.uniform(0.25, 0.75, (tags, 2)) * size
+        self.amplitude = rng.uniform(0.1, 0.25, (tags, 2)) * size
+        self.omega = speed / self.amplitude.mean(axis=1, keepdims=True) * rng.uniform(0.5, 1.0, (tags, 2))
+        self.phase = rng.uniform(0.0, 2 * math.pi, (tags, 2))
+        self.tag_height = tag_height
+
+    def positions(self, t):
+        """
+        This function returns the positions of all tags at time t, (T, 3).
+        """
+        xy = self.centre + self.amplitude * np.sin(self.omega * t + self.phase)
+        return np.column_stack([xy, np.full(len(xy), self.tag_height)])
+
+    def position(self, index, t):
+        """
+        This function returns the position of one tag at time t.
+        """
+        xy = self.centre[index] + self.amplitude[index] * np.sin(self.omega[index] * t + self.phase[index])
+        return np.array([xy[0], xy[1], self.tag_height])
+
+
+# --- Simulator ---
+class FleetSimulator:
+    """
+    This class produces the traffic of all simulated anchors and measures the
+    fixes that come back.
+
+    tick() builds the messages of one sample period. on_position() is the
+    paho callback for the master's position topic. run() is the asyncio main
+    loop that publishes every period and prints a report every
+    report_interval seconds.
+    """
+
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.topics = TOPICS[args.prefix]
+        self.period = 1.0 / args.rate
+        self.rng = np.random.default_rng(args.seed)
+
+        self.anchors = anchor_grid(args.anchors, args.width, args.depth)
+        self.anchor_names = [f"sim_anchor_{i}" for i in range(args.anchors)]
+        self.trajectories = Trajectories(args.tags, args.width, args.depth, args.tag_height, args.speed, args.seed)
+        self.tag_names = [tag_name(i) for i in range(args.tags)]
+
+        # Topic of every anchor. In clustered mode the topic also depends on
+        # the partition of each tag (see cluster.py).
+        self._anchor_topics = [self.topics["raw"].replace("+", name) for name in self.anchor_names]
+        if args.partitions:
+            self._partitions = [cluster.partition_of(tag, args.partitions) for tag in self.tag_names]
+
+        # Decodes the compact position encodings of the master
+        self.decoder = position_codec.PositionDecoder()
+
+        # Counters, swapped out by every report
+        self._lock = threading.Lock()
+        self._reset_counters()
+        self.ticks = 0
+        self.missed_ticks = 0
+        self._last_report = time.time()
+
+    def _reset_counters(self):
+        self.messages = 0
+        self.samples = 0
+        self.errors = []
+        self.filtered_errors = []
+        self.latencies = []
+        self.fixes = 0
+
+    # --- Traffic ---
+    def announce(self):
+        """
+        This function publishes the retained "online" status of every anchor
+        and, unless disabled, the anchor positions for the master.
+        """
+        status = self.topics["status"]
+        for name in self.anchor_names:
+            self.client.publish(status.replace("+", name), "online", retain=True)
+        if not self.args.no_anchor_config:
+            table = {name: [round(v, 3) for v in anchor] for name, anchor in zip(self.anchor_names, self.anchors.tolist())}
+            self.client.publish(self.topics["anchors"], json.dumps(table), retain=True)
+
+    def retire(self):
+        """
+        This function publishes "offline" for every anchor and removes the
+        simulated anchors from the master's anchor table.
+        """
+        status = self.topics["status"]
+        info = None
+        for name in self.anchor_names:
+            info = self.client.publish(status.replace("+", name), "offline", retain=True)
+        if not self.args.no_anchor_config:
+            info = self.client.publish(self.topics["anchors"], json.dumps({name: None for name in self.anchor_names}), retain=True)
+        if info is not None:
+            # Let the network thread send everything before disconnecting
+            info.wait_for_publish(5)
+
+    def tick(self, t):
+        """
+        This function simulates one sample period at time t and returns the
+        list of (topic, payload) messages to publish.
+        """
+        args = self.args
+        truth = self.trajectories.positions(t)
+        session = int(round(t * args.rate))
+        k = min(args.anchors_per_tag, len(self.anchors))
+
+        # The k nearest anchors of every tag, with their true distances
+        tags, anchors, distances = [], [], []
+        for start in range(0, len(truth), distance_chunk):
+            chunk = truth[start:start + distance_chunk]
+            d = np.linalg.norm(chunk[:, None, :] - self.anchors[None, :, :], axis=2)
+            nearest = np.argpartition(d, k - 1, axis=1)[:, :k] if k < d.shape[1] else np.tile(np.arange(k), (len(chunk), 1))
+            rows = np.arange(len(chunk))[:, None]
+            tags.append(np.broadcast_to(rows + start, nearest.shape).ravel())
+            anchors.append(nearest.ravel())
+            distances.append(d[rows, nearest].ravel())
+        tags = np.concatenate(tags)
+        anchors = np.concatenate(anchors)
+        ranges = np.concatenate(distances) + self.rng.normal(0.0, args.noise, len(tags))
+
+        # Drop samples at random, then group the rest by anchor
+        keep = self.rng.random(len(tags)) >= args.dropout
+        tags, anchors, ranges = tags[keep], anchors[keep], ranges[keep]
+        reported = truth[tags] + self.rng.normal(0.0, args.noise, (len(tags), 3))
+        order = np.argsort(anchors, kind="stable")
+        tags, anchors, ranges, reported = tags[order], anchors[order], ranges[order], reported[order]
+
+        messages = []
+        bounds = np.flatnonzero(np.diff(anchors)) + 1
+        for group in np.split(np.arange(len(anchors)), bounds):
+            if not len(group):
+                continue
+            anchor = int(anchors[group[0]])
+            samples = [
+                wire_codec.make_sample(None, self.tag_names[tag], session, x, y, z, distance, t)
+                for tag, distance, (x, y, z) in zip(tags[group].tolist(), ranges[group].tolist(), reported[group].tolist())
+            ]
+            if args.partitions:
+                # One message per partition, each on that partition's topic
+                by_partition = {}
+                for sample, tag in zip(samples, tags[group].tolist()):
+                    by_partition.setdefault(self._partitions[tag], []).append(sample)
+                for partition, part in by_partition.items():
+                    topic = cluster.partition_topic(self.topics["raw"], partition, self.anchor_names[anchor])
+                    self._add_messages(messages, topic, part)
+            else:
+                self._add_messages(messages, self._anchor_topics[anchor], samples)
+        return messages, len(tags)
+
+    def _add_messages(self, messages, topic, samples):
+        # One batch per anchor, like a node with batching, unless --no-batch
+        if self.args.no_batch or len(samples) == 1:
+            for sample in samples:
+                messages.append((topic, wire_codec.encode(sample, self.args.format)))
+        else:
+            messages.append((topic, wire_codec.encode_batch(samples, self.args.format)))
+
+    # --- Fixes ---
+    def on_position(self, client, userdata, msg):
+        """
+        Callback function for the master's position topic. It compares the
+        fix with the ground truth at the fix's timestamp.
+        """
+        received = time.time()
+        try:
+            data = self.decoder.decode(msg.payload)
+        except ValueError:
+            return
+        if data is None:
+            return
+        index = tag_index(data.get("uuid"))
+        timestamp = data.get("timestamp")
+        if index is None or index >= len(self.tag_names) or timestamp is None:
+            return
+        truth = self.trajectories.position(index, timestamp)
+        position = data["calculated_position"]
+        error = math.dist((position["x"], position["y"], position["z"]), truth)
+        filtered = data.get("filtered_position")
+        with self._lock:
+            self.fixes += 1
+            self.errors.append(error)
+            self.latencies.append(received - timestamp)
+            if filtered is not None:
+                self.filtered_errors.append(math.dist((filtered["x"], filtered["y"], filtered["z"]), truth))
+
+    # --- Main Loop ---
+    async def run(self, duration=0.0):
+        """
+        This function publishes one tick per sample period, spreading each
+        tick's messages over the period like independent nodes would, until
+        duration seconds passed (0 runs until interrupted).
+        """
+        loop = asyncio.get_running_loop()
+        reporter = asyncio.create_task(self._report_loop())
+        started = time.time()
+        # Sample on multiples of the period, like the nodes' RateScheduler
+        next_tick = math.ceil(started / self.period) * self.period
+        try:
+            while not duration or time.time() - started < duration:
+                delay = next_tick - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                t = next_tick
+
+                messages, samples = await loop.run_in_executor(None, self.tick, t)
+                slices = max(1, self.args.slices)
+                step = math.ceil(len(messages) / slices) if messages else 0
+                for i in range(slices):
+                    for topic, payload in messages[i * step:(i + 1) * step]:
+                        self.client.publish(topic, payload)
+                    if i < slices - 1:
+                        await asyncio.sleep(max(0.0, t + self.period * 0.8 * (i + 1) / slices - time.time()))
+                with self._lock:
+                    self.messages += len(messages)
+                    self.samples += samples
+                self.ticks += 1
+
+                # Skip the periods we are already late for instead of bursting
+                next_tick += self.period
+                late = time.time() - next_tick
+                if late > 0:
+                    skipped = math.ceil(late / self.period)
+                    self.missed_ticks += skipped
+                    next_tick += skipped * self.period
+        finally:
+            reporter.cancel()
+            self.report()
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(self.args.report)
+            self.report()
+
+    def report(self):
+        """
+        This function prints the counters since the previous report.
+        """
+        now = time.time()
+        with self._lock:
+            elapsed = max(now - self._last_report, 1e-9)
+            messages, samples, fixes = self.messages, self.samples, self.fixes
+            errors, filtered, latencies = self.errors, self.filtered_errors, self.latencies
+            self._reset_counters()
+        self._last_report = now
+
+        def p(values, q):
+            return np.percentile(values, q) if values else math.nan
+
+        print("-" * 40)
+        print(f"Ticks: {self.ticks} (missed {self.missed_ticks})  "
+              f"published {messages / elapsed:.0f} msg/s, {samples / elapsed:.0f} samples/s")
+        print(f"Fixes: {fixes / elapsed:.0f} fixes/s")
+        print(f"Error (m):          p50={p(errors, 50):.3f} p90={p(errors, 90):.3f} p99={p(errors, 99):.3f}")
+        if filtered:
+            print(f"Filtered error (m): p50={p(filtered, 50):.3f} p90={p(filtered, 90):.3f} p99={p(filtered, 99):.3f}")
+        print(f"Sample to fix (ms): p50={p(latencies, 50) * 1000:.1f} p99={p(latencies, 99) * 1000:.1f}")
+
+
+# --- Main Program ---
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many UWB anchors and tags in one process.")
+    parser.add_argument("--broker", default=broker_address, help="MQTT broker address")
+    parser.add_argument("--port", type=int, default=broker_port, help="MQTT broker port")
+    parser.add_argument("--prefix", choices=sorted(TOPICS), default="home", help="topics of the master to load")
+    parser.add_argument("--format", default=wire_codec.FORMAT_BINARY,
+                        choices=[wire_codec.FORMAT_BINARY, wire_codec.FORMAT_JSON, wire_codec.FORMAT_SLASH],
+                        help="wire format of the samples")
+    parser.add_argument("--anchors", type=int, default=100, help="number of anchors")
+    parser.add_argument("--tags", type=int, default=200, help="number of tags")
+    parser.add_argument("--anchors-per-tag", type=int, default=6, help="anchors that range each tag")
+    parser.add_argument("--width", type=float, default=50.0, help="floor width in metres")
+    parser.add_argument("--depth", type=float, default=50.0, help="floor depth in metres")
+    parser.add_argument("--tag-height", type=float, default=1.0, help="height of the tags in metres")
+    parser.add_argument("--speed", type=float, default=1.0, help="average tag speed in m/s")
+    parser.add_argument("--rate", type=float, default=10.0, help="samples per second per tag")
+    parser.add_argument("--noise", type=float, default=0.02, help="standard deviation of the range noise in metres")
+    parser.add_argument("--dropout", type=float, default=0.0, help="probability that a sample is lost")
+    parser.add_argument("--partitions", type=int, default=0, help="cluster_partitions of the masters")
+    parser.add_argument("--slices", type=int, default=10, help="spread each tick's messages over this many slices")
+    parser.add_argument("--no-batch", action="store_true", help="one message per sample instead of per anchor")
+    parser.add_argument("--no-anchor-config", action="store_true", help="do not publish the anchor positions")
+    parser.add_argument("--duration", type=float, default=0.0, help="seconds to run, 0 = until interrupted")
+    parser.add_argument("--report", type=float, default=5.0, help="seconds between reports")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    args = parser.parse_args()
+
+    client = mqtt.Client()
+    simulator = FleetSimulator(client, args)
+
+    def on_connect(client, userdata, flags, rc):
+        if rc == 0:
+            print(f"Simulator connected: {args.anchors} anchors, {args.tags} tags at {args.rate} Hz")
+            client.subscribe(simulator.topics["position"])
+        else:
+            print(f"Failed to connect, return code {rc}")
+
+    client.on_connect = on_connect
+    client.on_message = simulator.on_position
+    try:
+        client.connect(args.broker, args.port, 60)
+        client.loop_start()
+        simulator.announce()
+        asyncio.run(simulator.run(args.duration))
+    except KeyboardInterrupt:
+        print("Exiting...")
+    finally:
+        simulator.retire()
+        client.loop_stop()
+        client.disconnect()
+
+if __name__ == "__main__":
+    main()
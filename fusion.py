@@ -0,0 +1,144 @@
+# fusion.py
+# This module groups node reports into rounds before the master solves them.
+# A round is one ranging session of one tag, so it is keyed by
+# (tag uuid, session_id). Samples from different sessions are never mixed.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+# --- Fusion Window ---
+class FusionWindow:
+    """
+    This class collects samples into rounds and decides when a round is ready.
+
+    A round is emitted as soon as expected_nodes different nodes have reported
+    for it. If that does not happen within round_timeout seconds of the first
+    sample, the round is emitted by expire() as long as it reached min_nodes,
+    and dropped otherwise.
+
+    At most capacity rounds are kept open. When a new round arrives and the
+    window is full, the oldest open round is closed early, exactly as if its
+    deadline had passed. This bounds memory no matter how fast the nodes run.
+
+    Emitted rounds are dictionaries:
+        {"tag": ..., "session_id": ..., "samples": {node_key: sample},
+         "complete": True/False}
+
+    All methods are thread-safe, so the MQTT network thread can call add()
+    while the main thread calls expire().
+    """
+
+    def __init__(self, expected_nodes=3, min_nodes=3, round_timeout=1.0, capacity=256):
+        self.expected_nodes = expected_nodes
+        self.min_nodes = min_nodes
+        self.round_timeout = round_timeout
+        self.capacity = capacity
+
+        # Open rounds in arrival order: key -> (deadline, samples)
+        self._open = OrderedDict()
+        # Recently closed round keys, so late samples do not reopen a round
+        self._closed = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.rounds_complete = 0
+        self.rounds_timed_out = 0
+        self.rounds_dropped = 0
+        self.late_samples = 0
+
+    def add(self, tag, session_id, node_key, sample, now=None):
+        """
+        This function stores one sample and returns the list of rounds that
+        became ready because of it (usually empty or a single round).
+        """
+        if now is None:
+            now = time.monotonic()
+        key = (tag, session_id)
+        ready = []
+
+        with self._lock:
+            if key in self._closed:
+                self.late_samples += 1
+                return ready
+
+            entry = self._open.get(key)
+            if entry is None:
+                # Make room by closing the oldest open round
+                while len(self._open) >= self.capacity:
+                    old_key, (_, old_samples) = self._open.popitem(last=False)
+                    self._close(old_key, old_samples, False, ready)
+                entry = (now + self.round_timeout, {})
+                self._open[key] = entry
+
+            samples = entry[1]
+            samples[node_key] = sample
+            if len(samples) >= self.expected_nodes:
+                del self._open[key]
+                self._close(key, samples, True, ready)
+
+        return ready
+
+    def expire(self, now=None):
+        """
+        This function closes every round whose deadline has passed and
+        returns the ones that collected at least min_nodes samples.
+        """
+        if now is None:
+            now = time.monotonic()
+        ready = []
+
+        with self._lock:
+            # Rounds are stored in arrival order, so deadlines are ordered too
+            while self._open:
+                key, (deadline, samples) = next(iter(self._open.items()))
+                if deadline > now:
+                    break
+                del self._open[key]
+                self._close(key, samples, False, ready)
+
+        return ready
+
+    def set_expected_nodes(self, expected_nodes):
+        """
+        This function changes the number of nodes a round waits for, for
+        example when nodes come online or drop out. Open rounds that already
+        have enough samples for the new number are closed and returned.
+        """
+        ready = []
+        with self._lock:
+            self.expected_nodes = expected_nodes
+            for key, (_, samples) in list(self._open.items()):
+                if len(samples) >= expected_nodes:
+                    del self._open[key]
+                    self._close(key, samples, True, ready)
+        return ready
+
+    def pending(self):
+        """
+        This function returns the number of rounds that are still open.
+        """
+        with self._lock:
+            return len(self._open)
+
+    def _close(self, key, samples, complete, ready):
+        # Remember the key for a while so stragglers are counted, not reopened
+        self._closed[key] = None
+        while len(self._closed) > self.capacity:
+            self._closed.popitem(last=False)
+
+        if complete:
+            self.rounds_complete += 1
+        elif len(samples) >= self.min_nodes:
+            self.rounds_timed_out += 1
+        else:
+            self.rounds_dropped += 1
+            return
+
+        ready.append({
+            "tag": key[0],
+            "session_id": key[1],
+            "samples": samples,
+            "complete": complete,
+        })
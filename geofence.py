@@ -0,0 +1,337 @@
+# geofence.py
+# This module turns the master's fixes into zone events.
+#
+# A site can define hundreds of zones (rooms, desks, no-go areas), and every
+# subscriber that wants to know which zone a tag is in would otherwise test
+# every zone on every position message. Here the master does it once. The
+# zones are put in a uniform grid of cells, so a fix is only tested against
+# the few zones whose bounding box overlaps its cell. Every tag keeps the set
+# of zones it is in, and an event is only emitted when that set changes:
+#   "enter"  the tag moved inside the zone
+#   "exit"   the tag moved more than hysteresis metres outside the zone, was
+#            not seen for tag_timeout seconds, or the zone was removed
+#   "dwell"  the tag stayed in the zone for its dwell time (once per visit)
+# Because a tag has to move hysteresis metres out before it exits, a tag
+# standing on the edge of a zone does not flicker in and out with the noise
+# of its fixes.
+#
+# Zones are given as JSON-style dictionaries, keyed by zone name:
+#   {"min": [x, y, z], "max": [x, y, z]}        a box (z optional in both)
+#   {"polygon": [[x, y], ...], "z": [low, high]} a polygon ("z" optional)
+# Either form can also carry "dwell": seconds, overriding the default.
+
+import math
+import threading
+import time
+
+
+# --- Zones ---
+class Zone:
+    """
+    This class is one zone: a polygon in the x/y plane, optionally limited to
+    a range of heights.
+    """
+
+    def __init__(self, name, polygon, z_range=None, dwell_time=None):
+        if len(polygon) < 3:
+            raise ValueError(f"zone '{name}' needs at least 3 corners")
+        self.name = name
+        self.polygon = [(float(x), float(y)) for x, y in polygon]
+        self.z_range = None if z_range is None else (float(z_range[0]), float(z_range[1]))
+        self.dwell_time = dwell_time
+        xs = [x for x, _ in self.polygon]
+        ys = [y for _, y in self.polygon]
+        self.bounds = (min(xs), min(ys), max(xs), max(ys))
+
+    def contains(self, x, y, z):
+        """
+        This function returns True if the point is inside the zone.
+        """
+        if self.z_range is not None and not self.z_range[0] <= z <= self.z_range[1]:
+            return False
+        return self._contains_xy(x, y)
+
+    def distance(self, x, y, z):
+        """
+        This function returns how far the point is outside the zone in
+        metres, 0 if it is inside.
+        """
+        flat = 0.0
+        if not self._contains_xy(x, y):
+            edges = zip(self.polygon, self.polygon[1:] + self.polygon[:1])
+            flat = min(_segment_distance(x, y, a, b) for a, b in edges)
+        height = 0.0
+        if self.z_range is not None:
+            height = max(self.z_range[0] - z, z - self.z_range[1], 0.0)
+        return math.hypot(flat, height)
+
+    def _contains_xy(self, x, y):
+        min_x, min_y, max_x, max_y = self.bounds
+        if not (min_x <= x <= max_x and min_y <= y <= max_y):
+            return False
+        # Ray casting: count the edges crossed by a ray towards +x
+        inside = False
+        x1, y1 = self.polygon[-1]
+        for x2, y2 in self.polygon:
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+            x1, y1 = x2, y2
+        return inside
+
+
+def _segment_distance(x, y, a, b):
+    # Distance from (x, y) to the segment a-b
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length = dx * dx + dy * dy
+    t = 0.0 if length == 0 else max(0.0, min(1.0, ((x - a[0]) * dx + (y - a[1]) * dy) / length))
+    return math.hypot(x - a[0] - t * dx, y - a[1] - t * dy)
+
+
+def make_zone(name, spec):
+    """
+    This function builds a Zone from its JSON-style description (see the top
+    of this module). Raises ValueError if the description is not valid.
+    """
+    try:
+        dwell_time = spec.get("dwell")
+        if "polygon" in spec:
+            return Zone(name, spec["polygon"], spec.get("z"), dwell_time)
+        low, high = spec["min"], spec["max"]
+        z_range = (low[2], high[2]) if len(low) > 2 and len(high) > 2 else None
+        corners = [(low[0], low[1]), (high[0], low[1]), (high[0], high[1]), (low[0], high[1])]
+        return Zone(name, corners, z_range, dwell_time)
+    except (KeyError, IndexError, TypeError, AttributeError) as e:
+        raise ValueError(f"invalid zone '{name}': {e!r}")
+
+
+# --- Grid Index ---
+class GridIndex:
+    """
+    This class finds the zones near a point with a uniform grid of square
+    cells, cell_size metres wide. Every zone is listed in each cell its
+    bounding box overlaps, so a lookup is one dictionary access, however many
+    zones there are. The cells should be about the size of a typical zone.
+    """
+
+    def __init__(self, cell_size=2.0):
+        self.cell_size = cell_size
+        self._cells = {}
+
+    def _cell_range(self, zone):
+        min_x, min_y, max_x, max_y = zone.bounds
+        size = self.cell_size
+        return (range(math.floor(min_x / size), math.floor(max_x / size) + 1),
+                range(math.floor(min_y / size), math.floor(max_y / size) + 1))
+
+    def insert(self, zone):
+        columns, rows = self._cell_range(zone)
+        for i in columns:
+            for j in rows:
+                self._cells.setdefault((i, j), []).append(zone)
+
+    def remove(self, zone):
+        columns, rows = self._cell_range(zone)
+        for i in columns:
+            for j in rows:
+                cell = self._cells[i, j]
+                cell.remove(zone)
+                if not cell:
+                    del self._cells[i, j]
+
+    def query(self, x, y):
+        """
+        This function returns the zones whose bounding box may hold (x, y).
+        """
+        return self._cells.get((math.floor(x / self.cell_size), math.floor(y / self.cell_size)), ())
+
+
+# --- Zone Engine ---
+class ZoneEngine:
+    """
+    This class keeps the zones and the zones every tag is in, and turns fixes
+    into events.
+
+    update() takes one fix of a tag and returns its events. expire() returns
+    the exits of tags not seen for tag_timeout seconds and of removed zones;
+    due() says when to call it. Events are dictionaries:
+        {"tag": ..., "zone": ..., "event": "enter"/"exit"/"dwell",
+         "timestamp": ..., "position": {"x", "y", "z"}}
+    and exits and dwells also carry "duration", the seconds since the tag
+    entered. Exits that were not caused by the tag moving out carry a
+    "reason" ("timeout" or "removed") and no position.
+
+    Times are in seconds since the epoch, like the fixes' timestamps. All
+    methods are thread-safe.
+    """
+
+    def __init__(self, cell_size=2.0, hysteresis=0.3, dwell_time=10.0, tag_timeout=30.0, check_interval=1.0):
+        self.hysteresis = hysteresis
+        self.dwell_time = dwell_time
+        self.tag_timeout = tag_timeout
+        self.check_interval = check_interval
+        self._zones = {}
+        self._index = GridIndex(cell_size)
+        # tag -> (time of its last fix, {zone name: [time entered, dwell reported]})
+        self._tags = {}
+        # Exits of removed zones, returned by the next expire()
+        self._pending = []
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.fixes = 0
+        self.zone_tests = 0
+        self.events = 0
+        self.stale = 0
+
+    def __len__(self):
+        return len(self._zones)
+
+    def set_zones(self, changes):
+        """
+        This function applies zone changes ({name: description or None to
+        remove}). A changed zone replaces the old one; tags in a removed zone
+        exit it on the next expire(). Raises ValueError for an invalid
+        description, before anything is changed.
+        """
+        built = {name: None if spec is None else make_zone(name, spec) for name, spec in changes.items()}
+        with self._lock:
+            for name, zone in built.items():
+                old = self._zones.pop(name, None)
+                if old is not None:
+                    self._index.remove(old)
+                if zone is not None:
+                    self._zones[name] = zone
+                    self._index.insert(zone)
+                elif old is not None:
+                    # Exit as of the tag's last fix
+                    for tag, (seen, inside) in self._tags.items():
+                        if name in inside:
+                            self._pending.append(self._exit(tag, name, inside.pop(name), seen, "removed"))
+
+    def update(self, tag, x, y, z, timestamp=None):
+        """
+        This function takes one fix of a tag and returns the list of events it
+        caused (usually empty). Fixes that are not finite are ignored, and so
+        are stale fixes (late rounds, or samples a node replays from its
+        outbox): fixes older than the tag's last fix, or old enough that the
+        tag would time out at once.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        events = []
+        if not (math.isfinite(x) and math.isfinite(y) and math.isfinite(z)):
+            return events
+        with self._lock:
+            state = self._tags.get(tag)
+            if (state is not None and timestamp < state[0]) or timestamp < time.time() - self.tag_timeout:
+                self.stale += 1
+                return events
+            self.fixes += 1
+            inside = {} if state is None else state[1]
+            self._tags[tag] = (timestamp, inside)
+
+            # Zones the tag is in: exit once it is clearly outside
+            for name, visit in list(inside.items()):
+                zone = self._zones.get(name)
+                if zone is None:
+                    # Restored from a snapshot, not configured (yet)
+                    continue
+                self.zone_tests += 1
+                if zone.distance(x, y, z) > self.hysteresis:
+                    del inside[name]
+                    event = self._exit(tag, name, visit, timestamp)
+                    event["position"] = {"x": x, "y": y, "z": z}
+                    events.append(event)
+                    continue
+                dwell_time = self.dwell_time if zone.dwell_time is None else zone.dwell_time
+                if not visit[1] and dwell_time is not None and timestamp - visit[0] >= dwell_time:
+                    visit[1] = True
+                    events.append(self._event(tag, name, "dwell", timestamp, x, y, z, timestamp - visit[0]))
+
+            # Zones near the fix: enter once it is inside
+            for zone in self._index.query(x, y):
+                if zone.name in inside:
+                    continue
+                self.zone_tests += 1
+                if zone.contains(x, y, z):
+                    inside[zone.name] = [timestamp, False]
+                    events.append(self._event(tag, zone.name, "enter", timestamp, x, y, z))
+            self.events += len(events)
+        return events
+
+    def due(self):
+        """
+        This function returns True once every check_interval seconds.
+        """
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.check_interval
+        return True
+
+    def expire(self, now=None):
+        """
+        This function forgets the tags not seen for tag_timeout seconds and
+        returns their exits, along with the exits of removed zones.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            events, self._pending = self._pending, []
+            for tag, (seen, inside) in list(self._tags.items()):
+                if now - seen > self.tag_timeout:
+                    del self._tags[tag]
+                    for name, visit in inside.items():
+                        events.append(self._exit(tag, name, visit, now, "timeout"))
+            self.events += len(events)
+        return events
+
+    def occupants(self, name):
+        """
+        This function returns the tags that are in a zone.
+        """
+        with self._lock:
+            return sorted(tag for tag, (_, inside) in self._tags.items() if name in inside)
+
+    def snapshot(self):
+        """
+        This function returns a copy of the zones every tag is in, for
+        restore().
+        """
+        with self._lock:
+            return {tag: (seen, {name: list(visit) for name, visit in inside.items()})
+                    for tag, (seen, inside) in self._tags.items()}
+
+    def restore(self, snapshot):
+        """
+        This function loads the tags of a snapshot(), replacing their current
+        state. Visits of zones that are not configured yet, such as zones that
+        arrive later on a config topic, are kept: they carry on once the zone
+        is set again, or end with the tag's timeout.
+        """
+        with self._lock:
+            for tag, (seen, inside) in snapshot.items():
+                self._tags[tag] = (seen, {name: list(visit) for name, visit in inside.items()})
+
+    def _event(self, tag, name, kind, timestamp, x, y, z, duration=None):
+        event = {"tag": tag, "zone": name, "event": kind, "timestamp": timestamp,
+                 "position": {"x": x, "y": y, "z": z}}
+        if duration is not None:
+            event["duration"] = duration
+        return event
+
+    def _exit(self, tag, name, visit, timestamp, reason=None):
+        event = {"tag": tag, "zone": name, "event": "exit", "timestamp": timestamp,
+                 "duration": timestamp - visit[0]}
+        if reason is not None:
+            event["reason"] = reason
+        return event
+
+    def stats(self):
+        """
+        This function returns the counters as a printable line.
+        """
+        tests = self.zone_tests / self.fixes if self.fixes else 0.0
+        return (f"Zones: {len(self._zones)} zones, {len(self._tags)} tags tracked, {self.events} events, "
+                f"{tests:.1f} zone tests per fix, {self.stale} stale fixes skipped")
@@ -0,0 +1,123 @@
+# ingest_bench.py
+# This program compares the master's two ingest paths on the same binary
+# messages, without a broker:
+#   dict   wire_codec.decode_many + fusion.FusionWindow + solve_rounds
+#   array  round_buffer.decode_records + round_buffer.RoundBuffer +
+#          solve_round_arrays (use_array_ingest in the masters)
+# For each path it reports the time per message, the Python memory blocks
+# allocated per message (held by the open rounds), the garbage collections
+# per 1000 messages and the time to solve the rounds.
+#
+# Examples:
+#   python ingest_bench.py
+#   python ingest_bench.py --messages 200000 --batch 8 --nodes 6
+
+import argparse
+import gc
+import math
+import random
+import sys
+import time
+
+import fusion
+import multilateration
+import replay_bench
+import round_buffer
+import wire_codec
+
+
+def make_messages(count, nodes, tags, batch, seed=1):
+    """
+    This function returns count (node, payload) binary messages: every node
+    ranges every tag once per session and sends batch samples per message.
+    """
+    rng = random.Random(seed)
+    anchors = replay_bench.bench_anchors(nodes)
+    tag_ids = [f"00000000-0000-4000-8000-{i:012x}" for i in range(tags)]
+    messages = []
+    waiting = {name: [] for name in anchors}
+    session = 0
+    while len(messages) < count:
+        for name, anchor in anchors.items():
+            samples = waiting[name]
+            for tag_index, tag in enumerate(tag_ids):
+                phase = tag_index + session * 0.02
+                position = (5 + 3 * math.cos(phase), 5 + 3 * math.sin(phase), 1.0)
+                distance = math.dist(position, anchor) + rng.gauss(0, 0.02)
+                samples.append(wire_codec.make_sample(None, tag, session, *position, distance, 1000.0 + session * 0.1))
+                if len(samples) == batch:
+                    payload = wire_codec.encode(samples[0]) if batch == 1 else wire_codec.encode_batch(samples)
+                    messages.append((name, payload))
+                    samples.clear()
+        session += 1
+    return messages[:count], anchors
+
+
+def ingest_dict(window, messages):
+    """
+    This function ingests the messages the way the master does without
+    use_array_ingest and returns the ready rounds.
+    """
+    ready = []
+    for node, payload in messages:
+        for data in wire_codec.decode_many(payload):
+            ready.extend(window.add(data['tag'], data['session_id'], node, data))
+    return ready
+
+
+def ingest_array(buffer, messages):
+    """
+    This function ingests the messages the way the master does with
+    use_array_ingest and returns the ready rounds.
+    """
+    ready = []
+    for node, payload in messages:
+        records = round_buffer.decode_records(payload)
+        ready.extend(buffer.add_records(node, round_buffer.record_tags(records), records))
+    return ready
+
+
+def measure(name, ingest, window, messages, solve, anchors):
+    """
+    This function runs one ingest path over the messages and prints its
+    numbers.
+    """
+    gc.collect()
+    collections = sum(stat["collections"] for stat in gc.get_stats())
+    blocks = sys.getallocatedblocks()
+    started = time.perf_counter()
+    ready = ingest(window, messages)
+    elapsed = time.perf_counter() - started
+    held = sys.getallocatedblocks() - blocks
+    collections = sum(stat["collections"] for stat in gc.get_stats()) - collections
+
+    started = time.perf_counter()
+    rounds = [r['samples'] for r in ready] if solve is multilateration.solve_rounds else ready
+    solve(rounds, anchors, multilateration.GeometryCache())
+    solved = time.perf_counter() - started
+
+    count = len(messages)
+    print(f"{name:>6}: {elapsed / count * 1e6:7.2f} us/message, {held / count:6.2f} blocks/message, "
+          f"{collections / count * 1000:6.2f} GCs per 1000 messages, "
+          f"{len(ready)} rounds solved in {solved * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the dictionary and array ingest paths of the master.")
+    parser.add_argument("--messages", type=int, default=100000, help="binary messages to ingest")
+    parser.add_argument("--nodes", type=int, default=4, help="nodes (anchors) ranging every tag")
+    parser.add_argument("--tags", type=int, default=16, help="tags ranged every session")
+    parser.add_argument("--batch", type=int, default=1, help="samples per message")
+    args = parser.parse_args()
+
+    messages, anchors = make_messages(args.messages, args.nodes, args.tags, args.batch)
+    # Room for every round a batch from each node can open, so none is evicted
+    capacity = 4 * (args.tags + args.batch)
+    print(f"{len(messages)} messages of {args.batch} samples from {args.nodes} nodes, {args.tags} tags")
+    measure("dict", ingest_dict, fusion.FusionWindow(args.nodes, args.nodes, 1.0, capacity),
+            messages, multilateration.solve_rounds, anchors)
+    measure("array", ingest_array, round_buffer.RoundBuffer(args.nodes, args.nodes, 1.0, capacity),
+            messages, multilateration.solve_round_arrays, anchors)
+
+if __name__ == "__main__":
+    main()
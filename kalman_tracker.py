@@ -0,0 +1,179 @@
+# kalman_tracker.py
+# This module smooths the positions calculated by the master and estimates
+# the velocity of each tag, using a constant-velocity Kalman filter.
+#
+# The three axes are filtered independently with the same noise settings, so
+# they share one 2x2 covariance (position/velocity). That keeps the state of a
+# tag to one row of ten numbers in a preallocated NumPy array, and lets a whole
+# batch of fixes be filtered with a few array operations.
+
+import numpy as np
+
+# --- Row Layout ---
+# Columns of the state array
+_POS = slice(0, 3)      # x, y, z
+_VEL = slice(3, 6)      # vx, vy, vz
+_P00 = 6                # position variance
+_P01 = 7                # position/velocity covariance
+_P11 = 8                # velocity variance
+_TIME = 9               # time of the last update (seconds)
+_COLUMNS = 10
+
+
+# --- Tracker ---
+class KalmanTracker:
+    """
+    This class keeps a constant-velocity Kalman filter for every tag.
+
+    process_noise is the spectral density of the random acceleration
+    (m^2/s^3). measurement_noise is the variance of one fix (m^2).
+    initial_velocity_variance is the velocity uncertainty of a new tag.
+
+    Tags get a row the first time they are seen. The arrays start with room
+    for capacity tags and double when they are full, so each update is O(1).
+    """
+
+    def __init__(self, capacity=1024, process_noise=0.5, measurement_noise=0.05,
+                 initial_velocity_variance=1.0):
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.initial_velocity_variance = initial_velocity_variance
+
+        self._state = np.zeros((capacity, _COLUMNS))
+        self._fixes = np.zeros(capacity, dtype=np.int64)
+        self._rows = {}
+
+        # Counters for monitoring
+        self.stale = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, tag):
+        return tag in self._rows
+
+    def _row(self, tag):
+        row = self._rows.get(tag)
+        if row is None:
+            row = len(self._rows)
+            if row == len(self._state):
+                self._state = np.concatenate([self._state, np.zeros_like(self._state)])
+                self._fixes = np.concatenate([self._fixes, np.zeros_like(self._fixes)])
+            self._rows[tag] = row
+        return row
+
+    def update_many(self, tags, positions, times):
+        """
+        This function filters a batch of fixes.
+
+        tags is a list of tag uuids, positions an (N, 3) array and times an
+        (N,) array of fix times in seconds. A tag may appear more than once;
+        its fixes are applied in order.
+
+        A fix older than the tag's last update (a late round, or samples a
+        node replays from its outbox) cannot be filtered into the current
+        state, so it is skipped and counted in self.stale.
+
+        Returns a tuple (positions, velocities) of (N, 3) arrays holding the
+        filtered state right after each fix, NaN for skipped fixes.
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        times = np.asarray(times, dtype=np.float64)
+        rows = np.fromiter((self._row(tag) for tag in tags), dtype=np.int64, count=len(tags))
+        out_positions = np.full_like(positions, np.nan)
+        out_velocities = np.full_like(positions, np.nan)
+
+        # Apply the batch in passes where every row appears at most once
+        pending = np.arange(len(rows))
+        while len(pending):
+            _, first = np.unique(rows[pending], return_index=True)
+            current = pending[first]
+            pending = np.setdiff1d(pending, current, assume_unique=True)
+            stale = (self._fixes[rows[current]] > 0) & (times[current] < self._state[rows[current], _TIME])
+            if stale.any():
+                self.stale += int(stale.sum())
+                current = current[~stale]
+            self._update_rows(rows[current], positions[current], times[current])
+            out_positions[current] = self._state[rows[current], _POS]
+            out_velocities[current] = self._state[rows[current], _VEL]
+
+        return out_positions, out_velocities
+
+    def update(self, tag, position, t):
+        """
+        This function filters a single fix and returns (position, velocity).
+        """
+        positions, velocities = self.update_many([tag], [position], [t])
+        return positions[0], velocities[0]
+
+    def fixes(self, tag):
+        """
+        This function returns how many fixes a tag has received.
+        """
+        row = self._rows.get(tag)
+        return 0 if row is None else int(self._fixes[row])
+
+    def snapshot(self):
+        """
+        This function returns a copy of the state of every tag, as
+        {"tags": [...], "state": (N, 10) array, "fixes": (N,) array}, for
+        restore().
+        """
+        # Copy the rows first: a tag added meanwhile only grows the arrays
+        rows = dict(self._rows)
+        tags = list(rows)
+        index = np.fromiter(rows.values(), dtype=np.int64, count=len(rows))
+        return {"tags": tags, "state": self._state[index], "fixes": self._fixes[index]}
+
+    def restore(self, snapshot, keep=None):
+        """
+        This function loads the tags of a snapshot() into the tracker,
+        replacing their current state. keep(tag) can select which tags to load.
+        """
+        for i, tag in enumerate(snapshot["tags"]):
+            if keep is not None and not keep(tag):
+                continue
+            row = self._row(tag)
+            self._state[row] = snapshot["state"][i]
+            self._fixes[row] = snapshot["fixes"][i]
+
+    def _update_rows(self, rows, z, times):
+        state = self._state[rows]
+        r = self.measurement_noise
+        new = self._fixes[rows] == 0
+
+        # Predict each row forward to the time of its fix
+        dt = np.maximum(times - state[:, _TIME], 0.0)
+        q = self.process_noise
+        pos = state[:, _POS] + state[:, _VEL] * dt[:, None]
+        vel = state[:, _VEL]
+        p00 = state[:, _P00] + 2.0 * dt * state[:, _P01] + dt * dt * state[:, _P11] + q * dt ** 3 / 3.0
+        p01 = state[:, _P01] + dt * state[:, _P11] + q * dt * dt / 2.0
+        p11 = state[:, _P11] + q * dt
+
+        # Measurement update with the new fix
+        s = p00 + r
+        k0 = p00 / s
+        k1 = p01 / s
+        innovation = z - pos
+        pos = pos + k0[:, None] * innovation
+        vel = vel + k1[:, None] * innovation
+        p11 = p11 - k1 * p01
+        p00 = (1.0 - k0) * p00
+        p01 = (1.0 - k0) * p01
+
+        # A tag's first fix starts the filter at rest at that position
+        pos[new] = z[new]
+        vel[new] = 0.0
+        p00[new] = r
+        p01[new] = 0.0
+        p11[new] = self.initial_velocity_variance
+
+        state[:, _POS] = pos
+        state[:, _VEL] = vel
+        state[:, _P00] = p00
+        state[:, _P01] = p01
+        state[:, _P11] = p11
+        state[:, _TIME] = times
+        self._state[rows] = state
+        self._fixes[rows] += 1
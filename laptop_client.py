@@ -4,6 +4,13 @@
 
 import paho.mqtt.client as mqtt
 import json
+import sys
+import threading
+import time
+
+import latency_tracing
+import position_codec
+import rate_scheduler
 
 # --- MQTT Broker Configuration ---
 # This must be the same broker address as the other programs
@@ -14,6 +21,94 @@ broker_port = 1883
 # This client only needs to subscribe to the final position topic
 position_topic = "home/position"
 
+# --- Latency Tracing ---
+# When the master traces positions, show the p50/p99 latency of every stage
+# from node sample to this client every latency_report_interval seconds
+enable_tracing = False
+latency_report_interval = 10.0
+tracer = latency_tracing.HopTracer(latency_report_interval)
+
+# --- Display Configuration ---
+# Printing every message falls behind when many tags report at high rates.
+# In coalescing mode only the latest position of each tag is kept, and a
+# table of all tags is redrawn display_refresh_hz times per second, so the
+# cost of the display depends on the refresh rate, not the message rate.
+coalesce_display = False
+display_refresh_hz = 4.0
+
+# --- Coalescing Display ---
+class CoalescingDisplay:
+    """
+    This class keeps the latest position message of every tag and draws them
+    as one table.
+
+    update() is called from the MQTT callback and only replaces the tag's
+    entry. An update that is replaced before the next redraw was never shown;
+    those are counted as dropped.
+    """
+
+    def __init__(self):
+        self.latest = {}
+        self.received = 0
+        self.dropped = 0
+        self._fresh = set()
+        self._lock = threading.Lock()
+
+    def update(self, data):
+        """
+        This function stores one position message as the latest of its tag.
+        """
+        tag = data.get("uuid", "N/A")
+        with self._lock:
+            self.latest[tag] = (data, time.time())
+            self.received += 1
+            if tag in self._fresh:
+                self.dropped += 1
+            else:
+                self._fresh.add(tag)
+
+    def render(self):
+        """
+        This function returns the table of all tags as a string.
+        """
+        with self._lock:
+            rows = sorted(self.latest.items())
+            received, dropped = self.received, self.dropped
+            self._fresh.clear()
+        
+        now = time.time()
+        lines = [
+            f"Positions of {len(rows)} tags   (messages: {received}, dropped: {dropped})",
+            f"{'Tag':<38} {'Session':>10} {'X':>8} {'Y':>8} {'Z':>8} {'Filtered X,Y,Z':>24} {'Age (s)':>8}",
+            "-" * 110,
+        ]
+        for tag, (data, received_at) in rows:
+            position = data.get("calculated_position", {})
+            filtered = data.get("filtered_position")
+            filtered_text = "" if filtered is None else f"{filtered['x']},{filtered['y']},{filtered['z']}"
+            lines.append(
+                f"{str(tag):<38} {str(data.get('session_id', 'N/A')):>10} "
+                f"{str(position.get('x', 'N/A')):>8} {str(position.get('y', 'N/A')):>8} "
+                f"{str(position.get('z', 'N/A')):>8} {filtered_text:>24} {now - received_at:>8.1f}")
+        if enable_tracing:
+            lines.append("")
+            lines.append("Latency per stage:")
+            lines.append(tracer.format_summary())
+        return "\n".join(lines)
+
+    def redraw(self):
+        """
+        This function clears the terminal and draws the table in one write.
+        """
+        sys.stdout.write("\033[H\033[2J" + self.render() + "\n")
+        sys.stdout.flush()
+
+# Created in main() when coalesce_display is on
+display = None
+
+# Decodes the compact position encodings of the master (position_encoding)
+decoder = position_codec.PositionDecoder()
+
 # --- MQTT Callback Functions ---
 def on_connect(client, userdata, flags, rc):
     """
@@ -32,9 +127,22 @@ def on_message(client, userdata, msg):
     Callback function for when a message is received on the subscribed topic.
     """
     try:
-        # Decode the message payload and parse it as JSON
-        message_json = msg.payload.decode()
-        data = json.loads(message_json)
+        # Decode the message payload and parse it as JSON. A delta-encoded
+        # position can only be decoded after the tag's next key frame.
+        data = decoder.decode(msg.payload)
+        if data is None:
+            return
+        
+        # Complete the trace with the time this client received the position
+        trace = data.get("trace")
+        if enable_tracing and trace is not None:
+            trace["client_received"] = time.time()
+            tracer.record(trace)
+        
+        # In coalescing mode the table is drawn by the main loop instead
+        if display is not None:
+            display.update(data)
+            return
         
         # Extract and print the key information from the JSON message
         tracked_device = data.get("uuid", "N/A")
@@ -46,7 +154,18 @@ def on_message(client, userdata, msg):
         print(f"Tracked Device UUID: {tracked_device}")
         print(f"Session ID: {session}")
         print(f"Calculated Position: X={position['x']}, Y={position['y']}, Z={position['z']}")
+        # The master adds the Kalman-filtered position and velocity when tracking is on
+        if "filtered_position" in data:
+            filtered = data["filtered_position"]
+            velocity = data.get("velocity", {"x": "N/A", "y": "N/A", "z": "N/A"})
+            print(f"Filtered Position: X={filtered['x']}, Y={filtered['y']}, Z={filtered['z']}")
+            print(f"Velocity (m/s): X={velocity['x']}, Y={velocity['y']}, Z={velocity['z']}")
         print("-" * 40)
+        
+        if enable_tracing and tracer.due():
+            print("Latency per stage:")
+            print(tracer.format_summary())
+            print("-" * 40)
             
     except json.JSONDecodeError:
         print("Error decoding JSON from message.")
@@ -58,6 +177,8 @@ def main():
     """
     Initializes the MQTT client and starts the message loop.
     """
+    global display
+    
     client = mqtt.Client()
     client.on_connect = on_connect
     client.on_message = on_message
@@ -65,12 +186,23 @@ def main():
     try:
         client.connect(broker_address, broker_port, 60)
         
-        # Start a loop to listen for incoming messages indefinitely
-        client.loop_forever()
+        if coalesce_display:
+            # Receive messages in the background and redraw the table at a
+            # fixed rate from this thread
+            display = CoalescingDisplay()
+            client.loop_start()
+            scheduler = rate_scheduler.RateScheduler(display_refresh_hz, align=False)
+            while True:
+                scheduler.wait()
+                display.redraw()
+        else:
+            # Start a loop to listen for incoming messages indefinitely
+            client.loop_forever()
         
     except KeyboardInterrupt:
         print("Exiting...")
     finally:
+        client.loop_stop()
         client.disconnect()
 
 if __name__ == "__main__":
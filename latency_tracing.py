@@ -0,0 +1,178 @@
+# latency_tracing.py
+# This module measures where time goes between a node taking a sample and a
+# client printing the position calculated from it.
+#
+# When tracing is enabled every program adds a timestamp at its hop:
+#   sampled            node, when get_uwb_data() produced the sample
+#   published          node, when the sample (or its batch) was published
+#   received           master, when the message arrived
+#   solved             master, when the position was calculated
+#   position_published master, when the position was published
+#   client_received    client, when the position arrived
+# The time between two consecutive timestamps is one stage. Stages that
+# cross machines include their clock offset, so keep the clocks in sync (NTP).
+
+import json
+import math
+import threading
+import time
+
+# --- Stages ---
+TRACE_POINTS = ["sampled", "published", "received", "solved", "position_published", "client_received"]
+STAGES = [f"{a}->{b}" for a, b in zip(TRACE_POINTS, TRACE_POINTS[1:])]
+
+
+# --- Histogram ---
+class LatencyHistogram:
+    """
+    This class counts latencies in HDR-style log-linear buckets.
+
+    Values are stored in microseconds. Every power of two is split into
+    sub_buckets linear buckets, so a percentile read back from the histogram
+    is within 1/sub_buckets of the true value whatever its size. Recording is
+    O(1) and the memory used only grows with the number of distinct buckets.
+    """
+
+    def __init__(self, sub_buckets=16):
+        self.sub_buckets = sub_buckets
+        self.counts = {}
+        self.total = 0
+        self.max_us = 0.0
+
+    def _bucket(self, value_us):
+        if value_us < self.sub_buckets:
+            return int(value_us)
+        mantissa, exponent = math.frexp(value_us)
+        # mantissa is in [0.5, 1): map it to a sub-bucket of this power of two
+        return exponent * self.sub_buckets + int((mantissa * 2 - 1) * self.sub_buckets)
+
+    def _bucket_value(self, bucket):
+        # Upper edge of the bucket, in microseconds
+        if bucket < self.sub_buckets:
+            return float(bucket + 1)
+        exponent, sub = divmod(bucket, self.sub_buckets)
+        return math.ldexp(1 + (sub + 1) / self.sub_buckets, exponent - 1)
+
+    def record(self, seconds):
+        """
+        This function adds one latency, in seconds. Negative values (from
+        clock offsets between machines) are counted as zero.
+        """
+        value_us = max(seconds * 1e6, 0.0)
+        bucket = self._bucket(value_us)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+        if value_us > self.max_us:
+            self.max_us = value_us
+
+    def percentile(self, p):
+        """
+        This function returns the p-th percentile (0-100) in milliseconds,
+        or NaN if nothing was recorded.
+        """
+        if not self.total:
+            return math.nan
+        target = self.total * p / 100.0
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return min(self._bucket_value(bucket), self.max_us) / 1000.0
+        return self.max_us / 1000.0
+
+    def merge(self, other):
+        """
+        This function adds the counts of another histogram to this one.
+        """
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += other.total
+        self.max_us = max(self.max_us, other.max_us)
+
+    def to_dict(self):
+        return {"sub_buckets": self.sub_buckets, "total": self.total,
+                "max_us": self.max_us, "counts": self.counts}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data["sub_buckets"])
+        histogram.counts = {int(bucket): count for bucket, count in data["counts"].items()}
+        histogram.total = data["total"]
+        histogram.max_us = data["max_us"]
+        return histogram
+
+
+# --- Tracer ---
+class HopTracer:
+    """
+    This class keeps one LatencyHistogram per stage and decides when the
+    collected histograms should be published.
+
+    The MQTT network thread records traces while other threads read the
+    summary, so all methods are thread-safe.
+    """
+
+    def __init__(self, publish_interval=10.0):
+        self.publish_interval = publish_interval
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self._next_publish = time.monotonic() + publish_interval
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        """
+        This function records every stage for which both ends are present in
+        a trace dictionary (trace point name -> epoch seconds).
+        """
+        with self._lock:
+            for start, end, stage in zip(TRACE_POINTS, TRACE_POINTS[1:], STAGES):
+                a = trace.get(start)
+                b = trace.get(end)
+                if a is not None and b is not None:
+                    self.histograms[stage].record(b - a)
+
+    def due(self):
+        """
+        This function returns True once every publish_interval seconds.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_publish:
+                return False
+            self._next_publish = now + self.publish_interval
+            return True
+
+    def summary(self):
+        """
+        This function returns {stage: {"count", "p50_ms", "p99_ms"}} for every
+        stage that has data.
+        """
+        with self._lock:
+            return self._summary()
+
+    def _summary(self):
+        return {
+            stage: {"count": h.total, "p50_ms": h.percentile(50), "p99_ms": h.percentile(99)}
+            for stage, h in self.histograms.items() if h.total
+        }
+
+    def to_json(self):
+        """
+        This function returns the histograms and their summary as JSON for
+        the metrics topic.
+        """
+        with self._lock:
+            data = {
+                "time": time.time(),
+                "summary": self._summary(),
+                "histograms": {stage: h.to_dict() for stage, h in self.histograms.items() if h.total},
+            }
+        return json.dumps(data)
+
+    def format_summary(self):
+        """
+        This function returns the summary as printable lines.
+        """
+        lines = []
+        for stage, s in self.summary().items():
+            lines.append(f"{stage:<40} n={s['count']:<8} p50={s['p50_ms']:.2f} ms  p99={s['p99_ms']:.2f} ms")
+        return "\n".join(lines)
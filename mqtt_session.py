@@ -0,0 +1,128 @@
+# mqtt_session.py
+# This module keeps the master connected to the broker.
+#
+# paho's loop_start() reconnects after a fixed delay that only grows, so
+# after a short broker blip the master can sit idle for seconds, and when a
+# broker restarts every client comes back at the same moment. Here the
+# network loop runs in its own thread that reconnects with "full jitter"
+# exponential backoff: the first attempt follows within a few milliseconds,
+# each failed attempt doubles the limit of the random delay up to max_delay,
+# and the delays of different clients are spread over that whole range.
+#
+# Together with a persistent session (a fixed client id and
+# clean_session=False) and QoS 1 subscriptions, the broker keeps the messages
+# that arrive while the master is away and delivers them as soon as it is
+# back, on the subscriptions it already had.
+
+import random
+import threading
+
+import paho.mqtt.client as mqtt
+
+
+def make_client(client_id, persistent=True):
+    """
+    This function creates an MQTT client. With persistent the broker keeps
+    its session (subscriptions and queued QoS 1 messages) while it is
+    disconnected; client_id must then stay the same across restarts and be
+    unique per broker.
+    """
+    return mqtt.Client(client_id=client_id, clean_session=not persistent)
+
+
+# --- Backoff ---
+class Backoff:
+    """
+    This class returns the delays between reconnect attempts: a random delay
+    between 0 and initial_delay * multiplier ** attempts, at most max_delay.
+    reset() starts over after a successful connection.
+    """
+
+    def __init__(self, initial_delay=0.05, max_delay=30.0, multiplier=2.0):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.attempts = 0
+
+    def next(self):
+        limit = min(self.max_delay, self.initial_delay * self.multiplier ** self.attempts)
+        self.attempts += 1
+        return random.uniform(0.0, limit)
+
+    def reset(self):
+        self.attempts = 0
+
+
+# --- Network Loop ---
+class ReconnectingLoop:
+    """
+    This class runs the network loop of a client in a background thread, in
+    place of loop_start() and loop_stop(), and reconnects with Backoff delays
+    whenever the connection is lost or cannot be made.
+
+    Set up the client with connect_async() (or connect()) before start(); the
+    first connection is made by the thread.
+    """
+
+    def __init__(self, client, initial_delay=0.05, max_delay=30.0):
+        self.client = client
+        self.backoff = Backoff(initial_delay, max_delay)
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Counters for monitoring
+        self.connects = 0
+        self.failures = 0
+
+    def start(self):
+        """
+        This function starts the network thread.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="mqtt-network", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        This function stops the network thread. Call the client's disconnect()
+        afterwards for a clean disconnect.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                rc = self.client.reconnect()
+            except OSError as e:
+                # Broker unreachable or refusing connections
+                print(f"Could not connect to the MQTT broker: {e}")
+                rc = None
+
+            if rc == mqtt.MQTT_ERR_SUCCESS:
+                # Serve the connection until it drops. The backoff starts over
+                # once the broker accepted us (on_connect saw rc 0).
+                accepted = False
+                while not self._stop.is_set():
+                    rc = self.client.loop(timeout=1.0)
+                    if rc != mqtt.MQTT_ERR_SUCCESS:
+                        break
+                    if not accepted and self.client.is_connected():
+                        accepted = True
+                        self.connects += 1
+                        self.backoff.reset()
+                if self._stop.is_set():
+                    break
+
+            self.failures += 1
+            delay = self.backoff.next()
+            print(f"Reconnecting to the MQTT broker in {delay * 1000:.0f} ms")
+            self._stop.wait(delay)
+
+    def stats(self):
+        """
+        This function returns the counters as a printable line.
+        """
+        return f"MQTT: {self.connects} connections, {self.failures} disconnects or failed attempts"
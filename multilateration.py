@@ -0,0 +1,529 @@
+# multilateration.py
+# This module holds the localization math used by the master programs.
+# It turns anchor positions plus measured ranges into tag positions, and it
+# works on whole batches of fixes at once so the master never loops in Python
+# over individual fixes.
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# --- Solver Configuration ---
+# A fix needs at least this many ranged anchors. With exactly 3 anchors (or
+# with all anchors at the same height) the vertical axis cannot be observed,
+# and the solver returns the point in the anchor plane.
+min_anchors = 3
+
+
+# --- Batched Linear Least-Squares Solver ---
+def solve_positions(anchors, ranges, mask=None):
+    """
+    This function solves many multilateration problems in one call.
+
+    For every fix b and anchor i the range equation is
+        |p_b - a_bi|^2 = r_bi^2
+    Moving the origin to the centroid of the anchors and subtracting the mean
+    equation removes the quadratic |p_b|^2 term, which leaves a small linear
+    system per fix. All of those systems are built and solved together with
+    array operations.
+
+    anchors: array of shape (B, N, 3) with the anchor positions of each fix.
+    ranges:  array of shape (B, N) with the measured ranges in metres.
+    mask:    optional boolean array of shape (B, N). False marks an anchor
+             that did not report for that fix; its row is ignored.
+
+    Returns a tuple (positions, residuals) where positions has shape (B, 3)
+    and residuals has shape (B,) holding the RMS range error of each fix.
+    Fixes with fewer than min_anchors valid anchors come back as NaN.
+    """
+    anchors = np.asarray(anchors, dtype=np.float64)
+    ranges = np.asarray(ranges, dtype=np.float64)
+    if mask is None:
+        mask = np.isfinite(ranges)
+    else:
+        mask = np.asarray(mask, dtype=bool) & np.isfinite(ranges)
+
+    weights = mask.astype(np.float64)
+    counts = weights.sum(axis=1)
+    safe_counts = np.maximum(counts, 1.0)
+    # Zero out missing rows so NaNs never leak into the sums below
+    ranges = np.where(mask, ranges, 0.0)
+    anchors = np.where(mask[..., None], anchors, 0.0)
+
+    # Centre each fix on the centroid of its reporting anchors
+    centroid = (anchors * weights[..., None]).sum(axis=1) / safe_counts[:, None]
+    offsets = (anchors - centroid[:, None, :]) * weights[..., None]
+
+    range_sq = ranges ** 2
+    offset_sq = (offsets ** 2).sum(axis=2)
+    mean_range_sq = (range_sq * weights).sum(axis=1) / safe_counts
+    mean_offset_sq = (offset_sq * weights).sum(axis=1) / safe_counts
+
+    # Linear system A q = b with A = -2 * offsets and q = p - centroid
+    a = -2.0 * offsets
+    b = (range_sq - mean_range_sq[:, None]) - (offset_sq - mean_offset_sq[:, None])
+    b = b * weights
+
+    # Normal equations for the whole batch, solved with a pseudo-inverse so
+    # that flat anchor layouts still give the in-plane solution
+    ata = np.einsum("bni,bnj->bij", a, a)
+    atb = np.einsum("bni,bn->bi", a, b)
+    q = np.einsum("bij,bj->bi", np.linalg.pinv(ata), atb)
+    positions = q + centroid
+
+    # RMS difference between the measured and the solved ranges
+    solved = np.linalg.norm(positions[:, None, :] - anchors, axis=2)
+    errors = (solved - ranges) * weights
+    residuals = np.sqrt((errors ** 2).sum(axis=1) / safe_counts)
+
+    invalid = counts < min_anchors
+    positions[invalid] = np.nan
+    residuals[invalid] = np.nan
+    return positions, residuals
+
+
+def solve_position(anchors, ranges):
+    """
+    This function is a convenience wrapper around solve_positions for a
+    single fix.
+
+    anchors is a sequence of N (x, y, z) positions and ranges a sequence of
+    N ranges. Returns a tuple ((x, y, z), residual).
+    """
+    positions, residuals = solve_positions(
+        np.asarray(anchors, dtype=np.float64)[None, ...],
+        np.asarray(ranges, dtype=np.float64)[None, ...],
+    )
+    return tuple(float(v) for v in positions[0]), float(residuals[0])
+
+
+# --- Nonlinear Refinement ---
+def refine_positions(anchors, ranges, initial, mask=None, tolerance=1e-3, max_iterations=10, damping=1e-3):
+    """
+    This function refines many fixes with Levenberg-Marquardt iterations on
+    the range errors |p_b - a_bi| - r_bi.
+
+    The linear solve of solve_positions squares the ranges, which weights the
+    far anchors more and biases the fix when ranges are noisy. This minimises
+    the actual range errors instead. Every iteration linearises the range of
+    each anchor around the current position and solves the damped 3x3 normal
+    equations of all active fixes together. A step that lowers the error is
+    taken and the damping reduced; otherwise the damping grows and the fix
+    stays put, so the error never increases. A fix stops as soon as its step
+    is shorter than tolerance metres.
+
+    anchors, ranges and mask are as for solve_positions, and initial is the
+    (B, 3) array of starting positions.
+
+    Returns a tuple (positions, residuals, iterations, converged) with the
+    (B, 3) positions, the (B,) RMS range errors, the (B,) number of
+    iterations each fix took and a (B,) boolean array that is False for the
+    fixes that did not converge within max_iterations.
+    """
+    anchors = np.asarray(anchors, dtype=np.float64)
+    ranges = np.asarray(ranges, dtype=np.float64)
+    if mask is None:
+        mask = np.isfinite(ranges)
+    else:
+        mask = np.asarray(mask, dtype=bool) & np.isfinite(ranges)
+    weights = mask.astype(np.float64)
+    counts = np.maximum(weights.sum(axis=1), 1.0)
+    ranges = np.where(mask, ranges, 0.0)
+    anchors = np.where(mask[..., None], anchors, 0.0)
+
+    def errors(positions, rows):
+        # Range errors and unit vectors from the anchors to the positions
+        deltas = positions[:, None, :] - anchors[rows]
+        distances = np.maximum(np.linalg.norm(deltas, axis=2), 1e-9)
+        return (distances - ranges[rows]) * weights[rows], deltas / distances[..., None]
+
+    positions = np.array(initial, dtype=np.float64)
+    count = len(positions)
+    iterations = np.zeros(count, dtype=np.int64)
+    converged = np.zeros(count, dtype=bool)
+    lambdas = np.full(count, damping)
+    active = np.flatnonzero(np.isfinite(positions).all(axis=1))
+
+    for _ in range(max_iterations):
+        if not len(active):
+            break
+        current = positions[active]
+        residual, units = errors(current, active)
+        cost = (residual ** 2).sum(axis=1)
+
+        # Damped normal equations (J^T J + lambda I) step = J^T e per fix
+        jacobian = units * weights[active][..., None]
+        jtj = np.einsum("bni,bnj->bij", jacobian, jacobian)
+        jte = np.einsum("bni,bn->bi", jacobian, residual)
+        scale = np.maximum(np.trace(jtj, axis1=1, axis2=2), 1.0)
+        jtj += (lambdas[active] * scale)[:, None, None] * np.eye(3)
+        step = np.linalg.solve(jtj, jte[..., None])[..., 0]
+
+        candidate = current - step
+        new_residual, _ = errors(candidate, active)
+        better = (new_residual ** 2).sum(axis=1) <= cost
+        positions[active] = np.where(better[:, None], candidate, current)
+        lambdas[active] = np.where(better, lambdas[active] * 0.1, lambdas[active] * 10.0)
+        iterations[active] += 1
+
+        done = np.linalg.norm(step, axis=1) < tolerance
+        converged[active[done]] = True
+        active = active[~done]
+
+    residual, _ = errors(positions, np.arange(count))
+    residuals = np.sqrt((residual ** 2).sum(axis=1) / counts)
+    converged &= np.isfinite(positions).all(axis=1)
+    return positions, residuals, iterations, converged
+
+
+# --- Anchor Geometry Cache ---
+class GeometryCache:
+    """
+    This class keeps the precomputed solver matrices of anchor sets.
+
+    The anchors are fixed, so everything in the linear system except the
+    ranges depends only on which anchors took part in a fix. For one set of
+    anchors with centroid c, offsets o_i = a_i - c and A = -2 [o_i] the
+    solution of solve_positions is
+        p = pinv(A) r^2 + (c - pinv(A) (|o|^2 - mean |o|^2))
+    (the mean range term drops out because the columns of A sum to zero), so
+    a cached set turns every fix into one matrix-vector product.
+
+    Sets are keyed by the sorted tuple of node keys and evicted least
+    recently used once more than capacity sets are cached. Call invalidate()
+    whenever anchor positions change.
+    """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self._sets = OrderedDict()
+        # Anchor tables of node sets, for pack_round_arrays
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, keys, anchor_positions):
+        """
+        This function returns (matrix, offset, anchors) for a sorted tuple of
+        node keys: the (3, N) pseudo-inverse, the (3,) constant term and the
+        (N, 3) anchor positions. Positions are then
+            ranges ** 2 @ matrix.T + offset
+        """
+        with self._lock:
+            geometry = self._sets.get(keys)
+            if geometry is not None:
+                self._sets.move_to_end(keys)
+                self.hits += 1
+                return geometry
+            self.misses += 1
+
+        anchors = np.array([anchor_positions[key] for key in keys], dtype=np.float64)
+        centroid = anchors.mean(axis=0)
+        offsets = anchors - centroid
+        offset_sq = (offsets ** 2).sum(axis=1)
+        matrix = np.linalg.pinv(-2.0 * offsets)
+        offset = centroid - matrix @ (offset_sq - offset_sq.mean())
+        geometry = (matrix, offset, anchors)
+
+        with self._lock:
+            self._sets[keys] = geometry
+            while len(self._sets) > self.capacity:
+                self._sets.popitem(last=False)
+                self.evictions += 1
+        return geometry
+
+    def anchor_table(self, nodes, anchor_positions):
+        """
+        This function returns the (N, 3) anchor positions of a tuple of node
+        keys, NaN for nodes without a surveyed anchor.
+        """
+        with self._lock:
+            table = self._tables.get(nodes)
+            if table is not None:
+                self._tables.move_to_end(nodes)
+                return table
+        table = _anchor_table(nodes, anchor_positions)
+        with self._lock:
+            self._tables[nodes] = table
+            while len(self._tables) > self.capacity:
+                self._tables.popitem(last=False)
+        return table
+
+    def invalidate(self):
+        """
+        This function forgets every cached anchor set.
+        """
+        with self._lock:
+            self._sets.clear()
+            self._tables.clear()
+
+    def __len__(self):
+        return len(self._sets)
+
+
+# --- Helpers for the Master Programs ---
+def solve_rounds(rounds, anchor_positions, cache=None):
+    """
+    This function computes one position per round of node reports.
+
+    rounds is a list of dictionaries, each mapping a node key to the sample
+    that node reported ({"xyz": {...}, "range": r, ...}). anchor_positions maps
+    the same node keys to the surveyed (x, y, z) position of that anchor.
+
+    Rounds with enough ranged, surveyed anchors are solved together in a single
+    solve_positions call. Any other round falls back to the average of the
+    reported XYZ values, which is what the masters did before ranges existed.
+
+    With a GeometryCache, rounds are grouped by their set of anchors and
+    every group is solved with the cached matrices of that set instead.
+
+    Returns a tuple (positions, residuals) shaped (len(rounds), 3) and
+    (len(rounds),). Residuals are NaN for rounds that used the fallback.
+    """
+    if cache is not None:
+        return _solve_rounds_cached(rounds, anchor_positions, cache)
+
+    return _solve_packed(*_pack_rounds(rounds, anchor_positions))
+
+
+def _solve_packed(anchors, ranges, reported):
+    positions, residuals = solve_positions(anchors, ranges)
+
+    # Rounds without usable ranges get the plain average of the reported XYZ
+    fallback = np.isnan(positions[:, 0])
+    if fallback.any():
+        positions[fallback] = np.nanmean(reported[fallback], axis=1)
+    return positions, residuals
+
+
+def _pack_rounds(rounds, anchor_positions):
+    # (B, N, 3) anchors, (B, N) ranges (NaN where unusable) and (B, N, 3)
+    # reported XYZ values of a list of rounds
+    count = len(rounds)
+    width = max((len(r) for r in rounds), default=0)
+    anchors = np.zeros((count, width, 3))
+    ranges = np.full((count, width), np.nan)
+    reported = np.full((count, width, 3), np.nan)
+
+    for b, round_data in enumerate(rounds):
+        for i, (node_key, sample) in enumerate(round_data.items()):
+            xyz = sample['xyz']
+            reported[b, i] = (xyz['x'], xyz['y'], xyz['z'])
+            anchor = anchor_positions.get(node_key)
+            if anchor is not None and sample.get('range') is not None:
+                anchors[b, i] = anchor
+                ranges[b, i] = sample['range']
+    return anchors, ranges, reported
+
+
+def refine_rounds(rounds, anchor_positions, previous, cache=None, tolerance=1e-3,
+                  max_iterations=10, max_residual=0.5):
+    """
+    This function computes one refined position per round, warm-started from
+    the previous fix of each round's tag.
+
+    previous is a (len(rounds), 3) array holding the previous fix of each
+    round's tag, NaN for tags without one. Those rounds are refined straight
+    from the previous fix (see refine_positions), which for a tracked tag is
+    already close, so they usually converge in one or two iterations and
+    skip the linear solve. A warm start that does not converge, or that ends
+    with an RMS range error above max_residual metres (the tag moved too far,
+    e.g. after a long gap), counts as diverged. Diverged rounds and rounds
+    without a previous fix are solved cold with solve_rounds and refined
+    from the linear solution.
+
+    Returns a tuple (positions, residuals, iterations) shaped (len(rounds), 3),
+    (len(rounds),) and (len(rounds),). iterations counts the iterations of
+    both attempts; rounds that used the XYZ average have 0 iterations and a
+    NaN residual.
+    """
+    anchors, ranges, _ = _pack_rounds(rounds, anchor_positions)
+
+    def linear(indices):
+        return solve_rounds([rounds[b] for b in indices], anchor_positions, cache)[0]
+
+    return _refine_packed(anchors, ranges, previous, linear, tolerance, max_iterations, max_residual)
+
+
+def _refine_packed(anchors, ranges, previous, linear, tolerance, max_iterations, max_residual):
+    # Warm refinement of the packed rounds with a previous fix, then a cold
+    # refinement from linear(indices) of the rest (see refine_rounds)
+    count = len(ranges)
+    solvable = np.isfinite(ranges).sum(axis=1) >= min_anchors
+    positions = np.full((count, 3), np.nan)
+    residuals = np.full(count, np.nan)
+    iterations = np.zeros(count, dtype=np.int64)
+
+    warm = np.flatnonzero(solvable & np.isfinite(previous).all(axis=1))
+    done = np.zeros(count, dtype=bool)
+    if len(warm):
+        solved, errors, steps, converged = refine_positions(
+            anchors[warm], ranges[warm], previous[warm], None, tolerance, max_iterations)
+        ok = converged & (errors <= max_residual)
+        positions[warm[ok]] = solved[ok]
+        residuals[warm[ok]] = errors[ok]
+        iterations[warm] = steps
+        done[warm[ok]] = True
+
+    cold = np.flatnonzero(~done)
+    if len(cold):
+        positions[cold] = linear(cold)
+        refine = cold[solvable[cold]]
+        if len(refine):
+            solved, errors, steps, _ = refine_positions(
+                anchors[refine], ranges[refine], positions[refine], None, tolerance, max_iterations)
+            positions[refine] = solved
+            residuals[refine] = errors
+            iterations[refine] += steps
+    return positions, residuals, iterations
+
+
+def _solve_rounds_cached(rounds, anchor_positions, cache):
+    count = len(rounds)
+    positions = np.full((count, 3), np.nan)
+    residuals = np.full(count, np.nan)
+
+    # Group the rounds by the anchors that ranged in them
+    groups = {}
+    fallback = []
+    for b, round_data in enumerate(rounds):
+        keys = tuple(sorted(
+            key for key, sample in round_data.items()
+            if sample.get('range') is not None and key in anchor_positions))
+        if len(keys) < min_anchors:
+            fallback.append(b)
+        else:
+            groups.setdefault(keys, []).append(b)
+
+    for keys, members in groups.items():
+        matrix, offset, anchors = cache.get(keys, anchor_positions)
+        ranges = np.array([[rounds[b][key]['range'] for key in keys] for b in members], dtype=np.float64)
+        solved = (ranges ** 2) @ matrix.T + offset
+        errors = np.linalg.norm(solved[:, None, :] - anchors, axis=2) - ranges
+        positions[members] = solved
+        residuals[members] = np.sqrt((errors ** 2).mean(axis=1))
+
+    # Rounds without usable ranges get the plain average of the reported XYZ
+    for b in fallback:
+        reported = [(s['xyz']['x'], s['xyz']['y'], s['xyz']['z']) for s in rounds[b].values()]
+        positions[b] = np.nanmean(np.array(reported, dtype=np.float64), axis=0)
+    return positions, residuals
+
+
+# --- Array Rounds ---
+def pack_round_arrays(fused_rounds, anchor_positions, cache=None):
+    """
+    This function stacks rounds from round_buffer.RoundBuffer into the
+    (B, N, 3) anchors, (B, N) ranges and (B, N, 3) reported XYZ arrays of
+    solve_positions. Ranges of nodes without a surveyed anchor are NaN.
+    With a GeometryCache the anchor table of every set of nodes is cached.
+    """
+    count = len(fused_rounds)
+    sizes = [len(fused_round["nodes"]) for fused_round in fused_rounds]
+    width = max(sizes, default=0)
+    known = {}
+    tables = []
+    for fused_round in fused_rounds:
+        nodes = fused_round["nodes"]
+        table = known.get(nodes)
+        if table is None:
+            if cache is not None:
+                table = known[nodes] = cache.anchor_table(nodes, anchor_positions)
+            else:
+                table = known[nodes] = _anchor_table(nodes, anchor_positions)
+        tables.append(table)
+
+    if count and min(sizes) == width:
+        # Usually every round has the same number of nodes: stack them at once
+        anchors = np.array(tables)
+        ranges = np.array([fused_round["ranges"] for fused_round in fused_rounds])
+        reported = np.array([fused_round["xyz"] for fused_round in fused_rounds])
+    else:
+        anchors = np.full((count, width, 3), np.nan)
+        ranges = np.full((count, width), np.nan)
+        reported = np.full((count, width, 3), np.nan)
+        for b, fused_round in enumerate(fused_rounds):
+            size = sizes[b]
+            anchors[b, :size] = tables[b]
+            ranges[b, :size] = fused_round["ranges"]
+            reported[b, :size] = fused_round["xyz"]
+
+    unknown = np.isnan(anchors[..., 0])
+    ranges[unknown] = np.nan
+    anchors[unknown] = 0.0
+    return anchors, ranges, reported
+
+
+def _anchor_table(nodes, anchor_positions):
+    # (N, 3) positions of the nodes' anchors, NaN for nodes without one
+    missing = (np.nan, np.nan, np.nan)
+    return np.array([anchor_positions.get(node, missing) for node in nodes], dtype=np.float64).reshape(-1, 3)
+
+
+def solve_round_arrays(fused_rounds, anchor_positions, cache=None):
+    """
+    This function is solve_rounds for rounds from round_buffer.RoundBuffer,
+    which hold their samples as arrays. Without a GeometryCache all rounds
+    are solved in one solve_positions call; with one, rounds are grouped by
+    their set of anchors as in solve_rounds, so both paths give the same fixes.
+    """
+    anchors, ranges, reported = pack_round_arrays(fused_rounds, anchor_positions, cache)
+    if cache is None:
+        return _solve_packed(anchors, ranges, reported)
+
+    count = len(fused_rounds)
+    positions = np.full((count, 3), np.nan)
+    residuals = np.full(count, np.nan)
+
+    # Group the rounds by the anchors that ranged in them, with the columns
+    # of those anchors in sorted key order. Rounds mostly repeat a few node
+    # orders, so the columns are worked out once per order and set of usable
+    # columns (as a bit mask).
+    masks = (np.isfinite(ranges) << np.arange(ranges.shape[1])).sum(axis=1).tolist()
+    plans = {}
+    groups = {}
+    fallback = []
+    for b, mask in enumerate(masks):
+        nodes = fused_rounds[b]["nodes"]
+        plan = plans.get((nodes, mask))
+        if plan is None:
+            columns = sorted((column for column in range(len(nodes)) if mask >> column & 1), key=nodes.__getitem__)
+            plan = plans[nodes, mask] = (tuple(nodes[column] for column in columns), columns)
+        keys, columns = plan
+        if len(columns) < min_anchors:
+            fallback.append(b)
+        else:
+            rows, group_columns = groups.setdefault(keys, ([], []))
+            rows.append(b)
+            group_columns.append(columns)
+
+    for keys, (rows, columns) in groups.items():
+        matrix, offset, table = cache.get(keys, anchor_positions)
+        group_ranges = ranges[np.array(rows)[:, None], np.array(columns)]
+        solved = (group_ranges ** 2) @ matrix.T + offset
+        errors = np.linalg.norm(solved[:, None, :] - table, axis=2) - group_ranges
+        positions[rows] = solved
+        residuals[rows] = np.sqrt((errors ** 2).mean(axis=1))
+
+    # Rounds without usable ranges get the plain average of the reported XYZ
+    if fallback:
+        positions[fallback] = np.nanmean(reported[fallback], axis=1)
+    return positions, residuals
+
+
+def refine_round_arrays(fused_rounds, anchor_positions, previous, cache=None, tolerance=1e-3,
+                        max_iterations=10, max_residual=0.5):
+    """
+    This function is refine_rounds for rounds from round_buffer.RoundBuffer.
+    """
+    anchors, ranges, _ = pack_round_arrays(fused_rounds, anchor_positions, cache)
+
+    def linear(indices):
+        return solve_round_arrays([fused_rounds[b] for b in indices], anchor_positions, cache)[0]
+
+    return _refine_packed(anchors, ranges, previous, linear, tolerance, max_iterations, max_residual)
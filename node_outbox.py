@@ -0,0 +1,132 @@
+# node_outbox.py
+# This module keeps a node's samples on disk while it cannot reach the broker.
+#
+# While paho is disconnected, a QoS 0 publish is simply dropped, and while the
+# connection is slow its in-memory queue grows without limit. Instead the node
+# stores every payload it cannot publish in a small sqlite file, bounded to a
+# number of samples (the oldest are dropped first), which also survives a
+# restart of the node. Once connected again the stored samples are merged
+# into batches and sent at a limited rate, next to the live samples, so the
+# backlog does not flood the broker and the master. The batches must stay
+# small next to the master's fusion capacity, or the master evicts a batch's
+# rounds before the other nodes' replayed samples of them arrive.
+
+import sqlite3
+import time
+
+import wire_codec
+
+
+# --- Outbox ---
+class NodeOutbox:
+    """
+    This class is a bounded first-in first-out queue of payloads on disk.
+
+    put() stores a payload that could not be published. drain() sends the
+    oldest stored samples through a publish function, batch_samples samples
+    per message, at most drain_rate samples per second on average (a token
+    bucket that holds up to one batch). Stored payloads of the same topic are
+    decoded and encoded again as one batch in the node's wire format.
+    """
+
+    def __init__(self, path, max_samples=100000, batch_samples=50, drain_rate=100.0,
+                 fmt=wire_codec.FORMAT_BINARY):
+        self.max_samples = max_samples
+        self.batch_samples = max(1, min(batch_samples, wire_codec.BATCH_MAX_SAMPLES))
+        self.drain_rate = drain_rate
+        self.fmt = fmt
+
+        # WAL with synchronous=NORMAL commits without waiting for the SD card.
+        # A power cut may lose the last commits, but never corrupts the file.
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS outbox ("
+                         "id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT, payload BLOB, samples INTEGER)")
+        self._db.commit()
+        (self._samples,) = self._db.execute("SELECT COALESCE(SUM(samples), 0) FROM outbox").fetchone()
+
+        self._tokens = 0.0
+        self._last_drain = None
+
+        # Counters for monitoring
+        self.stored = 0
+        self.dropped = 0
+        self.sent = 0
+
+    def __len__(self):
+        return self._samples
+
+    def put(self, topic, payload):
+        """
+        This function stores a payload, dropping the oldest stored samples
+        once more than max_samples are waiting.
+        """
+        count = len(wire_codec.decode_many(payload))
+        self._db.execute("INSERT INTO outbox (topic, payload, samples) VALUES (?, ?, ?)",
+                         (topic, bytes(payload), count))
+        self._samples += count
+        self.stored += count
+
+        while self._samples > self.max_samples:
+            row = self._db.execute("SELECT id, samples FROM outbox ORDER BY id LIMIT 1").fetchone()
+            self._db.execute("DELETE FROM outbox WHERE id = ?", (row[0],))
+            self._samples -= row[1]
+            self.dropped += row[1]
+        self._db.commit()
+
+    def drain(self, publish, now=None):
+        """
+        This function sends as many stored samples as the rate limit allows.
+        publish(topic, payload) returns True if the payload went out; on
+        False the samples stay stored and draining stops until the next call.
+        Returns the number of samples sent.
+        """
+        if now is None:
+            now = time.monotonic()
+        if self._last_drain is not None:
+            self._tokens = min(self._tokens + (now - self._last_drain) * self.drain_rate,
+                               float(self.batch_samples))
+        self._last_drain = now
+
+        sent = 0
+        while self._samples and self._tokens >= min(self.batch_samples, self._samples):
+            rows = self._next_batch()
+            samples = []
+            for _, _, payload, _ in rows:
+                samples.extend(wire_codec.decode_many(payload))
+            if not publish(rows[0][1], wire_codec.encode_batch(samples, self.fmt)):
+                break
+
+            self._db.execute("DELETE FROM outbox WHERE id BETWEEN ? AND ?", (rows[0][0], rows[-1][0]))
+            self._db.commit()
+            count = sum(row[3] for row in rows)
+            self._samples -= count
+            self._tokens -= count
+            sent += count
+        self.sent += sent
+        return sent
+
+    def _next_batch(self):
+        # The oldest rows of the oldest topic, up to batch_samples samples (but
+        # at least one row). Rows of another topic end the batch.
+        rows = []
+        count = 0
+        cursor = self._db.execute("SELECT id, topic, payload, samples FROM outbox ORDER BY id")
+        for row in cursor:
+            if rows and (row[1] != rows[0][1] or count + row[3] > self.batch_samples):
+                break
+            rows.append(row)
+            count += row[3]
+        cursor.close()
+        return rows
+
+    def stats(self):
+        """
+        This function returns the counters as a printable line.
+        """
+        return (f"Outbox: {self._samples} samples waiting, {self.stored} stored, "
+                f"{self.sent} sent, {self.dropped} dropped")
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,127 @@
+# node_registry.py
+# This module keeps track of which nodes are alive, so the master only waits
+# for nodes that can actually report.
+#
+# Nodes publish a retained "online" on their status topic when they connect,
+# and the broker publishes their last will "offline" when they drop. The
+# registry combines those status messages with the node's own traffic: a node
+# is alive while it is online and has been heard from within the last ttl
+# seconds. Nodes not heard from for longer are evicted.
+
+import threading
+import time
+
+# Status payloads published by the nodes
+STATUS_ONLINE = "online"
+STATUS_OFFLINE = "offline"
+
+
+# --- Node Registry ---
+class NodeRegistry:
+    """
+    This class tracks the liveness and last-seen time of every node.
+
+    status() records a message from a node's status topic and seen() records
+    traffic from the node. Both return True when the set of alive nodes
+    changed, so the caller knows to adapt. evict() removes nodes that have
+    been quiet for ttl seconds and returns their names.
+
+    A node that reported "online" but sends no data (for example because no
+    tag is in range) is evicted after ttl seconds too, and comes back with
+    its next sample.
+
+    All methods are thread-safe.
+    """
+
+    def __init__(self, ttl=5.0):
+        self.ttl = ttl
+        # node -> [online, last seen (monotonic)]
+        self._nodes = {}
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.evictions = 0
+        self.went_offline = 0
+
+    def status(self, node, payload, now=None):
+        """
+        This function records a status message ("online" or "offline").
+        """
+        if now is None:
+            now = time.monotonic()
+        if isinstance(payload, bytes):
+            payload = payload.decode(errors="replace")
+        online = payload.strip().lower() == STATUS_ONLINE
+
+        with self._lock:
+            entry = self._nodes.get(node)
+            if entry is None:
+                if not online:
+                    # A retained "offline" of a node we never saw changes nothing
+                    return False
+                self._nodes[node] = [True, now]
+                return True
+            was_online = entry[0]
+            entry[0] = online
+            entry[1] = now
+            if was_online and not online:
+                self.went_offline += 1
+            return was_online != online
+
+    def seen(self, node, now=None):
+        """
+        This function records traffic from a node. Traffic proves the node is
+        online, whatever its last status message said.
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            entry = self._nodes.get(node)
+            if entry is None:
+                self._nodes[node] = [True, now]
+                return True
+            entry[1] = now
+            if not entry[0]:
+                entry[0] = True
+                return True
+            return False
+
+    def evict(self, now=None):
+        """
+        This function removes every node not heard from for ttl seconds and
+        returns the names of the evicted nodes that were still counted as
+        alive.
+        """
+        if now is None:
+            now = time.monotonic()
+        evicted = []
+        with self._lock:
+            for node, (online, last_seen) in list(self._nodes.items()):
+                if now - last_seen > self.ttl:
+                    del self._nodes[node]
+                    self.evictions += 1
+                    if online:
+                        evicted.append(node)
+        return evicted
+
+    def alive(self):
+        """
+        This function returns the sorted names of the alive nodes.
+        """
+        with self._lock:
+            return sorted(node for node, (online, _) in self._nodes.items() if online)
+
+    def alive_count(self):
+        """
+        This function returns the number of alive nodes.
+        """
+        with self._lock:
+            return sum(1 for online, _ in self._nodes.values() if online)
+
+    def is_alive(self, node):
+        """
+        This function returns True if the node is alive.
+        """
+        with self._lock:
+            entry = self._nodes.get(node)
+            return entry is not None and entry[0]
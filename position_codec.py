@@ -0,0 +1,166 @@
+# position_codec.py
+# This module decides which positions the master publishes and how they are
+# encoded on the position topic.
+#
+# Most tags stand still most of the time, yet every fix used to be published
+# as full JSON that every client decodes. The deadband only lets a position
+# through when the tag moved far enough or a heartbeat is due, and the compact
+# encodings send the coordinates as integers, optionally as changes since
+# the tag's previous message.
+#
+# Compact messages keep "uuid", "session_id", "timestamp" and "trace", and
+# replace the position dictionaries by integer lists in units of "q" metres:
+#   "p" calculated_position, "f" filtered_position, "v" velocity
+# Delta messages also carry "k": 1 for key frames, whose lists are absolute,
+# and "k": 0 for the others, whose lists are changes since the tag's previous
+# message. PositionDecoder turns
+# every encoding back into the original dictionary.
+
+import json
+import math
+import threading
+import time
+
+# --- Encodings ---
+ENCODING_JSON = "json"
+ENCODING_QUANTIZED = "quantized"
+ENCODING_DELTA = "delta"
+
+# Position dictionaries and their compact keys
+_FIELDS = (("calculated_position", "p"), ("filtered_position", "f"), ("velocity", "v"))
+
+
+# --- Deadband ---
+class Deadband:
+    """
+    This class decides, per tag, whether a new fix should be published.
+
+    A fix is published when the tag is new, when it is more than
+    min_distance metres from the last published position of the tag, or
+    when heartbeat seconds passed since the tag was last published. With
+    min_distance = 0 every fix is published.
+    """
+
+    def __init__(self, min_distance=0.0, heartbeat=5.0):
+        self.min_distance = min_distance
+        self.heartbeat = heartbeat
+        # tag -> (last published position, time)
+        self._last = {}
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.published = 0
+        self.suppressed = 0
+
+    def check(self, tag, position, now=None):
+        """
+        This function returns True if the fix at position (x, y, z) should be
+        published, and then remembers it as the tag's last published fix.
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            last = self._last.get(tag)
+            if (last is not None and self.min_distance > 0
+                    and now - last[1] < self.heartbeat
+                    and math.dist(position, last[0]) <= self.min_distance):
+                self.suppressed += 1
+                return False
+            self._last[tag] = (position, now)
+            self.published += 1
+            return True
+
+
+# --- Encoder ---
+class PositionEncoder:
+    """
+    This class turns the master's output dictionaries into payloads.
+
+    With delta encoding, the first message of a tag and then one message
+    every keyframe_interval seconds are key frames, so a client that
+    subscribes late (or missed a message) is back in sync within that time.
+    """
+
+    def __init__(self, encoding=ENCODING_JSON, quantum=0.01, keyframe_interval=5.0):
+        if encoding not in (ENCODING_JSON, ENCODING_QUANTIZED, ENCODING_DELTA):
+            raise ValueError(f"unknown position encoding '{encoding}'")
+        self.encoding = encoding
+        self.quantum = quantum
+        self.keyframe_interval = keyframe_interval
+        # tag -> ({compact key: last sent integers}, time of the last key frame)
+        self._sent = {}
+        self._lock = threading.Lock()
+
+    def encode(self, output, now=None):
+        """
+        This function returns the payload for one output dictionary.
+        """
+        if self.encoding == ENCODING_JSON:
+            return json.dumps(output)
+        if now is None:
+            now = time.monotonic()
+
+        message = {key: output[key] for key in ("uuid", "session_id", "timestamp", "trace") if key in output}
+        message["q"] = self.quantum
+        values = {}
+        for field, key in _FIELDS:
+            vector = output.get(field)
+            if vector is not None:
+                values[key] = [round(vector[axis] / self.quantum) for axis in ("x", "y", "z")]
+
+        if self.encoding == ENCODING_QUANTIZED:
+            message.update(values)
+            return json.dumps(message, separators=(",", ":"))
+
+        with self._lock:
+            state = self._sent.get(output["uuid"])
+            keyframe = (state is None or now - state[1] >= self.keyframe_interval
+                        or any(key not in state[0] for key in values))
+            if keyframe:
+                message["k"] = 1
+                message.update(values)
+                self._sent[output["uuid"]] = (values, now)
+            else:
+                message["k"] = 0
+                previous = state[0]
+                for key, ints in values.items():
+                    message[key] = [a - b for a, b in zip(ints, previous[key])]
+                self._sent[output["uuid"]] = (values, state[1])
+        return json.dumps(message, separators=(",", ":"))
+
+
+# --- Decoder ---
+class PositionDecoder:
+    """
+    This class turns position topic payloads of any encoding back into the
+    master's output dictionaries. decode() returns None for a delta message
+    of a tag whose key frame has not been seen yet.
+    """
+
+    def __init__(self):
+        self._last = {}
+
+    def decode(self, payload):
+        data = json.loads(payload)
+        if "q" not in data:
+            return data
+
+        quantum = data.pop("q")
+        tag = data.get("uuid")
+        keyframe = data.pop("k", None)
+        if keyframe == 0:
+            previous = self._last.get(tag)
+            if previous is None:
+                return None
+            values = {key: [a + b for a, b in zip(previous[key], data.pop(key))]
+                      for _, key in _FIELDS if key in data}
+        else:
+            values = {key: data.pop(key) for _, key in _FIELDS if key in data}
+        if keyframe is not None:
+            self._last[tag] = values
+
+        for field, key in _FIELDS:
+            if key in values:
+                x, y, z = (round(v * quantum, 6) for v in values[key])
+                data[field] = {"x": x, "y": y, "z": z}
+        return data
@@ -0,0 +1,342 @@
+# position_store.py
+# This module keeps a history of the positions calculated by the master (and
+# optionally the raw node samples) in an append-only, memory-mapped file, so
+# fixes are not lost when no client is listening.
+#
+# The file is a 64-byte header followed by blocks of fixed-size records. Each
+# block belongs to one (tag, kind) stream and holds its records in arrival
+# order, so the records of a tag always sit in contiguous runs. Arrival order
+# is not time order: rounds complete, are solved and come back from the
+# solver workers out of order, and nodes replay old samples from their
+# outbox. The in-memory index therefore keeps the earliest and latest time of
+# every block, a sparse time index that finds the blocks of "tag X between t0
+# and t1" by overlap, and whether the block's times are in order. Queries
+# return NumPy views straight into the mapped file for blocks in order, and
+# copies of the matching records for the others.
+#
+# Tag and node names are stored in a small JSON file next to the log.
+
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+import wire_codec
+
+# --- Record Layout ---
+RECORD_DTYPE = np.dtype([
+    ("time", "<f8"),
+    ("x", "<f4"),
+    ("y", "<f4"),
+    ("z", "<f4"),
+    ("range", "<f4"),
+    ("session", "<u4"),
+    ("tag", "<u4"),
+    ("node", "<u2"),
+    ("kind", "u1"),
+    ("flags", "u1"),
+])
+
+# Record kinds
+KIND_FIX = 0
+KIND_SAMPLE = 1
+
+# --- File Layout ---
+_MAGIC = b"UWBPOS1\0"
+_header = struct.Struct("<8sIIQ")   # magic, block_records, record size, blocks used
+HEADER_SIZE = 64
+
+
+# --- Store ---
+class PositionStore:
+    """
+    This class appends fixes and samples to the log and answers time-range
+    queries.
+
+    append_fix() and append_sample() never block: they put the record on a
+    bounded queue and return. A background thread writes the queued records
+    into the mapped file. When the queue is full, records are dropped and
+    counted in self.dropped.
+
+    With readonly=True the file is opened for queries only (for example by
+    another process while the master keeps writing); call refresh() to pick
+    up records written since it was opened.
+    """
+
+    def __init__(self, path, block_records=256, grow_blocks=1024, queue_size=100000, readonly=False):
+        self.path = path
+        self.names_path = path + ".names"
+        self.readonly = readonly
+        self.dropped = 0
+        self.written = 0
+
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(queue_size)
+        self._thread = None
+
+        self._tags = []
+        self._tag_ids = {}
+        self._nodes = [""]
+        self._node_ids = {"": 0}
+        self._names_dirty = False
+
+        # Per (tag id, kind): list of block numbers
+        self._streams = {}
+        # Number of records written in every block, their earliest and latest
+        # time, and whether their times never go back
+        self._fill = np.zeros(0, dtype=np.int64)
+        self._min_time = np.zeros(0)
+        self._max_time = np.zeros(0)
+        self._ordered = np.zeros(0, dtype=bool)
+
+        self._open(block_records, grow_blocks)
+        if not readonly:
+            self._thread = threading.Thread(target=self._writer, daemon=True)
+            self._thread.start()
+
+    # --- Opening and growing the file ---
+    def _open(self, block_records, grow_blocks):
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) >= HEADER_SIZE
+        if self.readonly and not exists:
+            raise FileNotFoundError(self.path)
+
+        self._file = open(self.path, "rb" if self.readonly else ("r+b" if exists else "w+b"))
+        if exists:
+            magic, block_records, record_size, blocks_used = _header.unpack(self._file.read(_header.size))
+            if magic != _MAGIC or record_size != RECORD_DTYPE.itemsize:
+                raise ValueError(f"'{self.path}' is not a position store of this version")
+        else:
+            blocks_used = 0
+            self._file.write(_header.pack(_MAGIC, block_records, RECORD_DTYPE.itemsize, 0).ljust(HEADER_SIZE, b"\0"))
+            self._file.flush()
+
+        self.block_records = block_records
+        self.grow_blocks = grow_blocks
+        self._blocks_used = blocks_used
+        self._block_bytes = block_records * RECORD_DTYPE.itemsize
+
+        self._load_names()
+        self._map(max(blocks_used, 1) if self.readonly else blocks_used + grow_blocks)
+        self._rebuild_index()
+
+    def _map(self, capacity_blocks):
+        # Map the file with room for capacity_blocks blocks. Views handed out
+        # earlier keep the old mapping alive, so they stay valid.
+        size = HEADER_SIZE + capacity_blocks * self._block_bytes
+        if self.readonly:
+            size = min(size, os.path.getsize(self.path))
+            self._mmap = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+        else:
+            if os.path.getsize(self.path) < size:
+                self._file.truncate(size)
+            self._mmap = mmap.mmap(self._file.fileno(), size)
+        self._capacity_blocks = (size - HEADER_SIZE) // self._block_bytes
+        self._records = np.ndarray(
+            (self._capacity_blocks * self.block_records,), dtype=RECORD_DTYPE,
+            buffer=self._mmap, offset=HEADER_SIZE)
+        grow = self._capacity_blocks - len(self._fill)
+        if grow > 0:
+            self._fill = np.concatenate([self._fill, np.zeros(grow, dtype=np.int64)])
+            self._min_time = np.concatenate([self._min_time, np.zeros(grow)])
+            self._max_time = np.concatenate([self._max_time, np.zeros(grow)])
+            self._ordered = np.concatenate([self._ordered, np.ones(grow, dtype=bool)])
+
+    def _rebuild_index(self):
+        # Blocks are filled front to back, and a record's time is never 0,
+        # so the fill of a block is the number of non-zero times in it
+        used = min(self._blocks_used, self._capacity_blocks)
+        blocks = self._records[:used * self.block_records].reshape(used, self.block_records)
+        times = blocks["time"]
+        written = times != 0
+        self._fill[:used] = written.sum(axis=1)
+        self._min_time[:used] = np.where(written, times, np.inf).min(axis=1, initial=np.inf)
+        self._max_time[:used] = np.where(written, times, -np.inf).max(axis=1, initial=-np.inf)
+        # A step back between two written records makes a block unordered
+        steps_back = (np.diff(times, axis=1) < 0) & written[:, 1:]
+        self._ordered[:used] = ~steps_back.any(axis=1)
+        self._streams = {}
+        for block in range(used):
+            if self._fill[block]:
+                first = blocks[block, 0]
+                self._streams.setdefault((int(first["tag"]), int(first["kind"])), []).append(block)
+
+    def refresh(self):
+        """
+        This function re-reads the header and names of a read-only store so
+        records written since it was opened become visible.
+        """
+        if not self.readonly:
+            return
+        with open(self.path, "rb") as f:
+            _, _, _, self._blocks_used = _header.unpack(f.read(_header.size))
+        with self._lock:
+            self._load_names()
+            self._map(max(self._blocks_used, 1))
+            self._rebuild_index()
+
+    def _load_names(self):
+        if os.path.exists(self.names_path):
+            with open(self.names_path) as f:
+                names = json.load(f)
+            self._tags = names["tags"]
+            self._tag_ids = {name: i for i, name in enumerate(self._tags)}
+            self._nodes = names["nodes"]
+            self._node_ids = {name: i for i, name in enumerate(self._nodes)}
+
+    # --- Appending (any thread, never blocks) ---
+    def append_fix(self, tag, t, x, y, z, session=0):
+        """
+        This function queues one calculated position.
+        """
+        self._put((KIND_FIX, tag, "", t, x, y, z, float("nan"), session))
+
+    def append_sample(self, tag, node, t, x, y, z, distance=None, session=0):
+        """
+        This function queues one raw node sample.
+        """
+        self._put((KIND_SAMPLE, tag, node, t, x, y, z,
+                   float("nan") if distance is None else distance, session))
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    # --- Writer thread ---
+    def _writer(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            items = [item]
+            stop = False
+            while len(items) < 4096:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                items.append(item)
+            try:
+                self._write(items)
+            except Exception as e:
+                print(f"Error writing position history: {e}")
+            if stop:
+                break
+
+    def _id(self, table, ids, name):
+        index = ids.get(name)
+        if index is None:
+            index = ids[name] = len(table)
+            table.append(name)
+            self._names_dirty = True
+        return index
+
+    def _write(self, items):
+        records = self._records
+        for kind, tag, node, t, x, y, z, distance, session in items:
+            tag_id = self._id(self._tags, self._tag_ids, str(tag))
+            node_id = self._id(self._nodes, self._node_ids, str(node)) if node else 0
+            key = (tag_id, kind)
+
+            stream = self._streams.get(key)
+            block = stream[-1] if stream else None
+            if block is None or self._fill[block] >= self.block_records:
+                with self._lock:
+                    if self._blocks_used >= self._capacity_blocks:
+                        self._map(self._capacity_blocks + self.grow_blocks)
+                        records = self._records
+                    block = self._blocks_used
+                    self._blocks_used += 1
+                    self._min_time[block] = self._max_time[block] = t
+                    self._ordered[block] = True
+                    self._streams.setdefault(key, []).append(block)
+
+            index = block * self.block_records + self._fill[block]
+            records[index] = (t, x, y, z, distance, wire_codec.session_counter(session), tag_id, node_id, kind, 0)
+            if t < self._max_time[block]:
+                self._ordered[block] = False
+            self._min_time[block] = min(self._min_time[block], t)
+            self._max_time[block] = max(self._max_time[block], t)
+            self._fill[block] += 1
+            self.written += 1
+
+        if self._names_dirty:
+            self._save_names()
+        _header.pack_into(self._mmap, 0, _MAGIC, self.block_records, RECORD_DTYPE.itemsize, self._blocks_used)
+
+    def _save_names(self):
+        temporary = self.names_path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"tags": self._tags, "nodes": self._nodes}, f)
+        os.replace(temporary, self.names_path)
+        self._names_dirty = False
+
+    # --- Queries ---
+    def query(self, tag, t0, t1, kind=KIND_FIX):
+        """
+        This function returns the records of a tag with t0 <= time <= t1.
+
+        The result is a list of NumPy structured arrays (fields: see
+        RECORD_DTYPE) in the order the records were written, which is only
+        time order if they arrived in order; sort np.concatenate(result) by
+        "time" when that matters. Records of blocks written in time order are
+        zero-copy views into the mapped file, the others are copies.
+        """
+        tag_id = self._tag_ids.get(str(tag))
+        if tag_id is None:
+            return []
+        with self._lock:
+            stream = self._streams.get((tag_id, kind))
+            if not stream:
+                return []
+            blocks = np.array(stream)
+            records = self._records
+            fill, ordered = self._fill, self._ordered
+            overlap = (self._min_time[blocks] <= t1) & (self._max_time[blocks] >= t0)
+
+        views = []
+        for block in blocks[overlap].tolist():
+            base = block * self.block_records
+            run = records[base:base + int(fill[block])]
+            times = run["time"]
+            if ordered[block]:
+                lo = np.searchsorted(times, t0, side="left")
+                hi = np.searchsorted(times, t1, side="right")
+                if hi > lo:
+                    views.append(run[lo:hi])
+            else:
+                matching = run[(times >= t0) & (times <= t1)]
+                if len(matching):
+                    views.append(matching)
+        return views
+
+    def tags(self):
+        """
+        This function returns the names of all tags in the store.
+        """
+        return list(self._tags)
+
+    def node_name(self, node_id):
+        """
+        This function returns the node name for the node field of a sample.
+        """
+        return self._nodes[node_id]
+
+    def close(self):
+        """
+        This function writes everything still queued and closes the file.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._mmap.flush()
+        self._file.close()
@@ -0,0 +1,93 @@
+# rate_scheduler.py
+# This module keeps the node publish loops on a fixed cadence.
+# Instead of sleeping a fixed time after each cycle (which makes the real
+# period grow with the work done in the cycle), every cycle has an absolute
+# deadline on the monotonic clock, one period after the previous deadline.
+
+import time
+
+
+# --- Rate Scheduler ---
+class RateScheduler:
+    """
+    This class paces a loop at rate_hz cycles per second without drift.
+
+    Call wait() once per cycle. It sleeps until the next deadline and returns
+    immediately if the deadline already passed. When a cycle overruns by one
+    or more whole periods, those deadlines are counted as missed and skipped,
+    so the loop does not try to catch up with a burst of back-to-back cycles.
+
+    With align=True the deadlines are placed on multiples of the period in
+    wall-clock time, so nodes with synchronised clocks (NTP) sample at the
+    same instants and report matching session IDs.
+
+    Jitter is the time between a deadline and the moment wait() returned.
+    """
+
+    def __init__(self, rate_hz, align=True):
+        if rate_hz <= 0:
+            raise ValueError("rate_hz must be positive")
+        self.rate_hz = rate_hz
+        self.period = 1.0 / rate_hz
+
+        now = time.monotonic()
+        if align:
+            self._deadline = now + (self.period - time.time() % self.period)
+        else:
+            self._deadline = now
+
+        self.cycles = 0
+        self.missed = 0
+        self._jitter_sum = 0.0
+        self._jitter_max = 0.0
+
+    def wait(self):
+        """
+        This function sleeps until the next deadline.
+        """
+        now = time.monotonic()
+        if now < self._deadline:
+            time.sleep(self._deadline - now)
+            now = time.monotonic()
+        else:
+            # Skip the deadlines that were overrun completely
+            behind = int((now - self._deadline) / self.period)
+            if behind:
+                self.missed += behind
+                self._deadline += behind * self.period
+
+        jitter = now - self._deadline
+        self._jitter_sum += jitter
+        if jitter > self._jitter_max:
+            self._jitter_max = jitter
+        self.cycles += 1
+        self._deadline += self.period
+
+    def stats(self, reset=True):
+        """
+        This function returns the scheduling statistics as a dictionary
+        (jitter in milliseconds) and by default starts a new measurement.
+        """
+        cycles = self.cycles
+        result = {
+            "rate_hz": self.rate_hz,
+            "cycles": cycles,
+            "missed": self.missed,
+            "jitter_mean_ms": self._jitter_sum / cycles * 1000.0 if cycles else 0.0,
+            "jitter_max_ms": self._jitter_max * 1000.0,
+        }
+        if reset:
+            self.cycles = 0
+            self.missed = 0
+            self._jitter_sum = 0.0
+            self._jitter_max = 0.0
+        return result
+
+    def report(self):
+        """
+        This function returns a one-line summary of stats() for printing.
+        """
+        s = self.stats()
+        return (f"Scheduler: {s['cycles']} cycles at {s['rate_hz']:g} Hz, "
+                f"{s['missed']} missed deadlines, jitter mean {s['jitter_mean_ms']:.2f} ms, "
+                f"max {s['jitter_max_ms']:.2f} ms")
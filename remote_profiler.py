@@ -0,0 +1,313 @@
+# remote_profiler.py
+# This module profiles a running master or node on request over MQTT.
+#
+# When a master falls behind there is no way to attach a profiler without
+# restarting it, which also clears whatever made it slow. Instead every
+# master and node listens on a control topic, <prefix>/control/<instance>/profile,
+# for JSON commands:
+#   {"action": "start", "seconds": 10, "profiler": "cprofile"}
+#   {"action": "start", "seconds": 10, "profiler": "sampling", "interval": 0.005}
+#   {"action": "stop"}
+#   {"verbose": false}
+# "cprofile" records every call of the thread that handles the messages (see
+# RemoteProfiler.poll). "sampling" looks at the stacks of all threads every
+# interval seconds from a background thread, which costs far less and also
+# covers the network, solver and pipeline threads. When the time is up (or on
+# "stop") the result is published, compressed, on the reply topic
+# <control topic>/result. "verbose" switches the per-message prints of the
+# process off or on; they cost more than most of the work they report on, and
+# any command can carry it.
+#
+# Either profiler only sees the process it runs in. A master with
+# solver_workers > 0 solves in worker processes that are not profiled; its
+# replies and reports say so (not_profiled), and their time shows up as the
+# master waiting on the worker queues.
+#
+# Run this file to profile an instance and print the result:
+#   python remote_profiler.py --instance node_a --prefix home --seconds 10
+#   python remote_profiler.py --instance <master> --profiler cprofile --quiet --output master.pstats
+
+import argparse
+import cProfile
+import json
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+
+import paho.mqtt.client as mqtt
+
+PROFILER_CPROFILE = "cprofile"
+PROFILER_SAMPLING = "sampling"
+
+
+def control_topic(prefix, instance):
+    """
+    This function returns the control topic of an instance.
+    """
+    return f"{prefix}/control/{instance}/profile"
+
+
+def reply_topic(topic):
+    """
+    This function returns the reply topic of a control topic.
+    """
+    return topic + "/result"
+
+
+# --- Profiler ---
+class RemoteProfiler:
+    """
+    This class runs one profile at a time on command.
+
+    handle() takes a control message, from any thread. A cProfile run has to
+    be started and stopped in the thread it profiles, so it starts and ends
+    in the next poll(), which the owner calls often (for every message, or
+    every loop iteration) from the thread to profile. A sampling run has its
+    own thread. Either way on_report(payload) is called with the finished
+    report, which load_report() turns back into statistics.
+
+    verbose tells the owner whether to print per-message lines.
+    not_profiled, set by the owner, describes work done outside this process
+    that no profile covers; it is added to the replies and reports.
+    """
+
+    def __init__(self, instance, verbose=True, max_seconds=300.0):
+        self.instance = instance
+        self.verbose = verbose
+        self.max_seconds = max_seconds
+        # Called with every finished report; set by the owner, like the
+        # callbacks of an MQTT client
+        self.on_report = None
+        self.not_profiled = None
+
+        self._lock = threading.Lock()
+        # cProfile run waiting for poll(): seconds to run, or None
+        self._requested = None
+        self._profile = None
+        self._started = 0.0
+        self._deadline = 0.0
+        self._sampler = None
+        self._stop = threading.Event()
+
+    def handle(self, payload):
+        """
+        This function applies one control message and returns a line
+        describing what it did. Raises ValueError for an invalid message.
+        """
+        command = json.loads(payload)
+        if not isinstance(command, dict):
+            raise ValueError("control message must be a JSON object")
+        done = []
+        if "verbose" in command:
+            self.verbose = bool(command["verbose"])
+            done.append(f"per-message prints {'on' if self.verbose else 'off'}")
+
+        action = command.get("action")
+        if action == "start":
+            seconds = min(float(command.get("seconds", 10.0)), self.max_seconds)
+            profiler = command.get("profiler", PROFILER_SAMPLING)
+            with self._lock:
+                if self._busy():
+                    done.append("a profile is already running")
+                elif profiler == PROFILER_CPROFILE:
+                    self._requested = seconds
+                    done.append(f"cProfile for {seconds:g} s")
+                elif profiler == PROFILER_SAMPLING:
+                    interval = float(command.get("interval", 0.005))
+                    self._stop.clear()
+                    self._sampler = threading.Thread(
+                        target=self._sample, args=(seconds, interval), name="remote-profiler", daemon=True)
+                    self._sampler.start()
+                    done.append(f"sampling every {interval * 1000:g} ms for {seconds:g} s")
+                else:
+                    raise ValueError(f"unknown profiler '{profiler}'")
+            if self.not_profiled:
+                done.append(f"not profiled: {self.not_profiled}")
+        elif action == "stop":
+            with self._lock:
+                self._requested = None
+                self._deadline = 0.0
+            self._stop.set()
+            done.append("stopping")
+        elif action is not None:
+            raise ValueError(f"unknown action '{action}'")
+        return f"Profiler: {', '.join(done) or 'nothing to do'}"
+
+    def poll(self):
+        """
+        This function starts a requested cProfile run, or ends one whose time
+        is up, in the calling thread.
+        """
+        if self._requested is None and self._profile is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self._requested is not None:
+                self._profile = cProfile.Profile()
+                self._started = now
+                self._deadline = now + self._requested
+                self._requested = None
+                self._profile.enable()
+                return
+            if now < self._deadline:
+                return
+            profile, self._profile = self._profile, None
+        profile.disable()
+        profile.create_stats()
+        header = {"profiler": PROFILER_CPROFILE, "seconds": now - self._started,
+                  "calls": sum(calls for _, calls, _, _, _ in profile.stats.values())}
+        self._report(header, marshal.dumps(profile.stats))
+
+    def _busy(self):
+        return (self._requested is not None or self._profile is not None
+                or (self._sampler is not None and self._sampler.is_alive()))
+
+    def _sample(self, seconds, interval):
+        # Count the stacks of every other thread, root first, as
+        # "thread;function (file:line);..." in the collapsed format that
+        # flame graph tools read
+        me = threading.get_ident()
+        counts = Counter()
+        samples = 0
+        started = time.monotonic()
+        deadline = started + seconds
+        while time.monotonic() < deadline and not self._stop.wait(interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                counts[";".join(reversed(stack))] += 1
+            samples += 1
+
+        body = "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+        header = {"profiler": PROFILER_SAMPLING, "seconds": time.monotonic() - started,
+                  "samples": samples, "interval": interval}
+        self._report(header, body.encode())
+
+    def _report(self, header, body):
+        header["instance"] = self.instance
+        if self.not_profiled:
+            header["not_profiled"] = self.not_profiled
+        payload = zlib.compress(json.dumps(header).encode() + b"\n" + body)
+        if self.on_report is not None:
+            self.on_report(payload)
+
+
+# --- Reports ---
+class _LoadedStats:
+    # Stands in for a cProfile.Profile so pstats.Stats can take the stats
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def load_report(payload):
+    """
+    This function turns a report back into (header, statistics): a
+    pstats.Stats for cProfile reports, and a Counter of collapsed stacks for
+    sampling reports.
+    """
+    header, body = zlib.decompress(payload).split(b"\n", 1)
+    header = json.loads(header)
+    if header["profiler"] == PROFILER_CPROFILE:
+        return header, pstats.Stats(_LoadedStats(marshal.loads(body)))
+    counts = Counter()
+    for line in body.decode().splitlines():
+        stack, count = line.rsplit(" ", 1)
+        counts[stack] = int(count)
+    return header, counts
+
+
+def print_report(header, stats, limit=25):
+    """
+    This function prints the top of a report.
+    """
+    print(f"{header['profiler']} profile of '{header['instance']}' over {header['seconds']:.1f} s")
+    if header.get("not_profiled"):
+        print(f"Not profiled: {header['not_profiled']}")
+    if isinstance(stats, pstats.Stats):
+        stats.sort_stats("cumulative").print_stats(limit)
+        return
+    total = sum(stats.values()) or 1
+    # Time spent in each function, wherever it was called from
+    functions = Counter()
+    for stack, count in stats.items():
+        for frame in set(stack.split(";")[1:]):
+            functions[frame] += count
+    print(f"{header['samples']} samples, {total} thread stacks")
+    for frame, count in functions.most_common(limit):
+        print(f"{100.0 * count / total:6.1f}%  {frame}")
+
+
+# --- Command Line ---
+def main():
+    parser = argparse.ArgumentParser(description="Profile a running master or node over MQTT.")
+    parser.add_argument("--broker", default="192.168.106.249", help="MQTT broker address")
+    parser.add_argument("--port", type=int, default=1883, help="MQTT broker port")
+    parser.add_argument("--prefix", default="uwb", help="topic prefix of the instance ('uwb' or 'home')")
+    parser.add_argument("--instance", required=True, help="instance name (node name or UUID, master instance)")
+    parser.add_argument("--profiler", choices=[PROFILER_SAMPLING, PROFILER_CPROFILE], default=PROFILER_SAMPLING)
+    parser.add_argument("--seconds", type=float, default=10.0, help="how long to profile")
+    parser.add_argument("--interval", type=float, default=0.005, help="sampling interval in seconds")
+    parser.add_argument("--quiet", action="store_true",
+                        help="silence the per-message prints while profiling, and switch them on afterwards")
+    parser.add_argument("--output", help="write the pstats file or collapsed stacks here")
+    args = parser.parse_args()
+
+    topic = control_topic(args.prefix, args.instance)
+    done = threading.Event()
+    reports = []
+
+    def on_connect(client, userdata, flags, rc):
+        client.subscribe(reply_topic(topic))
+        command = {"action": "start", "seconds": args.seconds, "profiler": args.profiler,
+                   "interval": args.interval}
+        if args.quiet:
+            command["verbose"] = False
+        client.publish(topic, json.dumps(command))
+
+    def on_message(client, userdata, msg):
+        reports.append(msg.payload)
+        done.set()
+
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(args.broker, args.port, 60)
+    client.loop_start()
+    try:
+        # The cProfile run ends with the first message after its time is up
+        if not done.wait(args.seconds + 30.0):
+            print(f"No report on '{reply_topic(topic)}'")
+            return
+    finally:
+        if args.quiet:
+            client.publish(topic, json.dumps({"verbose": True})).wait_for_publish(5.0)
+        client.loop_stop()
+        client.disconnect()
+
+    header, stats = load_report(reports[0])
+    print_report(header, stats)
+    if args.output:
+        if isinstance(stats, pstats.Stats):
+            stats.dump_stats(args.output)
+        else:
+            with open(args.output, "w") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in stats.most_common())
+        print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
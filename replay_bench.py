@@ -0,0 +1,231 @@
+# replay_bench.py
+# This program measures the throughput of a master program without any
+# hardware or broker. It replays a recording made by traffic_recorder.py (or a
+# synthetic one) straight into the master's on_message callback through an
+# in-process fake MQTT client, and reports messages/sec, fixes/sec and latency
+# percentiles.
+#
+# Examples:
+#   python replay_bench.py --synthesize bench.rec
+#   python replay_bench.py bench.rec --master rpi_master --workers 2
+#   python replay_bench.py uwb_traffic.rec --speed 1.0
+
+import argparse
+import contextlib
+import importlib
+import math
+import os
+import random
+import time
+
+import numpy as np
+
+import solver_pool
+import traffic_recorder
+import wire_codec
+
+# --- Benchmark Configuration ---
+default_master = "rpi_masternew"
+# How many messages to replay between checks for expired rounds
+expire_every = 1000
+
+
+# --- Fake MQTT Client ---
+class FakeMessage:
+    """
+    This class looks like the paho message handed to on_message.
+    """
+    __slots__ = ("topic", "payload", "qos", "retain")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+        self.qos = 0
+        self.retain = False
+
+
+class FakeMQTTClient:
+    """
+    This class stands in for paho's client. It records everything the master
+    publishes instead of sending it, and calls on_publish_hook if set.
+    """
+
+    def __init__(self):
+        self.published = {}
+        self.on_publish_hook = None
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published[topic] = self.published.get(topic, 0) + 1
+        if self.on_publish_hook is not None:
+            self.on_publish_hook(topic, payload)
+
+    def subscribe(self, topic, qos=0):
+        pass
+
+
+# --- Synthetic Recordings ---
+def bench_anchors(count):
+    """
+    This function returns the fixed anchor layout used by synthetic
+    recordings: count anchors on a circle, keyed "bench_anchor_<i>".
+    """
+    anchors = {}
+    for i in range(count):
+        angle = 2 * math.pi * i / count
+        anchors[f"bench_anchor_{i}"] = (5 + 5 * math.cos(angle), 5 + 5 * math.sin(angle), 2.0 + (i % 2))
+    return anchors
+
+
+def synthesize_recording(path, master, tags=20, rounds=500, rate_hz=10.0, fmt=wire_codec.FORMAT_BINARY, seed=1):
+    """
+    This function writes a recording of simulated nodes ranging to moving tags.
+
+    It uses the bench_anchors() layout with master.expected_nodes anchors and
+    publishes on the master's raw data topic.
+    """
+    rng = random.Random(seed)
+    anchors = bench_anchors(master.expected_nodes)
+
+    tag_ids = [f"00000000-0000-4000-8000-{i:012x}" for i in range(tags)]
+    writer = traffic_recorder.RecordingWriter(path)
+    start = time.time()
+    for session in range(rounds):
+        t = start + session / rate_hz
+        for tag_index, tag in enumerate(tag_ids):
+            phase = tag_index + t * 0.2
+            tag_pos = (5 + 3 * math.cos(phase), 5 + 3 * math.sin(phase), 1.0)
+            for name, anchor in anchors.items():
+                distance = math.dist(tag_pos, anchor) + rng.gauss(0, 0.02)
+                sample = wire_codec.make_sample(None, tag, session, *tag_pos, distance, t)
+                topic = master.raw_data_topic.replace("+", name)
+                writer.write(topic, wire_codec.encode(sample, fmt), t + rng.random() * 0.01)
+    writer.close()
+    return writer.count
+
+
+# --- Replay ---
+def percentiles(values):
+    """
+    This function returns p50/p90/p99/max of a list of seconds, in ms.
+    """
+    if not values:
+        return {"p50": math.nan, "p90": math.nan, "p99": math.nan, "max": math.nan}
+    data = np.asarray(values) * 1000.0
+    p50, p90, p99 = np.percentile(data, [50, 90, 99])
+    return {"p50": p50, "p90": p90, "p99": p99, "max": data.max()}
+
+
+def replay(path, master, speed=0.0, workers=0):
+    """
+    This function replays a recording into master.on_message.
+
+    speed 0 replays as fast as possible; 1.0 keeps the original timing and
+    2.0 replays twice as fast. workers is the size of the solver pool.
+
+    Returns a dictionary of results.
+    """
+    client = FakeMQTTClient()
+    dispatch_times = {}
+    fix_latencies = []
+    fixes = 0
+
+    # Every solved fix is counted and timed as it comes back from the solver,
+    # before the master decides whether to publish it (the deadband skips
+    # fixes that barely moved)
+    def on_result(calculated_position):
+        nonlocal fixes
+        fixes += 1
+        started = dispatch_times.pop((calculated_position['uuid'], calculated_position['session_id']), None)
+        if started is not None:
+            fix_latencies.append(time.perf_counter() - started)
+        master.publish_position(client, calculated_position)
+
+    master.solver = solver_pool.ShardedSolverPool(master.perform_calculations, workers, on_result)
+    master.solver.start()
+
+    messages = list(traffic_recorder.read_recording(path))
+    # The (tag, session) keys in every message, used to time each fix from
+    # the moment its last sample was handed over
+    message_keys = [
+        [(sample['tag'] or master.tracked_tag_uuid, sample['session_id'])
+         for sample in wire_codec.decode_many(payload)]
+        for _, _, payload in messages
+    ]
+    samples = sum(len(keys) for keys in message_keys)
+    ingest_latencies = []
+    first_time = messages[0][0] if messages else 0.0
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        for index, (timestamp, topic, payload) in enumerate(messages):
+            if speed > 0:
+                due = started + (timestamp - first_time) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            t0 = time.perf_counter()
+            for key in message_keys[index]:
+                dispatch_times[key] = t0
+            master.on_message(client, None, FakeMessage(topic, payload))
+            ingest_latencies.append(time.perf_counter() - t0)
+
+            if index % expire_every == 0:
+                master.submit_rounds(master.fusion_window.expire())
+
+        # Close every round that is still open and wait for the workers
+        master.submit_rounds(master.fusion_window.expire(math.inf))
+        master.solver.stop()
+        elapsed = time.perf_counter() - started
+
+    return {
+        "messages": len(messages),
+        "samples": samples,
+        "fixes": fixes,
+        "published": client.published.get(master.position_topic, 0),
+        "elapsed": elapsed,
+        "messages_per_sec": len(messages) / elapsed if elapsed else math.nan,
+        "fixes_per_sec": fixes / elapsed if elapsed else math.nan,
+        "ingest_latency_ms": percentiles(ingest_latencies),
+        "fix_latency_ms": percentiles(fix_latencies),
+    }
+
+
+def print_report(results):
+    """
+    This function prints the results of replay().
+    """
+    print("-" * 40)
+    print(f"Messages: {results['messages']} ({results['samples']} samples) in {results['elapsed']:.2f} s")
+    print(f"Throughput: {results['messages_per_sec']:.0f} messages/sec, {results['fixes_per_sec']:.0f} fixes/sec")
+    print(f"Fixes: {results['fixes']} solved, {results['published']} published")
+    for name in ("ingest_latency_ms", "fix_latency_ms"):
+        p = results[name]
+        print(f"{name}: p50={p['p50']:.3f} p90={p['p90']:.3f} p99={p['p99']:.3f} max={p['max']:.3f}")
+    print("-" * 40)
+
+
+# --- Main Program ---
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded node traffic into a master.")
+    parser.add_argument("recording", help="recording file from traffic_recorder.py")
+    parser.add_argument("--master", default=default_master, help="master module to benchmark")
+    parser.add_argument("--speed", type=float, default=0.0, help="0 = as fast as possible, 1.0 = original timing")
+    parser.add_argument("--workers", type=int, default=0, help="solver worker processes")
+    parser.add_argument("--synthesize", action="store_true", help="write a synthetic recording first")
+    parser.add_argument("--tags", type=int, default=20, help="tags in the synthetic recording")
+    parser.add_argument("--rounds", type=int, default=500, help="rounds per tag in the synthetic recording")
+    parser.add_argument("--format", default=wire_codec.FORMAT_BINARY, help="wire format of the synthetic recording")
+    args = parser.parse_args()
+
+    master = importlib.import_module(args.master)
+    # Synthetic recordings use a known anchor layout; real ones the master's own
+    master.anchor_positions.update(bench_anchors(master.expected_nodes))
+    if args.synthesize:
+        count = synthesize_recording(args.recording, master, args.tags, args.rounds, fmt=args.format)
+        print(f"Wrote {count} synthetic messages to '{args.recording}'")
+
+    print_report(replay(args.recording, master, args.speed, args.workers))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+# round_buffer.py
+# This module is the array-backed counterpart of fusion.FusionWindow.
+#
+# The dictionary path builds a sample dictionary (with a nested "xyz"
+# dictionary and a Python float per value) for every sample, keeps it until
+# its round closes, and the solver then walks those dictionaries again. At
+# high message rates that is several objects per sample and a constant load
+# on the garbage collector. Here binary messages are read with one NumPy view
+# over the payload, and every value is written straight into preallocated
+# arrays indexed by (round row, node slot). The arrays get a row per open
+# round (capacity rows, never more) and a column per node, and only grow when
+# more nodes join than there are columns. A closed round is copied out as a
+# few small arrays, which the solver reads directly (see
+# multilateration.solve_round_arrays).
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import wire_codec
+
+# --- Binary Records ---
+# NumPy views of wire_codec's binary record layouts
+_RECORD_FIELDS = [
+    ("magic", "u1"), ("version", "u1"), ("tag", "V16"), ("session", "<u4"),
+    ("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("range", "<f4"), ("timestamp", "<f8"),
+]
+RECORD_DTYPE = np.dtype(_RECORD_FIELDS)
+TRACED_RECORD_DTYPE = np.dtype(_RECORD_FIELDS + [("published", "<f8")])
+
+# Values kept for every sample, in this order along the last axis
+_RANGE, _X, _Y, _Z, _TIMESTAMP, _PUBLISHED, _RECEIVED = range(7)
+
+# Messages with up to this many records are written record by record, which
+# costs less than the handful of array operations of the vectorised write
+SMALL_MESSAGE = 16
+
+
+def decode_records(payload):
+    """
+    This function returns the records of a binary message or binary batch as
+    a structured array that views the payload without copying it, or None
+    if the payload uses one of the text formats. Raises ValueError if the
+    payload cannot be parsed.
+    """
+    if not payload:
+        raise ValueError("empty payload")
+    first = payload[0]
+
+    if first == wire_codec.BINARY_MAGIC:
+        traced = len(payload) > 1 and payload[1] == wire_codec.BINARY_VERSION | wire_codec.TRACE_FLAG
+        dtype = TRACED_RECORD_DTYPE if traced else RECORD_DTYPE
+        if len(payload) != dtype.itemsize:
+            raise ValueError(f"binary sample must be {dtype.itemsize} bytes, got {len(payload)}")
+        if payload[1] & ~wire_codec.TRACE_FLAG != wire_codec.BINARY_VERSION:
+            raise ValueError(f"unsupported binary version {payload[1]}")
+        return np.frombuffer(payload, dtype)
+
+    if first == wire_codec.BATCH_MAGIC:
+        header = wire_codec.BATCH_HEADER
+        if len(payload) < header.size:
+            raise ValueError("truncated binary batch header")
+        _, version, count = header.unpack_from(payload)
+        if version & ~wire_codec.TRACE_FLAG != wire_codec.BINARY_VERSION:
+            raise ValueError(f"unsupported binary version {version}")
+        dtype = TRACED_RECORD_DTYPE if version & wire_codec.TRACE_FLAG else RECORD_DTYPE
+        if len(payload) != header.size + count * dtype.itemsize:
+            raise ValueError(f"binary batch of {count} samples has the wrong length {len(payload)}")
+        records = np.frombuffer(payload, dtype, count, header.size)
+        # Every record repeats the version byte
+        if ((records["version"] | wire_codec.TRACE_FLAG) != version | wire_codec.TRACE_FLAG).any():
+            raise ValueError("unsupported binary version")
+        return records
+
+    return None
+
+
+def record_tags(records, default=None):
+    """
+    This function returns the tag uuid of every record, with default for the
+    records that carry no tag.
+    """
+    return [wire_codec.uuid_string(raw) or default for raw in records["tag"].tolist()]
+
+
+# --- Round Buffer ---
+class RoundBuffer:
+    """
+    This class collects samples into rounds, like fusion.FusionWindow, with
+    the same rules, methods and counters, but keeps the samples in arrays.
+
+    add() takes a sample dictionary (from the text formats) and
+    add_records() the records of a binary message. Both write into the
+    arrays of the round's row at the node's slot column.
+
+    Emitted rounds are dictionaries holding copies of their row:
+        {"tag": ..., "session_id": ..., "complete": True/False,
+         "nodes": (node_key, ...), "ranges": (k,), "xyz": (k, 3),
+         "timestamps": (k,), "published": (k,), "received": (k,)}
+    with one entry per reporting node, in the order they reported, and NaN
+    where a value is unknown.
+
+    All methods are thread-safe.
+    """
+
+    def __init__(self, expected_nodes=3, min_nodes=3, round_timeout=1.0, capacity=256, node_slots=8):
+        self.expected_nodes = expected_nodes
+        self.min_nodes = min_nodes
+        self.round_timeout = round_timeout
+        self.capacity = capacity
+
+        # One row per open round and one column per node slot, holding the
+        # range, x, y, z, timestamp, published and received of every sample
+        self._values = np.full((capacity, max(1, node_slots), 7), np.nan)
+        # Slots that reported in every row, in arrival order
+        self._members = [[] for _ in range(capacity)]
+        self._deadlines = [0.0] * capacity
+        self._free = list(range(capacity - 1, -1, -1))
+
+        # Node slots: node_key -> column, and the node of every column
+        self._slots = {}
+        self._nodes = []
+
+        # Open rounds in arrival order: key -> row
+        self._open = OrderedDict()
+        # Recently closed round keys, so late samples do not reopen a round
+        self._closed = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.rounds_complete = 0
+        self.rounds_timed_out = 0
+        self.rounds_dropped = 0
+        self.late_samples = 0
+        self.slot_growths = 0
+
+    def add(self, tag, session_id, node_key, sample, now=None):
+        """
+        This function stores one sample dictionary and returns the list of
+        rounds that became ready because of it.
+        """
+        if now is None:
+            now = time.monotonic()
+        ready = []
+        key = (tag, session_id)
+
+        with self._lock:
+            slot = self._slot(node_key)
+            row = self._row(key, now, ready)
+            if row is None:
+                return ready
+            xyz = sample['xyz']
+            self._values[row, slot] = [
+                np.nan if value is None else value
+                for value in (sample.get('range'), xyz['x'], xyz['y'], xyz['z'], sample.get('timestamp'),
+                              sample.get('published'), sample.get('received'))]
+            if self._mark(row, slot):
+                del self._open[key]
+                self._close(key, row, True, ready)
+        return ready
+
+    def add_records(self, node_key, tags, records, received=None, now=None):
+        """
+        This function stores the records of one binary message from a node.
+        tags holds the tag uuid of every record (see record_tags) and
+        received the time the message arrived, if traced.
+
+        Returns the list of rounds that became ready.
+        """
+        if now is None:
+            now = time.monotonic()
+        ready = []
+        sessions = records["session"].tolist()
+        rows = [-1] * len(sessions)
+        complete = []
+
+        with self._lock:
+            slot = self._slot(node_key)
+            written = 0
+            for i, key in enumerate(zip(tags, sessions)):
+                if key not in self._open and not self._free and key not in self._closed:
+                    # A round has to be closed to make room. Write what this
+                    # message put into the rows so far and close the rounds it
+                    # completed, which frees their rows, before evicting one.
+                    self._write(slot, rows[written:i], records[written:i], received)
+                    written = i
+                    for done_key, done_row in complete:
+                        self._close(done_key, done_row, True, ready)
+                    complete = []
+                row = self._row(key, now, ready)
+                if row is None:
+                    continue
+                rows[i] = row
+                if self._mark(row, slot):
+                    # Closed right away, so a repeat of the key in this
+                    # message counts as late; copied out once written
+                    del self._open[key]
+                    self._remember(key)
+                    complete.append((key, row))
+
+            self._write(slot, rows[written:], records[written:], received)
+            for key, row in complete:
+                self._close(key, row, True, ready)
+        return ready
+
+    def expire(self, now=None):
+        """
+        This function closes every round whose deadline has passed and
+        returns the ones that collected at least min_nodes samples.
+        """
+        if now is None:
+            now = time.monotonic()
+        ready = []
+
+        with self._lock:
+            # Rounds are stored in arrival order, so deadlines are ordered too
+            while self._open:
+                key, row = next(iter(self._open.items()))
+                if self._deadlines[row] > now:
+                    break
+                del self._open[key]
+                self._close(key, row, False, ready)
+        return ready
+
+    def set_expected_nodes(self, expected_nodes):
+        """
+        This function changes the number of nodes a round waits for. Open
+        rounds that already have enough samples are closed and returned.
+        """
+        ready = []
+        with self._lock:
+            self.expected_nodes = expected_nodes
+            for key, row in list(self._open.items()):
+                if len(self._members[row]) >= expected_nodes:
+                    del self._open[key]
+                    self._close(key, row, True, ready)
+        return ready
+
+    def pending(self):
+        """
+        This function returns the number of rounds that are still open.
+        """
+        with self._lock:
+            return len(self._open)
+
+    def node_slots(self):
+        """
+        This function returns the number of node columns of the arrays.
+        """
+        return self._values.shape[1]
+
+    def _slot(self, node_key):
+        slot = self._slots.get(node_key)
+        if slot is None:
+            slot = len(self._nodes)
+            if slot == self._values.shape[1]:
+                # Double the columns; open rounds keep their rows
+                self._values = np.concatenate([self._values, np.full_like(self._values, np.nan)], axis=1)
+                self.slot_growths += 1
+            self._slots[node_key] = slot
+            self._nodes.append(node_key)
+        return slot
+
+    def _row(self, key, now, ready):
+        # Row of an open round, or a new row for a new one; None if the round
+        # was closed already
+        row = self._open.get(key)
+        if row is not None:
+            return row
+        if key in self._closed:
+            self.late_samples += 1
+            return None
+        if not self._free:
+            # Make room by closing the oldest open round
+            old_key, old_row = self._open.popitem(last=False)
+            self._close(old_key, old_row, False, ready)
+        row = self._free.pop()
+        self._deadlines[row] = now + self.round_timeout
+        self._open[key] = row
+        return row
+
+    def _mark(self, row, slot):
+        # Count the node in the round; True once the round is complete
+        members = self._members[row]
+        if slot not in members:
+            members.append(slot)
+        return len(members) >= self.expected_nodes
+
+    def _write(self, slot, rows, records, received):
+        # Write the records into their rows at the slot; rows of -1 (late
+        # records) are skipped
+        values = self._values[:, slot]
+        received = np.nan if received is None else received
+
+        if len(rows) <= SMALL_MESSAGE:
+            traced = records.dtype == TRACED_RECORD_DTYPE
+            for row, record in zip(rows, records.tolist()):
+                # (magic, version, tag, session, x, y, z, range, timestamp[, published])
+                if row >= 0:
+                    values[row] = (record[7], record[4], record[5], record[6], record[8],
+                                   record[9] if traced else np.nan, received)
+            return
+
+        rows = np.array(rows)
+        keep = rows >= 0
+        if not keep.all():
+            rows = rows[keep]
+            records = records[keep]
+        values[rows, _RANGE] = records["range"]
+        values[rows, _X] = records["x"]
+        values[rows, _Y] = records["y"]
+        values[rows, _Z] = records["z"]
+        values[rows, _TIMESTAMP] = records["timestamp"]
+        values[rows, _PUBLISHED] = records["published"] if "published" in records.dtype.names else np.nan
+        values[rows, _RECEIVED] = received
+
+    def _remember(self, key):
+        # Remember the key for a while so stragglers are counted, not reopened
+        self._closed[key] = None
+        while len(self._closed) > self.capacity:
+            self._closed.popitem(last=False)
+
+    def _close(self, key, row, complete, ready):
+        self._remember(key)
+        slots = self._members[row]
+        count = len(slots)
+        if complete:
+            self.rounds_complete += 1
+        elif count >= self.min_nodes:
+            self.rounds_timed_out += 1
+        else:
+            self.rounds_dropped += 1
+
+        if complete or count >= self.min_nodes:
+            # One copy of the row's samples; the entries are views of it
+            values = self._values[row, slots]
+            ready.append({
+                "tag": key[0],
+                "session_id": key[1],
+                "complete": complete,
+                "nodes": tuple([self._nodes[slot] for slot in slots]),
+                "ranges": values[:, _RANGE],
+                "xyz": values[:, _X:_Z + 1],
+                "timestamps": values[:, _TIMESTAMP],
+                "published": values[:, _PUBLISHED],
+                "received": values[:, _RECEIVED],
+            })
+
+        # Every value of a sample is written when it is stored, so freeing
+        # the row only needs its members cleared
+        self._members[row] = []
+        self._free.append(row)
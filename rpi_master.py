@@ -2,59 +2,570 @@
 # This program acts as the master node. It subscribes to all raw data topics,
 # performs a calculation, and publishes the final position.
 
-import paho.mqtt.client as mqtt
+import asyncio
+import os
+import socket
+import threading
 import time
 import json
 
+import numpy as np
+
+import async_pipeline
+import cluster
+import fusion
+import geofence
+import kalman_tracker
+import latency_tracing
+import mqtt_session
+import multilateration
+import node_registry
+import position_codec
+import position_store
+import remote_profiler
+import round_buffer
+import solver_pool
+import state_snapshot
+import wire_codec
+
 # --- MQTT Broker Configuration ---
 broker_address = "192.168.106.249"
 broker_port = 1883
 
+# --- MQTT Session ---
+# Name of this master: its MQTT client id and its name in the cluster. It must
+# stay the same across restarts and differ between running masters, so give
+# every master on the same host its own name. Two masters with one name take
+# the broker session from each other on every reconnect. It is read from the
+# UWB_MASTER_NAME environment variable, or else the host name:
+#   UWB_MASTER_NAME=master-2 python rpi_master.py
+master_name = os.environ.get("UWB_MASTER_NAME") or socket.gethostname()
+
+# The master keeps a persistent session on the broker under mqtt_client_id
+# and subscribes with QoS subscribe_qos. While it is disconnected or
+# restarting, the broker keeps the nodes' QoS 1 samples for it (up to its
+# queue limit, max_queued_messages in mosquitto) and delivers them once it is
+# back. After losing the broker the master reconnects after a random delay
+# of up to reconnect_min_delay seconds, a limit that doubles with every failed
+# attempt up to reconnect_max_delay (see mqtt_session.py).
+mqtt_client_id = f"uwb-master-{master_name}"
+subscribe_qos = 1
+reconnect_min_delay = 0.05
+reconnect_max_delay = 30.0
+
 # --- Master Node Topics ---
 # The master node subscribes to all raw data topics using a wildcard "+"
 raw_data_topic = "uwb/raw_data/+"
 # The master node publishes to this single position topic
 position_topic = "uwb/position"
 
-# --- Placeholder for Calculations ---
-# In a real-world system, this is where your localization algorithm would go.
-def perform_calculation(all_raw_data):
+# The nodes publish "online"/"offline" (their last will) on these topics
+status_topic = "uwb/status/+"
+
+# --- Anchor Configuration ---
+# Surveyed position (x, y, z) of each anchor node in metres, keyed by node UUID.
+# Hardcode the node UUIDs (see rpi_node.py) and list their positions here.
+# Nodes missing from this table can still report, but their ranges are ignored.
+anchor_positions = {}
+
+# Anchor positions can be changed at run time by publishing a JSON object
+# {"<node key>": [x, y, z], ...} (retained) on this topic. Listed anchors are
+# added or moved, anchors set to null are removed.
+anchor_config_topic = "uwb/config/anchors"
+
+# --- Fusion Configuration ---
+# Tag reported when a node's message does not carry a tag UUID
+tracked_tag_uuid = "iphone_tracked_device"
+# Reports are grouped into rounds by (tag uuid, session_id). A round is solved
+# as soon as expected_nodes nodes have reported, or after round_timeout seconds
+# if at least min_nodes did. At most fusion_capacity rounds are kept open.
+expected_nodes = 3
+min_nodes = 3
+round_timeout = 1.0
+fusion_capacity = 256
+# How often the main loop checks for rounds whose deadline has passed
+fusion_tick = 0.05
+# With use_array_ingest, binary messages are decoded straight into the
+# preallocated arrays of a round_buffer.RoundBuffer instead of one sample
+# dictionary per sample, and the solver reads the rounds' arrays directly.
+# The arrays start with fusion_node_slots node columns and double when more
+# nodes join. This allocates several times less per sample and solves faster,
+# but costs a few microseconds more per message, so it pays off once the nodes
+# batch their samples (batch_max_samples > 1). See ingest_bench.py.
+use_array_ingest = False
+fusion_node_slots = 16
+
+# --- Node Liveness ---
+# A node is alive while its status is "online" and it was heard from (status
+# or data) within node_ttl seconds. With adapt_to_alive_nodes a round waits
+# for every alive node instead of expected_nodes, but never for fewer than
+# min_nodes, so the master stops waiting on nodes that are gone.
+node_ttl = 5.0
+adapt_to_alive_nodes = True
+
+# --- Solver Configuration ---
+# Number of worker processes that calculate positions. Rounds are sharded by
+# tag uuid, so all rounds of one tag are solved by the same worker.
+# Set to 0 to calculate every round inline in the MQTT network thread.
+solver_workers = os.cpu_count() or 1
+
+# The solver matrices of the last geometry_cache_size anchor sets are kept,
+# so solving a round with a known set of anchors is one matrix product
+geometry_cache_size = 64
+
+# With refine_positions every fix is refined with Levenberg-Marquardt
+# iterations on the range errors, warm-started from the tag's previous fix
+# (see multilateration.refine_rounds). A fix stops once its step is shorter
+# than refine_tolerance metres (positions are published in centimetres). It is
+# solved cold from the linear solution when the warm start has not converged
+# after refine_max_iterations or ends more than refine_max_residual metres RMS
+# off the measured ranges.
+refine_positions = True
+refine_tolerance = 0.005
+refine_max_iterations = 10
+refine_max_residual = 0.5
+
+# --- Tracking Configuration ---
+# The fixes of every tag are smoothed by a constant-velocity Kalman filter,
+# which also estimates the tag's velocity. process noise is the random
+# acceleration (m^2/s^3), measurement noise the variance of one fix (m^2).
+use_tracker = True
+tracker_process_noise = 0.5
+tracker_measurement_noise = 0.05
+# Number of tags the tracker has room for before it grows its arrays
+tracker_capacity = 1024
+
+# --- Latency Tracing ---
+# When on, every sample and position carries the time of each hop, and the
+# master publishes per-stage latency histograms on metrics_topic every
+# metrics_interval seconds. Turn it on in the nodes and the client as well.
+enable_tracing = False
+metrics_topic = "uwb/metrics/latency"
+metrics_interval = 10.0
+
+# --- Position History ---
+# Every calculated position is appended to a memory-mapped log on disk that
+# can be queried by tag and time range (see position_store.py). With
+# history_raw_samples the raw node samples are kept as well. The file is
+# named after master_name, so masters sharing a directory keep their own
+# history. Set history_file to None to keep no history.
+history_file = f"position_history-{master_name}.log"
+history_raw_samples = True
+
+# --- State Snapshots ---
+# Every state_snapshot_interval seconds the per-tag state (Kalman filters,
+# warm starts of the refinement and the zones every tag is in) is saved to
+# state_snapshot_file and the solver parts next to it (see state_snapshot.py),
+# and loaded again on start, so a restarted master picks up its tags where it
+# stopped. The file is named after master_name, so a master only loads its own
+# state. Set state_snapshot_file to None to keep no snapshots.
+state_snapshot_file = f"master_state-{master_name}.snap"
+state_snapshot_interval = 5.0
+
+# --- Position Publishing ---
+# A tag's position is only published when it moved more than
+# publish_min_distance metres (filtered position when tracking) since it was
+# last published, or publish_heartbeat seconds passed. With 0 every fix is
+# published. The history still records every fix.
+publish_min_distance = 0.0
+publish_heartbeat = 5.0
+# "json" publishes the full JSON. "quantized" sends the coordinates as
+# integers in units of position_quantum metres, and "delta" as changes since
+# the tag's previous message, in full every publish_heartbeat seconds.
+# Clients decode both with position_codec.PositionDecoder.
+position_encoding = "json"
+position_quantum = 0.01
+
+# --- Zone Events ---
+# Zones of the site, keyed by zone name, in metres (see geofence.py), e.g.
+#   zones = {"kitchen": {"min": [0, 0], "max": [4, 3]}}
+# Every fix is checked against the zones near it (in a grid of zone_cell_size
+# metre cells), and "enter", "exit" and "dwell" events are published as JSON
+# on zone_event_topic. A tag only exits a zone once it is zone_hysteresis
+# metres outside of it, is sent one "dwell" event once it stayed
+# zone_dwell_time seconds, and exits all its zones when it is not seen for
+# zone_tag_timeout seconds.
+zones = {}
+zone_event_topic = "uwb/zones/events"
+zone_cell_size = 2.0
+zone_hysteresis = 0.3
+zone_dwell_time = 10.0
+zone_tag_timeout = 30.0
+
+# Zones can be changed at run time by publishing a JSON object
+# {"<zone name>": {...}, ...} (retained) on this topic. Listed zones are
+# added or replaced, zones set to null are removed.
+zone_config_topic = "uwb/config/zones"
+
+# --- Cluster Configuration ---
+# Several masters can share the tags of one site (see cluster.py). Set
+# cluster_partitions to the same number > 0 in every master and node: tags are
+# hashed into that many partitions, and each master only subscribes to and
+# solves the partitions it owns. 0 runs a single master on raw_data_topic.
+cluster_partitions = 0
+# Name of this master in the cluster, unique per running instance. It is
+# master_name, so a restarted master comes back as the same member, owns the
+# same partitions and finds their subscriptions in its broker session.
+# A starting instance takes its partitions once the retained member list came
+# in, or after cluster_grace_period seconds if it does not, and holds the
+# samples that arrive before.
+cluster_instance = master_name
+cluster_members_topic = "uwb/cluster/members/+"
+cluster_grace_period = 2.0
+
+# --- Remote Profiling ---
+# JSON commands on control_topic profile this master for a while, and the
+# compressed result is published on the reply topic (see remote_profiler.py):
+#   python remote_profiler.py --prefix uwb --instance <cluster_instance> --seconds 10
+# With print_messages = False the per-message prints are left out, which
+# saves more time than most of the work they report on. A {"verbose": ...}
+# command switches them at run time. Only this process is profiled: with
+# solver_workers > 0 the solving itself runs in the worker processes and is
+# not part of the profile.
+print_messages = True
+control_topic = remote_profiler.control_topic("uwb", cluster_instance)
+
+# --- Pipeline Configuration ---
+# With use_async_pipeline the MQTT callback only queues raw messages, and
+# asyncio tasks decode, solve and publish them, so a slow solve never stalls
+# the network thread. The queue sizes bound the memory used between stages.
+use_async_pipeline = False
+ingest_queue_size = 10000
+solve_queue_size = 1000
+publish_queue_size = 1000
+
+# --- Calculations ---
+# Per-tag tracking state, one row per tag in the tracker's preallocated arrays.
+# When a solver pool is used, each worker process holds the state of the tags
+# in its own shard.
+tracker = kalman_tracker.KalmanTracker(
+    tracker_capacity, tracker_process_noise, tracker_measurement_noise)
+
+# Precomputed solver matrices per set of anchors
+geometry_cache = multilateration.GeometryCache(geometry_cache_size)
+
+# Last refined fix of every tag, the warm start of its next refinement. Like
+# the tracker, each solver worker keeps the tags of its own shard.
+last_fixes = {}
+
+def set_anchor_positions(changes):
+    """
+    This function applies anchor position changes ({node key: (x, y, z) or
+    None to remove}) and drops the cached solver matrices. It is also run in
+    every solver worker process.
+    """
+    for node_key, position in changes.items():
+        if position is None:
+            anchor_positions.pop(node_key, None)
+        else:
+            anchor_positions[node_key] = tuple(float(v) for v in position)
+    geometry_cache.invalidate()
+
+def round_time(fused_round):
+    """
+    This function returns the time of a round: the earliest timestamp sent
+    by its nodes, or the current time if no node sent one.
+    """
+    if use_array_ingest:
+        timestamps = fused_round['timestamps']
+        timestamps = timestamps[np.isfinite(timestamps)]
+        return float(timestamps.min()) if len(timestamps) else time.time()
+    timestamps = [sample['timestamp'] for sample in fused_round['samples'].values()
+                  if sample.get('timestamp') is not None]
+    return min(timestamps) if timestamps else time.time()
+
+def round_trace(fused_round, solved):
+    """
+    This function returns the trace timestamps of a round: when its first
+    sample was taken, when its last sample was published and received (the
+    moment the round could be completed), and when it was solved.
     """
-    This function simulates the "Calculations" block from your diagram.
+    if use_array_ingest:
+        trace = {"solved": solved}
+        for name, column, reduce in (("sampled", "timestamps", np.min), ("published", "published", np.max),
+                                     ("received", "received", np.max)):
+            values = fused_round[column]
+            values = values[np.isfinite(values)]
+            if len(values):
+                trace[name] = float(reduce(values))
+        return trace
+    samples = fused_round['samples'].values()
+    trace = {"solved": solved}
+    sampled = [s['timestamp'] for s in samples if s.get('timestamp') is not None]
+    published = [s['published'] for s in samples if s.get('published') is not None]
+    received = [s['received'] for s in samples if s.get('received') is not None]
+    if sampled:
+        trace["sampled"] = min(sampled)
+    if published:
+        trace["published"] = max(published)
+    if received:
+        trace["received"] = max(received)
+    return trace
+
+def perform_calculations(fused_rounds):
+    """
+    This function implements the "Calculations" block from your diagram.
     
-    It receives a dictionary containing raw data from all nodes (keys are UUIDs).
-    You would replace the placeholder code here with your multilateration or
-    triangulation algorithm to compute the final position.
+    It receives a list of fused rounds. Each round holds the raw data of one
+    tag's session from all nodes, keyed by node UUID. The ranges of the surveyed
+    anchors of all rounds are solved together in one batch with the linear
+    least-squares multilateration in multilateration.py. Rounds where not
+    enough nodes sent a range fall back to averaging the reported XYZ values.
+    With refine_positions the fixes are refined starting from each tag's
+    previous fix instead, and report the iterations they took. Each fix is
+    then smoothed by its tag's Kalman filter.
     
-    Returns a dictionary with the calculated position.
+    Returns a list of dictionaries with the calculated positions.
     """
-    print("\nStarting calculation...")
-    
-    # Placeholder: In the real code, you would use data from multiple nodes
-    # to calculate a single, precise position.
-    # For now, we'll just average the incoming XYZ values.
+    if use_array_ingest:
+        # Rounds from the round buffer already hold their samples as arrays
+        rounds = fused_rounds
+        solve, refine = multilateration.solve_round_arrays, multilateration.refine_round_arrays
+    else:
+        rounds = [fused_round['samples'] for fused_round in fused_rounds]
+        solve, refine = multilateration.solve_rounds, multilateration.refine_rounds
+    iterations = None
+    if refine_positions:
+        previous = np.array([last_fixes.get(fused_round['tag'], (np.nan, np.nan, np.nan))
+                             for fused_round in fused_rounds], dtype=np.float64).reshape(-1, 3)
+        positions, _, iterations = refine(
+            rounds, anchor_positions, previous, geometry_cache,
+            refine_tolerance, refine_max_iterations, refine_max_residual)
+        for fused_round, position, steps in zip(fused_rounds, positions, iterations):
+            if steps:
+                last_fixes[fused_round['tag']] = position
+    else:
+        positions, _ = solve(rounds, anchor_positions, geometry_cache)
+    times = [round_time(fused_round) for fused_round in fused_rounds]
     
-    avg_x = sum(d['xyz']['x'] for d in all_raw_data.values()) / len(all_raw_data)
-    avg_y = sum(d['xyz']['y'] for d in all_raw_data.values()) / len(all_raw_data)
-    avg_z = sum(d['xyz']['z'] for d in all_raw_data.values()) / len(all_raw_data)
+    # Update the tracking state of every tag with a valid fix
+    filtered = velocities = None
+    valid = np.isfinite(positions).all(axis=1)
+    if use_tracker and valid.any():
+        index = np.flatnonzero(valid)
+        filtered = np.full_like(positions, np.nan)
+        velocities = np.full_like(positions, np.nan)
+        filtered[index], velocities[index] = tracker.update_many(
+            [fused_rounds[i]['tag'] for i in index], positions[index],
+            [times[i] for i in index])
     
-    # Assuming a single iPhone is being tracked, we can use a static UUID for the output
-    # or the UUID of the iPhone itself.
-    output_data = {
-        "uuid": "iphone_tracked_device", 
-        "session_id": list(all_raw_data.values())[0]['session_id'],
-        "calculated_position": {
-            "x": round(avg_x, 2),
-            "y": round(avg_y, 2),
-            "z": round(avg_z, 2)
+    solved = time.time()
+    results = []
+    for i, fused_round in enumerate(fused_rounds):
+        x, y, z = positions[i].tolist()
+        
+        # Create the output data dictionary, which will be converted to JSON
+        output_data = {
+            "uuid": fused_round['tag'],
+            "session_id": fused_round['session_id'],
+            "timestamp": times[i],
+            "calculated_position": {
+                "x": round(x, 2),
+                "y": round(y, 2),
+                "z": round(z, 2)
+            }
         }
-    }
+        # Fixes older than their tag's filter state have no filtered position
+        if filtered is not None and valid[i] and np.isfinite(filtered[i]).all():
+            fx, fy, fz = filtered[i].tolist()
+            vx, vy, vz = velocities[i].tolist()
+            output_data["filtered_position"] = {"x": round(fx, 2), "y": round(fy, 2), "z": round(fz, 2)}
+            output_data["velocity"] = {"x": round(vx, 2), "y": round(vy, 2), "z": round(vz, 2)}
+        if iterations is not None:
+            output_data["iterations"] = int(iterations[i])
+        if enable_tracing:
+            output_data["trace"] = round_trace(fused_round, solved)
+        results.append(output_data)
+    return results
+
+# Collects incoming data from all nodes until a round is ready to calculate
+if use_array_ingest:
+    fusion_window = round_buffer.RoundBuffer(
+        expected_nodes, min_nodes, round_timeout, fusion_capacity, fusion_node_slots)
+else:
+    fusion_window = fusion.FusionWindow(expected_nodes, min_nodes, round_timeout, fusion_capacity)
+
+# Liveness of every node, from status messages and traffic
+registry = node_registry.NodeRegistry(node_ttl)
+
+def update_required_nodes():
+    """
+    This function makes rounds wait for the nodes that are alive right now.
+    
+    Returns the list of open rounds that are complete with the new number.
+    """
+    if not adapt_to_alive_nodes:
+        return []
+    alive = registry.alive()
+    if profiler.verbose:
+        print(f"Alive nodes ({len(alive)}): {alive}")
+    return fusion_window.set_expected_nodes(max(min_nodes, len(alive)))
+
+def expire_rounds():
+    """
+    This function evicts nodes that went quiet and closes every round whose
+    deadline has passed, and saves a state snapshot when one is due.
+    Returns the rounds that are ready to calculate.
+    """
+    ready = []
+    evicted = registry.evict()
+    if evicted:
+        print(f"Nodes timed out: {evicted}")
+        ready.extend(update_required_nodes())
+    ready.extend(fusion_window.expire())
+    save_state_if_due()
+    return ready
+
+# Calculates the fused rounds; created in main()
+solver = None
+
+def submit_rounds(fused_rounds):
+    """
+    This function hands fused rounds to the solver.
+    """
+    for fused_round in fused_rounds:
+        nodes = fused_round['nodes'] if use_array_ingest else fused_round['samples']
+        if profiler.verbose:
+            print(f"\nCollected data from {len(nodes)} nodes for tag "
+                  f"'{fused_round['tag']}', session {fused_round['session_id']}. Ready to calculate.")
+    solver.submit(fused_rounds)
+
+# Position history on disk; opened in main() when history_file is set
+history = None
+
+# Per-stage latency histograms of traced positions
+tracer = latency_tracing.HopTracer(metrics_interval)
+
+# Which positions are published, and how they are encoded
+deadband = position_codec.Deadband(publish_min_distance, publish_heartbeat)
+position_encoder = position_codec.PositionEncoder(position_encoding, position_quantum, publish_heartbeat)
+
+# Profiles this process on command, and says whether to print per-message lines
+profiler = remote_profiler.RemoteProfiler(cluster_instance, print_messages)
+
+# The zones and the zones every tag is in
+zone_engine = geofence.ZoneEngine(zone_cell_size, zone_hysteresis, zone_dwell_time, zone_tag_timeout)
+zone_engine.set_zones(zones)
+
+def publish_zone_events(client, events):
+    """
+    This function publishes zone events to the zone event topic.
+    """
+    for event in events:
+        client.publish(zone_event_topic, json.dumps(event))
+        if profiler.verbose:
+            print(f"Zone event: tag '{event['tag']}' {event['event']} '{event['zone']}'")
+
+def publish_position(client, calculated_position):
+    """
+    This function publishes one calculated position to the position topic,
+    unless the tag has hardly moved since its last published position.
+    """
+    # Keep the fix in the history. This only queues it, so it never waits on the disk.
+    position = calculated_position["calculated_position"]
+    if history is not None:
+        history.append_fix(calculated_position["uuid"], calculated_position["timestamp"],
+                           position["x"], position["y"], position["z"], calculated_position["session_id"])
+    
+    # Zone events are checked on every fix, published or not
+    moved = calculated_position.get("filtered_position", position)
+    if len(zone_engine):
+        publish_zone_events(client, zone_engine.update(
+            calculated_position["uuid"], moved["x"], moved["y"], moved["z"], calculated_position["timestamp"]))
+    if zone_engine.due():
+        publish_zone_events(client, zone_engine.expire())
     
-    print("Calculation complete.")
-    return output_data
+    if not deadband.check(calculated_position["uuid"], (moved["x"], moved["y"], moved["z"])):
+        return
+    
+    trace = calculated_position.get("trace")
+    if trace is not None:
+        trace["position_published"] = time.time()
+        tracer.record(trace)
+    
+    client.publish(position_topic, position_encoder.encode(calculated_position))
+    
+    # Publish the latency histograms every metrics_interval seconds
+    if trace is not None and tracer.due():
+        client.publish(metrics_topic, tracer.to_json())
+    if profiler.verbose:
+        print(f"Published final position to '{position_topic}': {calculated_position}\n")
+
+# --- State Snapshots ---
+# When the next snapshot is due (time.monotonic())
+next_snapshot = 0.0
+
+def save_solver_state(path):
+    """
+    This function saves the tracker state and warm starts of the tags in this
+    process to its solver part of the snapshot. It is run in every solver
+    worker process.
+    """
+    shard, _ = solver_pool.current_shard()
+    state_snapshot.save(state_snapshot.part_path(path, shard),
+                        {"tracker": tracker.snapshot(), "last_fixes": dict(last_fixes)})
+
+def restore_solver_state(parts):
+    """
+    This function loads the tags of this process's shard from the solver
+    parts of a snapshot, whatever number of workers saved them. It is run in
+    every solver worker process.
+    """
+    shard, shards = solver_pool.current_shard()
+    def keep(tag):
+        return solver_pool.shard_of(tag, shards) == shard
+    for part in parts:
+        tracker.restore(part["tracker"], keep)
+        last_fixes.update((tag, fix) for tag, fix in part["last_fixes"].items() if keep(tag))
+
+def run_in_solvers(config_fn, *args):
+    """
+    This function runs config_fn(*args) where the solver state lives: in
+    every solver worker process, or here when rounds are solved inline.
+    """
+    if solver.workers > 0:
+        solver.configure(config_fn, *args)
+    else:
+        config_fn(*args)
+
+def save_state():
+    """
+    This function saves a snapshot of the per-tag state.
+    """
+    try:
+        state_snapshot.save(state_snapshot_file, {"zones": zone_engine.snapshot()})
+        run_in_solvers(save_solver_state, state_snapshot_file)
+        # Parts of workers that no longer exist would be loaded again later,
+        # over the newer state of their tags
+        state_snapshot.remove_parts(state_snapshot_file, max(solver.workers, 1))
+    except OSError as e:
+        print(f"Could not save the state snapshot: {e}")
+
+def save_state_if_due():
+    """
+    This function saves a snapshot every state_snapshot_interval seconds.
+    """
+    global next_snapshot
+    now = time.monotonic()
+    if not state_snapshot_file or now < next_snapshot:
+        return
+    next_snapshot = now + state_snapshot_interval
+    save_state()
 
-# Store incoming data from all nodes until ready to calculate
-incoming_data = {}
+def restore_state():
+    """
+    This function loads the last snapshot, if there is one. Call it after
+    the solver workers started and before any message can arrive.
+    """
+    state = state_snapshot.load(state_snapshot_file)
+    if state is not None:
+        zone_engine.restore(state["zones"])
+    parts = state_snapshot.load_parts(state_snapshot_file)
+    if parts:
+        run_in_solvers(restore_solver_state, parts)
+    if state is not None or parts:
+        tags = sum(len(part["tracker"]["tags"]) for part in parts)
+        print(f"Restored state snapshot '{state_snapshot_file}': {tags} tracked tags")
 
 # --- MQTT Callback Functions ---
 def on_connect(client, userdata, flags, rc):
@@ -63,44 +574,201 @@ def on_connect(client, userdata, flags, rc):
     """
     if rc == 0:
         print("Master RPI connected to MQTT Broker!")
-        # Subscribe to all raw data topics from all nodes
-        client.subscribe(raw_data_topic)
-        print(f"Subscribed to topic: {raw_data_topic}")
+        if flags.get("session present"):
+            # The broker kept our subscriptions and the messages sent meanwhile
+            print(f"Resumed the session of '{mqtt_client_id}'")
+        if membership is None:
+            # Subscribe to all raw data topics from all nodes
+            client.subscribe(raw_data_topic, qos=subscribe_qos)
+            print(f"Subscribed to topic: {raw_data_topic}")
+        else:
+            # Follow the other members, then announce this instance: its own
+            # "online" comes back after the retained list of the others. The
+            # partitions it owns are re-subscribed here after a reconnect and
+            # adjusted in on_cluster_message as the member list comes in.
+            client.subscribe(cluster_members_topic, qos=subscribe_qos)
+            client.publish(member_topic(), cluster.MEMBER_ONLINE, retain=True)
+            print(f"Joined cluster as '{cluster_instance}'")
+            for partition in sorted(membership.owned):
+                client.subscribe(cluster.partition_topic(raw_data_topic, partition), qos=subscribe_qos)
+            if not membership.settled:
+                timer = threading.Timer(cluster_grace_period, settle_cluster, (client,))
+                timer.daemon = True
+                timer.start()
+        # Subscribe to the status of all nodes; retained statuses arrive at once
+        client.subscribe(status_topic, qos=subscribe_qos)
+        print(f"Subscribed to topic: {status_topic}")
+        client.subscribe(anchor_config_topic, qos=subscribe_qos)
+        print(f"Subscribed to topic: {anchor_config_topic}")
+        client.subscribe(control_topic, qos=subscribe_qos)
+        print(f"Subscribed to topic: {control_topic}")
+        client.subscribe(zone_config_topic, qos=subscribe_qos)
+        print(f"Subscribed to topic: {zone_config_topic}")
     else:
         print(f"Failed to connect, return code {rc}")
 
+# --- Cluster ---
+# Members of the cluster and the partitions this instance owns; created in
+# main() when cluster_partitions is set
+membership = None
+
+def member_topic():
+    """
+    This function returns the members topic of this instance.
+    """
+    return cluster_members_topic[:-1] + cluster_instance
+
+def on_cluster_message(client, userdata, msg):
+    """
+    Callback function for messages on the members topic. It moves the
+    subscriptions of partitions this instance gained or lost.
+    """
+    member = msg.topic.split("/")[-1]
+    move_partitions(client, *membership.update(member, msg.payload))
+
+def settle_cluster(client):
+    """
+    This function claims the partitions of this instance if the member list
+    did not come in within cluster_grace_period. It runs in a timer thread.
+    """
+    if not membership.settled:
+        print(f"No member list after {cluster_grace_period} s, claiming partitions "
+              f"with the members known so far: {sorted(membership.members)}")
+    move_partitions(client, *membership.settle())
+
+def move_partitions(client, gained, lost):
+    """
+    This function moves the subscriptions of partitions this instance gained
+    or lost, and then handles the samples held until the member list settled.
+    """
+    for partition in lost:
+        client.unsubscribe(cluster.partition_topic(raw_data_topic, partition))
+    for partition in gained:
+        client.subscribe(cluster.partition_topic(raw_data_topic, partition), qos=subscribe_qos)
+    if gained or lost:
+        print(f"Cluster members: {sorted(membership.members)}. This instance now owns "
+              f"{len(membership.owned)} of {cluster_partitions} partitions.")
+    for msg in membership.take_held():
+        client.on_message(client, None, msg)
+
+def on_partition_message(client, userdata, msg):
+    """
+    Callback function for samples on the partition topics. Until the member
+    list is settled they are held, since this instance does not know yet
+    which tags it owns.
+    """
+    if not membership.hold(msg):
+        client.on_message(client, userdata, msg)
+
+def ingest_message(topic, payload):
+    """
+    This function decodes one node message and stores the data in its rounds.
+    
+    Returns the list of fused rounds that became ready.
+    """
+    # A cProfile run starts and ends in the thread that ingests the messages
+    profiler.poll()
+    if topic == control_topic:
+        print(profiler.handle(payload))
+        profiler.poll()
+        return []
+    
+    # Anchor changes go to this process and to every solver worker
+    if topic == anchor_config_topic:
+        changes = json.loads(payload)
+        set_anchor_positions(changes)
+        solver.configure(set_anchor_positions, changes)
+        print(f"Anchor positions updated: {anchor_positions}")
+        return []
+    
+    # Zone changes only concern this process, which publishes the positions
+    if topic == zone_config_topic:
+        zone_engine.set_zones(json.loads(payload))
+        print(f"Zones updated: {len(zone_engine)} zones")
+        return []
+    
+    # Status messages only update the liveness of the node
+    if topic.startswith(status_topic[:-1]):
+        node = topic.split("/")[-1]
+        if registry.status(node, payload):
+            print(f"Node '{node}' is now {payload.decode(errors='replace')}")
+            return update_required_nodes()
+        return []
+    
+    # Binary messages go straight into the arrays of the round buffer
+    if use_array_ingest:
+        records = round_buffer.decode_records(payload)
+        if records is not None:
+            return ingest_records(topic.split("/")[-1], records)
+    
+    # Decode the message into sample dictionaries. A node may send a
+    # batch of samples in one message; each one is handled on its own.
+    received = time.time() if enable_tracing else None
+    ready = []
+    for data in wire_codec.decode_many(payload):
+        if received is not None:
+            data['received'] = received
+        # Nodes without a UUID in the message are named by their topic
+        node_uuid = data['uuid'] or topic.split("/")[-1]
+        tag_uuid = data['tag'] or tracked_tag_uuid
+        
+        # Store the incoming data from this node in its round. A round is only
+        # calculated once enough nodes reported for the same tag and session.
+        if profiler.verbose:
+            print(f"Received data from '{topic}': {data}")
+        if registry.seen(node_uuid):
+            ready.extend(update_required_nodes())
+        # Tags of partitions owned by another instance can still arrive
+        # briefly after a rebalance; leave them to their owner
+        if membership is not None and not membership.owns(tag_uuid):
+            continue
+        ready.extend(fusion_window.add(tag_uuid, data['session_id'], node_uuid, data))
+        if history is not None and history_raw_samples:
+            xyz = data['xyz']
+            history.append_sample(tag_uuid, node_uuid, data['timestamp'] or time.time(),
+                                  xyz['x'], xyz['y'], xyz['z'], data['range'], data['session_id'])
+    return ready
+
+def ingest_records(node_key, records):
+    """
+    This function stores the records of one binary message from a node in
+    the round buffer, without building a dictionary per sample.
+    
+    Returns the list of fused rounds that became ready.
+    """
+    if profiler.verbose:
+        print(f"Received {len(records)} samples from '{node_key}'")
+    ready = []
+    if registry.seen(node_key):
+        ready.extend(update_required_nodes())
+    tags = round_buffer.record_tags(records, tracked_tag_uuid)
+    # Tags of partitions owned by another instance can still arrive
+    # briefly after a rebalance; leave them to their owner
+    if membership is not None:
+        owned = [membership.owns(tag) for tag in tags]
+        if not all(owned):
+            records = records[np.array(owned)]
+            tags = [tag for tag, keep in zip(tags, owned) if keep]
+    received = time.time() if enable_tracing else None
+    ready.extend(fusion_window.add_records(node_key, tags, records, received))
+    if history is not None and history_raw_samples:
+        now = time.time()
+        for tag, session, x, y, z, distance, timestamp in zip(
+                tags, records['session'].tolist(), records['x'].tolist(), records['y'].tolist(),
+                records['z'].tolist(), records['range'].tolist(), records['timestamp'].tolist()):
+            history.append_sample(tag, node_key, now if timestamp != timestamp else timestamp,
+                                  x, y, z, None if distance != distance else distance, session)
+    return ready
+
 def on_message(client, userdata, msg):
     """
     Callback function for when a message is received on a subscribed topic.
     """
     try:
-        # Decode the message from bytes to a JSON string, then parse it
-        message_json = msg.payload.decode()
-        data = json.loads(message_json)
-        
-        node_uuid = data['uuid']
+        submit_rounds(ingest_message(msg.topic, msg.payload))
         
-        # Store the incoming data from this node
-        incoming_data[node_uuid] = data
-        print(f"Received data from '{msg.topic}': {data}")
-        
-        # We need data from at least 3 nodes for triangulation in 3D space.
-        # This condition triggers the calculation.
-        if len(incoming_data) >= 3:
-            print(f"\nCollected data from {len(incoming_data)} nodes. Ready to calculate.")
-            
-            # Perform the calculation with the collected data
-            calculated_position = perform_calculation(incoming_data)
-            
-            # Publish the final calculated position to the position topic
-            client.publish(position_topic, json.dumps(calculated_position))
-            print(f"Published final position to '{position_topic}': {calculated_position}\n")
-            
-            # Clear the collected data to prepare for the next round of calculations
-            incoming_data.clear()
-            
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON message: {e}")
+    except ValueError as e:
+        print(f"Error decoding message from '{msg.topic}': {e}")
     except Exception as e:
         print(f"An error occurred: {e}")
     
@@ -109,21 +777,81 @@ def main():
     """
     Initializes the MQTT client, sets up callbacks, and starts the loop.
     """
-    client = mqtt.Client()
+    global solver, history, membership
+    
+    client = mqtt_session.make_client(mqtt_client_id)
     client.on_connect = on_connect
     client.on_message = on_message
     
+    if cluster_partitions:
+        membership = cluster.ClusterMembership(cluster_instance, cluster_partitions)
+        client.message_callback_add(cluster_members_topic, on_cluster_message)
+        client.message_callback_add(cluster.partition_topic(raw_data_topic, "+"), on_partition_message)
+        # The broker announces our departure if we drop off
+        client.will_set(member_topic(), cluster.MEMBER_OFFLINE, retain=True)
+    
+    def publish_fn(calculated_position):
+        publish_position(client, calculated_position)
+    
+    def publish_report(payload):
+        client.publish(remote_profiler.reply_topic(control_topic), payload)
+    profiler.on_report = publish_report
+    
+    pipeline = None
+    on_result = publish_fn
+    if use_async_pipeline:
+        # The MQTT callback only queues raw messages; asyncio tasks decode,
+        # solve and publish them
+        pipeline = async_pipeline.AsyncMasterPipeline(
+            ingest_message, submit_rounds, publish_fn, expire_rounds, fusion_tick,
+            ingest_queue_size, solve_queue_size, publish_queue_size)
+        client.on_message = pipeline.on_message
+        on_result = pipeline.post_result
+    
+    if history_file:
+        history = position_store.PositionStore(history_file)
+    
+    # Start the solver workers before any message can arrive
+    solver = solver_pool.ShardedSolverPool(perform_calculations, solver_workers, on_result)
+    solver.start()
+    if solver.workers > 0:
+        profiler.not_profiled = f"solving, in {solver.workers} solver worker processes"
+    if state_snapshot_file:
+        restore_state()
+    
+    # The network thread connects, and reconnects whenever the broker is lost
+    network = mqtt_session.ReconnectingLoop(client, reconnect_min_delay, reconnect_max_delay)
+    
     try:
-        client.connect(broker_address, broker_port, 60)
+        client.connect_async(broker_address, broker_port, 60)
         
-        # Start the network loop, blocking until disconnect.
-        # This client will wait for messages indefinitely.
-        client.loop_forever()
+        if pipeline is not None:
+            # Start the network loop once the pipeline's queues exist. The
+            # pipeline also closes rounds whose deadline passed.
+            asyncio.run(pipeline.run(on_ready=network.start))
+        else:
+            # Start the network loop in a background thread. This thread waits
+            # for messages indefinitely and closes rounds whose deadline passed
+            # before every node reported.
+            network.start()
+            while True:
+                time.sleep(fusion_tick)
+                submit_rounds(expire_rounds())
         
     except KeyboardInterrupt:
         print("Exiting...")
     finally:
+        if membership is not None:
+            # A clean disconnect does not send the will, so leave explicitly
+            client.publish(member_topic(), cluster.MEMBER_OFFLINE, retain=True)
+        network.stop()
         client.disconnect()
+        if state_snapshot_file:
+            # The workers save their parts before they stop
+            save_state()
+        solver.stop()
+        if history is not None:
+            history.close()
 
 if __name__ == "__main__":
     main()
@@ -3,7 +3,17 @@
 
 import paho.mqtt.client as mqtt
 import time
+import math
 import uuid
+
+import cluster
+import edge_filter
+import node_outbox
+import rate_scheduler
+import remote_profiler
+import uart_reader
+import uplink_batcher
+import wire_codec
 import socket # Import the socket library
 
 # --- MQTT Broker Configuration ---
@@ -21,10 +31,102 @@ except socket.error as e:
     node_name = str(uuid.uuid4())
     
 node_uuid = str(uuid.uuid4())
-session_id = str(uuid.uuid4())[:8]
+# The tag (e.g. the tracked iPhone) that this node ranges to. Every node must
+# use the same UUID for the same tag so the master can combine their reports.
+tag_uuid = "6f1c2a9e-3b7d-4c55-9e0a-2d8b1f4c7a10"
+# Target rate of the publish loop in samples per second. Every sample is one
+# simulated ranging round (session) of the tag.
+sample_rate_hz = 10.0
+# How often (in seconds) to print the scheduler's missed deadlines and jitter
+scheduler_report_interval = 10.0
+
+# Surveyed position (x, y, z) of this anchor in metres. It must match the
+# entry for this node in the master's anchor_positions table.
+anchor_position = (0.0, 5.0, 2.5)
 
 print(f"Node Name: {node_name}")
 print(f"Node UUID: {node_uuid}")
+print(f"Tag UUID: {tag_uuid}")
+
+# Message format to publish. Use wire_codec.FORMAT_SLASH to keep sending the
+# original "TAG_UUID/session_ID/X,Y,Z,RANGE" string to older masters.
+wire_format = wire_codec.FORMAT_BINARY
+
+# --- Uplink Batching ---
+# Samples are published together once batch_max_samples are waiting, or when
+# the oldest one has waited batch_max_delay_ms milliseconds.
+# batch_max_samples = 1 publishes every sample on its own.
+batch_max_samples = 1
+batch_max_delay_ms = 100
+
+# --- Latency Tracing ---
+# Adds the publish time to every sample so the masters and clients can measure
+# the latency of each hop (see latency_tracing.py)
+enable_tracing = False
+
+# --- Cluster Configuration ---
+# With several masters sharing the site (see cluster.py), set this to the
+# masters' cluster_partitions so samples reach the master that owns the tag
+cluster_partitions = 0
+
+# Define the topic to publish to, using the dynamic hostname. In a cluster
+# every sample goes to the partition topic of its tag instead (see
+# sample_topic).
+publish_topic = f"home/nodes/{node_name}"
+
+# --- Edge Filtering ---
+# Ranges more than filter_threshold scaled MADs from the median of the tag's
+# last filter_window ranges are outliers and are not published. With
+# filter_decimation = n only every n-th session is published, the same ones on
+# every node. See edge_filter.py.
+enable_filter = False
+filter_window = 15
+filter_threshold = 3.0
+filter_decimation = 1
+
+# --- UART Configuration ---
+# Serial port of the UWB module (see uart_reader.py for the frame format).
+# With uart_port = None the node publishes the simulated get_uwb_data() below.
+uart_port = None
+uart_baudrate = 115200
+# Tag UUIDs of the tag addresses reported by the module
+uart_tag_names = {}
+
+# --- Offline Outbox ---
+# Payloads that cannot be published while the node is disconnected are kept in
+# outbox_file (see node_outbox.py), up to outbox_max_samples samples; beyond
+# that the oldest are dropped. After reconnecting they are sent in batches of
+# outbox_batch_samples, at most outbox_drain_rate samples per second, next to
+# the live samples. With outbox_file = None they are dropped.
+# The master only fuses a replayed session while its round is open, so keep
+# outbox_batch_samples and outbox_drain_rate * round_timeout well below the
+# master's fusion_capacity (256); larger batches evict their own rounds
+# before the other nodes' samples of the same sessions arrive. The nodes'
+# backlogs fuse when they reconnect within round_timeout of each other.
+outbox_file = "node_outbox.sqlite"
+outbox_max_samples = 100000
+outbox_batch_samples = 50
+outbox_drain_rate = 100.0
+# Samples are published with QoS publish_qos. With 1 the broker confirms
+# every sample, and keeps them for the master while it reconnects or restarts
+# (the master holds a persistent session), so none is lost on the way.
+# 0 is cheaper but drops whatever arrives while the master is away.
+publish_qos = 1
+# paho keeps at most publish_queue_size messages itself (in flight or waiting
+# to be sent). Once those are taken, publishing fails and the payloads go to
+# the outbox, instead of piling up in memory on a link that stopped answering.
+publish_queue_size = 40
+
+# --- Remote Profiling ---
+# JSON commands on control_topic profile this node for a while, and the
+# compressed result is published on the reply topic (see remote_profiler.py).
+# With print_messages = False the per-message prints are left out; a
+# {"verbose": ...} command switches them at run time.
+print_messages = True
+control_topic = remote_profiler.control_topic("home", node_name)
+
+# Profiles this node on command, and says whether to print per-message lines
+profiler = remote_profiler.RemoteProfiler(node_name, print_messages)
 
 # --- Data Simulation (replace with your UWB board logic) ---
 def get_uwb_data():
@@ -34,21 +136,19 @@ def get_uwb_data():
     It generates simulated ranging data. In your actual application, you would
     replace this with the code that reads data from the UWB board (e.g., via UART).
     
-    Returns a string in the format "UUID/session_ID/X,Y,Z".
+    Returns a sample dictionary (see wire_codec.make_sample) whose range is the
+    distance in metres from this anchor to the simulated tag position.
     """
-    global session_id
-    
-    # Increment the session ID to show new data rounds
-    session_id = str(int(session_id, 16) + 1)[-8:]
+    # Number the simulated rounds from the wall clock, so that every node
+    # reports the same session ID for the same round of the tag
+    session_id = str(round(time.time() * sample_rate_hz))
     
     x = 1.0 + time.time() % 10
     y = 5.0 - time.time() % 8
     z = 3.0 + time.time() % 5
+    distance = math.dist((x, y, z), anchor_position)
     
-    # Format the data into the requested string format
-    data_string = f"{node_uuid}/{session_id}/{x:.2f},{y:.2f},{z:.2f}"
-    
-    return data_string
+    return wire_codec.make_sample(node_uuid, tag_uuid, session_id, x, y, z, distance, time.time())
 
 # --- MQTT Callback Functions ---
 def on_connect(client, userdata, flags, rc):
@@ -59,6 +159,7 @@ def on_connect(client, userdata, flags, rc):
         print("Connected to MQTT Broker!")
         # Publish an "online" status message when connecting
         client.publish(f"home/status/{node_name}", "online", retain=True)
+        client.subscribe(control_topic)
     else:
         print(f"Failed to connect, return code {rc}")
 
@@ -71,44 +172,180 @@ def on_disconnect(client, userdata, rc):
     if rc != 0:
         client.publish(f"home/status/{node_name}", "offline", retain=True)
 
+def on_message(client, userdata, msg):
+    """
+    Callback function for commands on the control topic.
+    """
+    try:
+        print(profiler.handle(msg.payload))
+    except ValueError as e:
+        print(f"Invalid control message: {e}")
+
+# --- Publishing ---
+def sample_topic(uwb_data):
+    """
+    This function returns the topic to publish a sample on: publish_topic, or in
+    a cluster the partition topic of the sample's tag, so it reaches the master
+    that owns the tag. A node reporting many tags publishes on many topics.
+    """
+    if not cluster_partitions:
+        return publish_topic
+    return cluster.partition_topic(
+        publish_topic, cluster.partition_of(uwb_data['tag'], cluster_partitions), node_name)
+
+def publish_now(client, topic, payload):
+    """
+    This function publishes a payload and returns True if paho took it. paho
+    keeps a QoS 1 message it could not send for lack of a connection and
+    sends it after reconnecting; such a message is taken off paho's queue
+    again here, so it is only kept (and sent once) by whoever handles the
+    failure.
+    """
+    info = client.publish(topic, payload, qos=publish_qos)
+    if info.rc == mqtt.MQTT_ERR_NO_CONN and publish_qos > 0:
+        with client._out_message_mutex:
+            client._out_messages.pop(info.mid, None)
+    return info.rc == mqtt.MQTT_ERR_SUCCESS
+
+def publish_or_store(client, outbox, topic, payload):
+    """
+    This function publishes a payload, or stores it in the outbox while the
+    node is not connected or paho's queue is full (without an outbox it is
+    dropped). Returns True if the payload was published.
+    """
+    if client.is_connected() and publish_now(client, topic, payload):
+        return True
+    if outbox is not None:
+        outbox.put(topic, payload)
+    return False
+
+def drain_outbox(client, outbox):
+    """
+    This function sends part of the stored backlog if the node is connected.
+    """
+    if outbox is None or not len(outbox) or not client.is_connected():
+        return
+    sent = outbox.drain(lambda topic, payload: publish_now(client, topic, payload))
+    if sent:
+        print(f"Sent {sent} stored samples, {len(outbox)} still waiting")
+
 # --- Main Program ---
 def main():
     """
     Initializes the MQTT client and starts the data publishing loop.
     """
     client = mqtt.Client()
+    client.max_queued_messages_set(publish_queue_size)
     client.on_connect = on_connect
     client.on_disconnect = on_disconnect
+    client.on_message = on_message
+    
+    # Profiler reports go out on the reply topic
+    def publish_report(payload):
+        client.publish(remote_profiler.reply_topic(control_topic), payload)
+    profiler.on_report = publish_report
+    
+    # Reads the ranging reports of the UWB module, if one is connected
+    reader = None
+    if uart_port is not None:
+        reader = uart_reader.UartReader(uart_reader.open_serial(uart_port, uart_baudrate))
+    
+    # Drops outliers (and decimates) before samples reach the batch
+    edge = None
+    if enable_filter:
+        edge = edge_filter.EdgeFilter(filter_window, filter_threshold, filter_decimation)
+    
+    # Keeps the payloads that cannot be published while disconnected
+    outbox = None
+    if outbox_file:
+        outbox = node_outbox.NodeOutbox(
+            outbox_file, outbox_max_samples, outbox_batch_samples, outbox_drain_rate, wire_format)
+        if len(outbox):
+            print(f"Outbox holds {len(outbox)} samples from before the restart")
+    
+    # Collects samples into batches before they are published, one batch per
+    # topic (in a cluster every partition has its own topic)
+    batchers = {}
     
     # Set up Last Will and Testament (LWT) message
     client.will_set(f"home/status/{node_name}", "offline", retain=True)
     
     try:
-        # Connect to the broker
-        client.connect(broker_address, broker_port, 60)
+        # Connect to the broker from the network thread, which keeps retrying
+        # while the broker is down, so the node samples into the outbox until then
+        client.connect_async(broker_address, broker_port, 60)
         client.loop_start() # Start a background thread
         
-        # Define the topic to publish to, using the dynamic hostname
-        publish_topic = f"home/nodes/{node_name}"
+        # Paces the loop at sample_rate_hz on absolute deadlines, so the period
+        # does not grow with the time spent publishing and printing
+        scheduler = rate_scheduler.RateScheduler(sample_rate_hz)
+        next_report = time.monotonic() + scheduler_report_interval
         
         while True:
-            # Get the simulated UWB data string
-            uwb_data_string = get_uwb_data()
+            # A cProfile run starts and ends in this loop
+            profiler.poll()
+            
+            if reader is not None:
+                # Take every frame the UWB module sent. The module sets the
+                # pace; the timeout only lets a quiet batch go out in time.
+                samples = [uart_reader.to_sample(frame, node_uuid, uart_tag_names)
+                           for frame in reader.read(batch_max_delay_ms / 1000.0)]
+            else:
+                # Wait for the next sampling deadline and get the simulated UWB data
+                scheduler.wait()
+                samples = [get_uwb_data()]
             
-            # Publish the string message to the node's specific topic
-            client.publish(publish_topic, uwb_data_string)
-            print(f"Published to '{publish_topic}': {uwb_data_string}")
+            # Add the samples to the batch of their topic and publish the batch once it is due
+            for uwb_data in samples:
+                if edge is not None and not edge.accept(uwb_data):
+                    continue
+                topic = sample_topic(uwb_data)
+                batcher = batchers.get(topic)
+                if batcher is None:
+                    batcher = batchers[topic] = uplink_batcher.UplinkBatcher(
+                        batch_max_samples, batch_max_delay_ms, wire_format, enable_tracing)
+                payload = batcher.add(uwb_data)
+                if payload is not None:
+                    # With printing off the outbox stats still report what was stored
+                    published = publish_or_store(client, outbox, topic, payload)
+                    if profiler.verbose and published:
+                        print(f"Published to '{topic}' ({len(payload)} bytes), latest sample: {uwb_data}")
+                    elif profiler.verbose and outbox is not None:
+                        print(f"Not published, stored {len(payload)} bytes in the outbox")
+                    elif profiler.verbose:
+                        print(f"Not published, dropped {len(payload)} bytes")
+            # Samples left waiting (after a quiet read or dropped samples) still go out in time
+            for topic, batcher in batchers.items():
+                if len(batcher):
+                    payload = batcher.poll()
+                    if payload is not None:
+                        publish_or_store(client, outbox, topic, payload)
+            # Send part of the backlog from while the node was disconnected
+            drain_outbox(client, outbox)
             
-            # Wait before the next publish
-            time.sleep(3)
+            # Print the missed deadlines and jitter every few seconds
+            if time.monotonic() >= next_report:
+                print(scheduler.report() if reader is None else reader.stats())
+                if edge is not None:
+                    print(edge.stats())
+                if outbox is not None:
+                    print(outbox.stats())
+                next_report += scheduler_report_interval
             
     except KeyboardInterrupt:
         print("Exiting...")
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
+        # Send the samples still waiting in the batches
+        for topic, batcher in batchers.items():
+            payload = batcher.flush()
+            if payload is not None:
+                publish_or_store(client, outbox, topic, payload)
         client.loop_stop()
         client.disconnect()
+        if outbox is not None:
+            outbox.close()
         
 if __name__ == "__main__":
     main()
@@ -0,0 +1,198 @@
+# solver_pool.py
+# This module spreads the master's position calculations over several
+# processes so a single Raspberry Pi master can use all of its cores.
+# Work is sharded by tag uuid: every round of a tag goes to the same worker,
+# so any per-tag state kept by the solve function stays in one process.
+
+import multiprocessing
+import queue
+import threading
+import zlib
+
+
+# --- Sharding ---
+def shard_of(tag, shards):
+    """
+    This function maps a tag uuid to a shard number in range(shards).
+
+    It uses CRC32 instead of hash() because Python salts string hashes per
+    process, and the mapping must be the same in every process.
+    """
+    return zlib.crc32(str(tag).encode()) % shards
+
+
+# Shard of this process and the number of shards; a worker process sets its
+# own in _worker_main, and the master process solves every shard itself
+_shard = (0, 1)
+
+
+def current_shard():
+    """
+    This function returns (shard, shards) for the calling process: the shard
+    of a worker, or (0, 1) in the master process. Functions run through
+    configure() use it to tell which tags belong to their worker.
+    """
+    return _shard
+
+
+# --- Worker Process ---
+def _worker_main(solve_fn, in_queue, out_queue, max_batch, shard=0, shards=1):
+    """
+    This function is the main loop of one worker process.
+
+    It waits for rounds, grabs whatever else is already queued (up to
+    max_batch rounds) so that busy periods are solved in large batches, and
+    sends the results back to the master process. A (function, args) tuple
+    from configure() is run after the rounds queued before it. None stops
+    the worker.
+    """
+    global _shard
+    _shard = (shard, shards)
+    item = in_queue.get()
+    while item is not None:
+        if isinstance(item, tuple):
+            _run_configure(item)
+            item = in_queue.get()
+            continue
+
+        rounds = list(item)
+        item = _EMPTY
+        while len(rounds) < max_batch:
+            try:
+                more = in_queue.get_nowait()
+            except queue.Empty:
+                break
+            if more is None or isinstance(more, tuple):
+                # Solve what we have before stopping or reconfiguring
+                item = more
+                break
+            rounds.extend(more)
+
+        try:
+            out_queue.put(solve_fn(rounds))
+        except Exception as e:
+            print(f"Solver worker error: {e}")
+        if item is _EMPTY:
+            item = in_queue.get()
+
+
+# Marks "nothing taken from the queue yet" in _worker_main
+_EMPTY = object()
+
+
+def _run_configure(item):
+    config_fn, args = item
+    try:
+        config_fn(*args)
+    except Exception as e:
+        print(f"Solver worker configuration error: {e}")
+
+
+# --- Pool ---
+class ShardedSolverPool:
+    """
+    This class runs solve_fn over fused rounds, either inline or in a pool
+    of worker processes.
+
+    solve_fn takes a list of fused rounds and returns a list of results. It
+    must be a module-level function so it can be sent to the workers.
+    on_result is called in the master process once for every result.
+
+    With workers = 0 the rounds are solved immediately in the calling thread,
+    which is the simplest setup for small sites. Calls from several threads
+    (the network thread and the main loop closing rounds) take turns, as
+    solve_fn and on_result keep per-tag state that is not thread-safe. With workers > 0 each tag
+    is pinned to one worker by shard_of(), and a background thread hands the
+    results to on_result as they come back.
+    """
+
+    def __init__(self, solve_fn, workers, on_result, max_batch=512):
+        self.solve_fn = solve_fn
+        self.workers = workers
+        self.on_result = on_result
+        self.max_batch = max_batch
+
+        self._processes = []
+        self._in_queues = []
+        self._out_queue = None
+        self._collector = None
+        self._inline_lock = threading.Lock()
+
+    def start(self):
+        """
+        This function starts the worker processes and the result thread.
+        """
+        if self.workers <= 0:
+            return
+        self._out_queue = multiprocessing.Queue()
+        for shard in range(self.workers):
+            in_queue = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=_worker_main,
+                args=(self.solve_fn, in_queue, self._out_queue, self.max_batch, shard, self.workers),
+                daemon=True,
+            )
+            process.start()
+            self._in_queues.append(in_queue)
+            self._processes.append(process)
+
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def submit(self, fused_rounds):
+        """
+        This function queues fused rounds for solving.
+        """
+        if not fused_rounds:
+            return
+        if self.workers <= 0:
+            with self._inline_lock:
+                for result in self.solve_fn(fused_rounds):
+                    self.on_result(result)
+            return
+
+        # Group the rounds by shard so every worker gets one message
+        shards = {}
+        for fused_round in fused_rounds:
+            shard = shard_of(fused_round['tag'], self.workers)
+            shards.setdefault(shard, []).append(fused_round)
+        for shard, rounds in shards.items():
+            self._in_queues[shard].put(rounds)
+
+    def configure(self, config_fn, *args):
+        """
+        This function runs config_fn(*args) in every worker process, after
+        the rounds already queued for it. Use it to change module state the
+        solve function depends on, such as anchor positions. config_fn must be
+        a module-level function. Without workers there is no other process,
+        so the caller's own state is all there is and nothing is sent.
+        """
+        for in_queue in self._in_queues:
+            in_queue.put((config_fn, args))
+
+    def stop(self):
+        """
+        This function stops the workers after they finish their queued rounds.
+        """
+        for in_queue in self._in_queues:
+            in_queue.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+        if self._out_queue is not None:
+            self._out_queue.put(None)
+        if self._collector is not None:
+            self._collector.join(timeout=5)
+        self._processes = []
+        self._in_queues = []
+
+    def _collect(self):
+        # Runs in a background thread of the master process
+        while True:
+            results = self._out_queue.get()
+            if results is None:
+                break
+            for result in results:
+                try:
+                    self.on_result(result)
+                except Exception as e:
+                    print(f"Error handling solver result: {e}")
@@ -0,0 +1,79 @@
+# state_snapshot.py
+# This module saves the master's per-tag state to disk and loads it back
+# when the master starts, so a restarted master carries on filtering and
+# refining its tags where it stopped instead of warming up again.
+#
+# The state lives in several processes: the master process keeps the zones
+# every tag is in, and the solver worker of a tag's shard keeps its Kalman
+# filter and warm start. Every process saves its own part:
+#   <path>           the master process
+#   <path>.solver<N>  solver worker N (the master process itself without workers)
+# A part is written to a temporary file and renamed over the previous one,
+# so a crash while saving leaves the last snapshot intact. Parts are pickled
+# and only meant to be read back by the same version of the master.
+
+import glob
+import os
+import pickle
+
+
+def part_path(path, shard):
+    """
+    This function returns the file of the solver part of a shard.
+    """
+    return f"{path}.solver{shard}"
+
+
+def save(path, state):
+    """
+    This function writes state to path, replacing the old file at once.
+    """
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+
+def load(path):
+    """
+    This function returns the state saved in path, or None if there is none
+    or it cannot be read.
+    """
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Ignoring unreadable snapshot '{path}': {e!r}")
+        return None
+
+
+def _parts(path):
+    # {shard: file} of the solver parts on disk
+    parts = {}
+    prefix = part_path(path, "")
+    for name in glob.glob(glob.escape(prefix) + "*"):
+        shard = name[len(prefix):]
+        if shard.isdigit():
+            parts[int(shard)] = name
+    return parts
+
+
+def load_parts(path):
+    """
+    This function returns the states of all solver parts of path, whatever
+    number of workers saved them.
+    """
+    parts = (load(name) for _, name in sorted(_parts(path).items()))
+    return [state for state in parts if state is not None]
+
+
+def remove_parts(path, shards):
+    """
+    This function deletes the solver parts of shards >= shards, left over
+    from a run with more workers, so they are not loaded again later.
+    """
+    for shard, name in _parts(path).items():
+        if shard >= shards:
+            os.remove(name)
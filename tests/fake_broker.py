@@ -0,0 +1,217 @@
+# fake_broker.py
+# A small MQTT 3.1.1 broker for the tests that run masters and nodes in
+# separate processes. It knows just enough for paho: CONNECT with a last will,
+# SUBSCRIBE and UNSUBSCRIBE with "+" and "#" wildcards, retained messages,
+# PUBLISH with QoS 0 and 1, PINGREQ and DISCONNECT. Sessions are not kept and
+# QoS 1 messages are sent once without waiting for their PUBACK.
+
+import socket
+import struct
+import threading
+
+import paho.mqtt.client as mqtt
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def _packet(kind, body, flags=0):
+    # Fixed header with the variable-length "remaining length"
+    header = bytearray([kind << 4 | flags])
+    length = len(body)
+    while True:
+        byte, length = length % 128, length // 128
+        header.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(header) + body
+
+
+def _string(data, offset):
+    (length,) = struct.unpack_from("!H", data, offset)
+    offset += 2
+    return data[offset:offset + length], offset + length
+
+
+class _Connection:
+    def __init__(self, broker, sock):
+        self.broker = broker
+        self.sock = sock
+        self.client_id = None
+        self.will = None
+        self.subscriptions = {}
+        self._send_lock = threading.Lock()
+        self._next_id = 0
+
+    def send(self, data):
+        with self._send_lock:
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                pass
+
+    def deliver(self, topic, payload, qos, retain=False):
+        body = struct.pack("!H", len(topic)) + topic
+        if qos:
+            self._next_id = self._next_id % 0xFFFF + 1
+            body += struct.pack("!H", self._next_id)
+        self.send(_packet(PUBLISH, body + payload, qos << 1 | int(retain)))
+
+    def _read(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("closed")
+            data += chunk
+        return data
+
+    def _read_packet(self):
+        first = self._read(1)[0]
+        length, shift = 0, 0
+        while True:
+            byte = self._read(1)[0]
+            length |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        return first >> 4, first & 0x0F, self._read(length)
+
+    def run(self):
+        clean = False
+        try:
+            while True:
+                kind, flags, body = self._read_packet()
+                if kind == CONNECT:
+                    self._connect(body)
+                elif kind == PUBLISH:
+                    self._publish(flags, body)
+                elif kind == SUBSCRIBE:
+                    self._subscribe(body)
+                elif kind == UNSUBSCRIBE:
+                    self._unsubscribe(body)
+                elif kind == PINGREQ:
+                    self.send(_packet(PINGRESP, b""))
+                elif kind == DISCONNECT:
+                    clean = True
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.broker.remove(self, None if clean else self.will)
+            self.sock.close()
+
+    def _connect(self, body):
+        _, offset = _string(body, 0)
+        offset += 1
+        flags = body[offset]
+        offset += 3
+        self.client_id, offset = _string(body, offset)
+        if flags & 0x04:
+            topic, offset = _string(body, offset)
+            payload, offset = _string(body, offset)
+            self.will = (topic, payload, flags >> 3 & 0x03, bool(flags & 0x20))
+        self.send(_packet(CONNACK, b"\x00\x00"))
+
+    def _publish(self, flags, body):
+        qos, retain = flags >> 1 & 0x03, bool(flags & 0x01)
+        topic, offset = _string(body, 0)
+        if qos:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+            self.send(_packet(PUBACK, packet_id))
+        self.broker.publish(topic, body[offset:], qos, retain)
+
+    def _subscribe(self, body):
+        packet_id, offset = body[:2], 2
+        granted = bytearray()
+        topics = []
+        while offset < len(body):
+            topic, offset = _string(body, offset)
+            qos = min(body[offset], 1)
+            offset += 1
+            granted.append(qos)
+            topics.append((topic.decode(), qos))
+        self.broker.subscribe(self, topics, _packet(SUBACK, packet_id + bytes(granted)))
+
+    def _unsubscribe(self, body):
+        packet_id, offset = body[:2], 2
+        while offset < len(body):
+            topic, offset = _string(body, offset)
+            self.broker.unsubscribe(self, topic.decode())
+        self.send(_packet(UNSUBACK, packet_id))
+
+
+class FakeBroker:
+    """
+    This class runs the broker on a free local port in background threads.
+    """
+
+    def __init__(self):
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        self._connections = []
+        self._retained = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.close()
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            connection = _Connection(self, sock)
+            with self._lock:
+                self._connections.append(connection)
+            threading.Thread(target=connection.run, daemon=True).start()
+
+    def remove(self, connection, will):
+        with self._lock:
+            if connection in self._connections:
+                self._connections.remove(connection)
+        if will is not None:
+            self.publish(*will)
+
+    def publish(self, topic, payload, qos, retain):
+        with self._lock:
+            if retain:
+                if payload:
+                    self._retained[topic] = payload
+                else:
+                    self._retained.pop(topic, None)
+            name = topic.decode()
+            for connection in self._connections:
+                levels = [sub_qos for sub, sub_qos in connection.subscriptions.items()
+                          if mqtt.topic_matches_sub(sub, name)]
+                if levels:
+                    connection.deliver(topic, payload, min(qos, max(levels)))
+
+    def subscribe(self, connection, topics, suback):
+        # The SUBACK and the retained messages go out under the lock, so they
+        # come before any message published after the subscription
+        with self._lock:
+            connection.send(suback)
+            for topic, qos in topics:
+                connection.subscriptions[topic] = qos
+                for name, payload in self._retained.items():
+                    if mqtt.topic_matches_sub(topic, name.decode()):
+                        connection.deliver(name, payload, qos, retain=True)
+
+    def unsubscribe(self, connection, topic):
+        with self._lock:
+            connection.subscriptions.pop(topic, None)
@@ -0,0 +1,127 @@
+# test_cluster.py
+# Partition ownership of the cluster members, and two masters sharing the
+# tags of one site through a broker, each tag solved by exactly one of them.
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import paho.mqtt.client as mqtt
+
+import cluster
+import wire_codec
+from fake_broker import FakeBroker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARTITIONS = 8
+
+
+def test_owns_nothing_until_settled():
+    membership = cluster.ClusterMembership("a", PARTITIONS)
+    assert membership.update("b", b"online") == ([], [])
+    assert not membership.owned
+    assert membership.hold("early sample")
+
+    # Our own "online" comes back after the retained list
+    gained, lost = membership.update("a", b"online")
+    assert gained == cluster.assign(PARTITIONS, ["a", "b"])["a"] and not lost
+    assert not membership.hold("late sample")
+    assert membership.take_held() == ["early sample"]
+    assert membership.take_held() == []
+
+    # b leaves, a takes over its partitions
+    gained, lost = membership.update("b", b"offline")
+    assert sorted(membership.owned) == list(range(PARTITIONS)) and gained and not lost
+
+
+def test_settle_after_grace_period():
+    membership = cluster.ClusterMembership("a", PARTITIONS)
+    membership.update("b", b"online")
+    gained, _ = membership.settle()
+    assert gained == cluster.assign(PARTITIONS, ["a", "b"])["a"]
+    assert membership.settle() == ([], [])
+    # A stale "offline" of our previous run changes nothing
+    assert membership.update("a", b"offline") == ([], [])
+
+
+# Runs rpi_master.py against the test broker, as a cluster member
+MASTER = """
+import rpi_master as m
+m.broker_address = "127.0.0.1"
+m.broker_port = {port}
+m.cluster_partitions = {partitions}
+m.solver_workers = 0
+m.history_file = None
+m.state_snapshot_file = None
+m.profiler.verbose = False
+m.main()
+"""
+
+
+def start_master(name, port, log):
+    env = dict(os.environ, UWB_MASTER_NAME=name, PYTHONUNBUFFERED="1")
+    return subprocess.Popen(
+        [sys.executable, "-c", MASTER.format(port=port, partitions=PARTITIONS)],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def test_masters_share_tags(tmp_path):
+    broker = FakeBroker().start()
+    members = {}
+    positions = []
+
+    def on_message(client, userdata, msg):
+        if msg.topic.startswith("uwb/cluster/members/"):
+            members[msg.topic.split("/")[-1]] = msg.payload.decode()
+        else:
+            positions.append(json.loads(msg.payload))
+
+    client = mqtt.Client()
+    client.on_message = on_message
+    client.connect("127.0.0.1", broker.port)
+    client.subscribe([("uwb/cluster/members/+", 1), ("uwb/position", 1)])
+    client.loop_start()
+
+    masters = []
+    try:
+        with open(tmp_path / "masters.log", "w") as log:
+            masters = [start_master(name, broker.port, log) for name in ("master-a", "master-b")]
+            wait_for(lambda: members == {"master-a": "online", "master-b": "online"}, timeout=30.0)
+            # Give both time to settle and move their subscriptions
+            time.sleep(1.0)
+
+            tags = [f"tag-{i}" for i in range(24)]
+            for session in range(3):
+                for tag in tags:
+                    partition = cluster.partition_of(tag, PARTITIONS)
+                    for node in ("node-1", "node-2", "node-3"):
+                        sample = wire_codec.make_sample(None, tag, session, 1.0, 2.0, 0.5, timestamp=time.time())
+                        topic = cluster.partition_topic("uwb/raw_data/+", partition, node)
+                        client.publish(topic, wire_codec.encode(sample, wire_codec.FORMAT_JSON), qos=1)
+            wait_for(lambda: len(positions) >= len(tags) * 3)
+            time.sleep(0.5)
+    finally:
+        for master in masters:
+            master.send_signal(signal.SIGINT)
+        for master in masters:
+            try:
+                master.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                master.kill()
+        client.loop_stop()
+        client.disconnect()
+        broker.stop()
+
+    solved = sorted((p["uuid"], p["session_id"]) for p in positions)
+    assert solved == sorted((tag, session) for tag in tags for session in range(3)), \
+        (tmp_path / "masters.log").read_text()
@@ -0,0 +1,70 @@
+# test_edge_filter.py
+# The sliding median and MAD against a full sort, and the outlier and
+# decimation decisions of the node filter.
+
+import random
+import statistics
+
+import pytest
+
+import edge_filter
+import wire_codec
+
+
+def test_sliding_median_and_mad_match_a_full_sort():
+    rng = random.Random(1)
+    for window in (1, 2, 5, 8, 15):
+        sliding = edge_filter.SlidingMedian(window)
+        values = []
+        for _ in range(200):
+            # Repeated values and jumps, like quantized ranges
+            value = round(rng.choice([rng.gauss(5.0, 0.1), rng.uniform(0.0, 20.0)]), 2)
+            sliding.add(value)
+            values = (values + [value])[-window:]
+            median = statistics.median(values)
+            assert sliding.median() == pytest.approx(median)
+            assert sliding.mad() == pytest.approx(statistics.median(abs(v - median) for v in values))
+        assert len(sliding) == window
+
+
+def sample(tag, session, distance):
+    return wire_codec.make_sample(None, tag, session, 0.0, 0.0, 0.0, distance)
+
+
+def test_outliers_are_rejected():
+    rng = random.Random(2)
+    edge = edge_filter.EdgeFilter(window=15, threshold=3.0)
+    for session in range(30):
+        assert edge.accept(sample("tag", session, 5.0 + rng.gauss(0.0, 0.02)))
+    # A multipath range far off the recent ones is dropped
+    assert not edge.accept(sample("tag", 30, 9.0))
+    # Each tag has its own window, so the same range is fine for another tag
+    for session in range(5):
+        assert edge.accept(sample("other", session, 9.0))
+    # Samples without a range always pass
+    assert edge.accept(sample("tag", 31, None))
+    assert edge.rejected == 1 and edge.published == 36
+
+
+def test_a_real_jump_becomes_the_new_median():
+    edge = edge_filter.EdgeFilter(window=9, threshold=3.0)
+    for session in range(9):
+        edge.accept(sample("tag", session, 2.0))
+    accepted = [edge.accept(sample("tag", 9 + i, 6.0)) for i in range(9)]
+    # Rejected until the new range fills half the window, accepted after
+    assert accepted[:4] == [False] * 4 and all(accepted[5:])
+
+
+def test_steady_ranges_do_not_reject_small_noise():
+    edge = edge_filter.EdgeFilter(min_mad=0.02)
+    for session in range(15):
+        edge.accept(sample("tag", session, 3.0))
+    assert edge.accept(sample("tag", 15, 3.05))
+
+
+def test_decimation_keeps_the_same_sessions_on_every_node():
+    edge = edge_filter.EdgeFilter(decimation=4)
+    kept = [session for session in range(20) if edge.accept(sample("tag", session, None))]
+    assert kept == [0, 4, 8, 12, 16]
+    assert edge.decimated == 15
+    assert "5 published" in edge.stats()
@@ -0,0 +1,64 @@
+# test_fusion.py
+# Rounds of the fusion window: completion, expiry, late samples and the
+# capacity limit.
+
+import fusion
+
+
+def add_nodes(window, tag, session, nodes, now):
+    ready = []
+    for node in nodes:
+        ready.extend(window.add(tag, session, node, {"node": node}, now=now))
+    return ready
+
+
+def test_round_completes_with_expected_nodes():
+    window = fusion.FusionWindow(expected_nodes=3, min_nodes=2, round_timeout=1.0)
+    assert add_nodes(window, "tag", 1, ["a", "b"], now=0.0) == []
+    # Another session of the same tag is a round of its own
+    assert add_nodes(window, "tag", 2, ["a"], now=0.0) == []
+    ready = window.add("tag", 1, "c", {"node": "c"}, now=0.1)
+    assert len(ready) == 1
+    assert ready[0]["tag"] == "tag" and ready[0]["session_id"] == 1 and ready[0]["complete"]
+    assert sorted(ready[0]["samples"]) == ["a", "b", "c"]
+    assert window.pending() == 1 and window.rounds_complete == 1
+
+
+def test_expiry_keeps_rounds_with_min_nodes():
+    window = fusion.FusionWindow(expected_nodes=3, min_nodes=2, round_timeout=1.0)
+    add_nodes(window, "tag_a", 1, ["a", "b"], now=0.0)
+    add_nodes(window, "tag_b", 1, ["a"], now=0.5)
+    assert window.expire(now=0.9) == []
+
+    ready = window.expire(now=1.0)
+    assert [(r["tag"], r["complete"]) for r in ready] == [("tag_a", False)]
+    assert window.pending() == 1
+    # The single-node round of tag_b is dropped at its own deadline
+    assert window.expire(now=1.5) == []
+    assert window.pending() == 0
+    assert window.rounds_timed_out == 1 and window.rounds_dropped == 1
+
+
+def test_late_samples_do_not_reopen_a_round():
+    window = fusion.FusionWindow(expected_nodes=2, min_nodes=2, round_timeout=1.0)
+    assert len(add_nodes(window, "tag", 7, ["a", "b"], now=0.0)) == 1
+    assert window.add("tag", 7, "c", {"node": "c"}, now=0.2) == []
+    assert window.pending() == 0 and window.late_samples == 1
+
+
+def test_capacity_closes_the_oldest_round():
+    window = fusion.FusionWindow(expected_nodes=3, min_nodes=2, round_timeout=10.0, capacity=2)
+    add_nodes(window, "tag", 1, ["a", "b"], now=0.0)
+    add_nodes(window, "tag", 2, ["a", "b"], now=0.1)
+    ready = window.add("tag", 3, "a", {"node": "a"}, now=0.2)
+    assert [(r["session_id"], r["complete"]) for r in ready] == [(1, False)]
+    assert window.pending() == 2
+
+
+def test_fewer_expected_nodes_close_open_rounds():
+    window = fusion.FusionWindow(expected_nodes=3, min_nodes=2, round_timeout=1.0)
+    add_nodes(window, "tag_a", 1, ["a", "b"], now=0.0)
+    add_nodes(window, "tag_b", 1, ["a"], now=0.0)
+    ready = window.set_expected_nodes(2)
+    assert [(r["tag"], r["complete"]) for r in ready] == [("tag_a", True)]
+    assert len(window.add("tag_b", 1, "b", {"node": "b"}, now=0.1)) == 1
@@ -0,0 +1,88 @@
+# test_geofence.py
+# Zone events of the geofence engine: enter, exit with hysteresis, dwell,
+# timeouts, removed zones and stale fixes.
+
+import time
+
+import geofence
+
+ZONES = {
+    "kitchen": {"min": [0, 0], "max": [4, 3]},
+    "desk": {"polygon": [[6, 0], [9, 0], [9, 2], [6, 2]], "z": [0, 2], "dwell": 2.0},
+}
+
+
+def make_engine():
+    engine = geofence.ZoneEngine(cell_size=2.0, hysteresis=0.3, dwell_time=5.0, tag_timeout=30.0)
+    engine.set_zones(ZONES)
+    return engine
+
+
+def kinds(events):
+    return [(event["zone"], event["event"]) for event in events]
+
+
+def test_enter_and_exit_with_hysteresis():
+    engine = make_engine()
+    t = time.time()
+    assert kinds(engine.update("tag", 2.0, 1.0, 0.0, t)) == [("kitchen", "enter")]
+    assert engine.occupants("kitchen") == ["tag"]
+    # Just outside the edge, within the hysteresis: still inside
+    assert engine.update("tag", 4.2, 1.0, 0.0, t + 0.1) == []
+    assert engine.update("tag", 3.9, 1.0, 0.0, t + 0.2) == []
+    assert engine.update("tag", 4.25, 1.0, 0.0, t + 0.3) == []
+    events = engine.update("tag", 4.5, 1.0, 0.0, t + 0.4)
+    assert kinds(events) == [("kitchen", "exit")]
+    assert abs(events[0]["duration"] - 0.4) < 1e-6 and "reason" not in events[0]
+    assert engine.occupants("kitchen") == []
+    # Back in just over the edge: enter again at once
+    assert kinds(engine.update("tag", 3.9, 1.0, 0.0, t + 0.5)) == [("kitchen", "enter")]
+
+
+def test_polygon_zone_with_height_and_dwell():
+    engine = make_engine()
+    t = time.time()
+    # Above the zone's height range
+    assert engine.update("tag", 7.0, 1.0, 3.0, t) == []
+    assert kinds(engine.update("tag", 7.0, 1.0, 1.0, t + 0.1)) == [("desk", "enter")]
+    assert engine.update("tag", 7.1, 1.0, 1.0, t + 1.0) == []
+    events = engine.update("tag", 7.2, 1.0, 1.0, t + 2.2)
+    # The zone's own dwell time applies, and the dwell is reported once
+    assert kinds(events) == [("desk", "dwell")] and abs(events[0]["duration"] - 2.1) < 1e-6
+    assert engine.update("tag", 7.2, 1.0, 1.0, t + 10.0) == []
+
+
+def test_timeout_and_removed_zone():
+    engine = make_engine()
+    t = time.time()
+    engine.update("a", 1.0, 1.0, 0.0, t)
+    engine.update("b", 7.0, 1.0, 1.0, t)
+    engine.set_zones({"kitchen": None})
+    events = engine.expire(now=t + 1.0)
+    assert [(e["tag"], e["zone"], e["reason"]) for e in events] == [("a", "kitchen", "removed")]
+
+    events = engine.expire(now=t + 31.0)
+    assert [(e["tag"], e["zone"], e["reason"]) for e in events] == [("b", "desk", "timeout")]
+    assert engine.occupants("desk") == []
+
+
+def test_stale_fixes_are_skipped():
+    engine = make_engine()
+    t = time.time()
+    engine.update("tag", 2.0, 1.0, 0.0, t)
+    # Older than the tag's last fix: would exit the kitchen if it counted
+    assert engine.update("tag", 20.0, 1.0, 0.0, t - 1.0) == []
+    # Too old to matter at all
+    assert engine.update("other", 2.0, 1.0, 0.0, t - 60.0) == []
+    assert engine.stale == 2 and engine.occupants("kitchen") == ["tag"]
+
+
+def test_snapshot_restore_keeps_visits():
+    engine = make_engine()
+    t = time.time()
+    engine.update("tag", 2.0, 1.0, 0.0, t)
+    restored = geofence.ZoneEngine(hysteresis=0.3, dwell_time=5.0)
+    restored.restore(engine.snapshot())
+    # The zone arrives later, e.g. on the config topic; the visit carries on
+    restored.set_zones(ZONES)
+    assert kinds(restored.update("tag", 2.0, 1.5, 0.0, t + 5.0)) == [("kitchen", "dwell")]
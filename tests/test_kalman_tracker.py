@@ -0,0 +1,69 @@
+# test_kalman_tracker.py
+# Filtering batches of fixes, skipping stale fixes, and snapshots.
+
+import numpy as np
+
+import kalman_tracker
+
+
+def moving_fixes(count, velocity, start=0.0, step=0.1):
+    times = start + step * np.arange(count)
+    positions = np.outer(times - start, velocity) + [1.0, 2.0, 0.5]
+    return positions, times
+
+
+def test_tracks_constant_velocity():
+    tracker = kalman_tracker.KalmanTracker(capacity=2)
+    velocity = np.array([0.5, -0.2, 0.0])
+    positions, times = moving_fixes(60, velocity)
+    for position, t in zip(positions, times):
+        filtered, estimated = tracker.update("tag", position, t)
+    np.testing.assert_allclose(filtered, positions[-1], atol=0.02)
+    np.testing.assert_allclose(estimated, velocity, atol=0.05)
+    assert tracker.fixes("tag") == 60 and "tag" in tracker and len(tracker) == 1
+
+
+def test_batch_matches_single_updates():
+    rng = np.random.default_rng(1)
+    tags = [rng.choice(["a", "b", "c"]) for _ in range(40)]
+    positions = rng.normal(0.0, 1.0, (40, 3))
+    times = np.arange(40) * 0.05
+
+    one_by_one = kalman_tracker.KalmanTracker(capacity=1)
+    expected = np.array([one_by_one.update(tag, p, t)[0] for tag, p, t in zip(tags, positions, times)])
+    # The arrays grow past capacity, and repeated tags are applied in order
+    batched = kalman_tracker.KalmanTracker(capacity=1)
+    filtered, _ = batched.update_many(tags, positions, times)
+    np.testing.assert_allclose(filtered, expected)
+
+
+def test_stale_fixes_are_skipped():
+    tracker = kalman_tracker.KalmanTracker()
+    tracker.update("tag", [1.0, 1.0, 0.0], 10.0)
+    before = tracker.snapshot()["state"].copy()
+
+    filtered, velocities = tracker.update_many(["tag", "tag"], [[5.0, 5.0, 0.0], [1.1, 1.0, 0.0]], [9.0, 10.1])
+    assert np.isnan(filtered[0]).all() and np.isnan(velocities[0]).all()
+    assert np.isfinite(filtered[1]).all()
+    assert tracker.stale == 1 and tracker.fixes("tag") == 2
+
+    # A stale fix alone leaves the state as it was
+    tracker = kalman_tracker.KalmanTracker()
+    tracker.update("tag", [1.0, 1.0, 0.0], 10.0)
+    filtered, _ = tracker.update("tag", [5.0, 5.0, 0.0], 9.0)
+    assert np.isnan(filtered).all()
+    np.testing.assert_array_equal(tracker.snapshot()["state"], before)
+
+
+def test_snapshot_restore():
+    tracker = kalman_tracker.KalmanTracker()
+    positions, times = moving_fixes(10, [1.0, 0.0, 0.0])
+    tracker.update_many(["a"] * 10, positions, times)
+    tracker.update("b", [0.0, 0.0, 0.0], 0.0)
+
+    restored = kalman_tracker.KalmanTracker(capacity=1)
+    restored.restore(tracker.snapshot(), keep=lambda tag: tag == "a")
+    assert "a" in restored and "b" not in restored
+    assert restored.fixes("a") == 10
+    np.testing.assert_allclose(restored.update("a", [1.0, 2.0, 0.5], 1.0)[0],
+                               tracker.update("a", [1.0, 2.0, 0.5], 1.0)[0])
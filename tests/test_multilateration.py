@@ -0,0 +1,81 @@
+# test_multilateration.py
+# The batched solvers on synthetic anchors and tags with known positions.
+
+import numpy as np
+
+import multilateration
+
+ANCHORS = np.array([
+    [0.0, 0.0, 0.0],
+    [8.0, 0.0, 2.5],
+    [8.0, 6.0, 0.0],
+    [0.0, 6.0, 2.5],
+    [4.0, 3.0, 3.0],
+])
+
+
+def synthetic_fixes(count, seed, noise=0.0):
+    rng = np.random.default_rng(seed)
+    tags = rng.uniform([0.5, 0.5, 0.2], [7.5, 5.5, 2.2], size=(count, 3))
+    ranges = np.linalg.norm(tags[:, None, :] - ANCHORS[None, :, :], axis=2)
+    ranges += rng.normal(0.0, noise, ranges.shape)
+    return tags, np.broadcast_to(ANCHORS, (count,) + ANCHORS.shape), ranges
+
+
+def test_exact_ranges_give_exact_positions():
+    tags, anchors, ranges = synthetic_fixes(200, seed=1)
+    positions, residuals = multilateration.solve_positions(anchors, ranges)
+    np.testing.assert_allclose(positions, tags, atol=1e-6)
+    assert np.all(residuals < 1e-6)
+
+    position, _ = multilateration.solve_position(ANCHORS, ranges[0])
+    np.testing.assert_allclose(position, tags[0], atol=1e-6)
+
+
+def test_masked_anchors():
+    tags, anchors, ranges = synthetic_fixes(3, seed=2)
+    mask = np.ones(ranges.shape, dtype=bool)
+    mask[0, 4] = False                   # four anchors left, still solvable
+    mask[1, 2:] = False                  # two anchors left, too few
+    ranges = ranges.copy()
+    ranges[2, 1] = np.nan                # a missing range counts as masked
+    positions, _ = multilateration.solve_positions(anchors, ranges, mask)
+    np.testing.assert_allclose(positions[0], tags[0], atol=1e-6)
+    assert np.isnan(positions[1]).all()
+    np.testing.assert_allclose(positions[2], tags[2], atol=1e-6)
+
+
+def test_refinement_lowers_the_range_error():
+    tags, anchors, ranges = synthetic_fixes(100, seed=3, noise=0.05)
+    linear, linear_residuals = multilateration.solve_positions(anchors, ranges)
+    refined, residuals, iterations, converged = multilateration.refine_positions(
+        anchors, ranges, linear, max_iterations=20)
+    assert converged.all() and (iterations >= 1).all()
+    assert np.all(residuals <= linear_residuals + 1e-9)
+    assert np.abs(refined - tags).max() < 0.3
+
+
+def test_cached_rounds_match_uncached():
+    tags, _, ranges = synthetic_fixes(50, seed=4)
+    anchor_positions = {f"node_{i}": tuple(anchor) for i, anchor in enumerate(ANCHORS)}
+    rounds = []
+    for b, tag_ranges in enumerate(ranges):
+        # Every round misses a different anchor, so several sets are cached
+        nodes = [i for i in range(len(ANCHORS)) if i != b % len(ANCHORS)]
+        rounds.append({f"node_{i}": {"xyz": {"x": 0.0, "y": 0.0, "z": 0.0}, "range": tag_ranges[i]}
+                       for i in nodes})
+    cache = multilateration.GeometryCache()
+    plain, _ = multilateration.solve_rounds(rounds, anchor_positions)
+    # Rounds are grouped by anchor set, so the second call hits the cache
+    for _ in range(2):
+        cached, _ = multilateration.solve_rounds(rounds, anchor_positions, cache)
+        np.testing.assert_allclose(cached, plain, atol=1e-9)
+        np.testing.assert_allclose(cached, tags, atol=1e-6)
+    assert cache.misses == len(ANCHORS) and cache.hits == len(ANCHORS)
+
+    # Rounds without surveyed anchors fall back to the reported XYZ average
+    fallback = {"a": {"xyz": {"x": 1.0, "y": 2.0, "z": 0.0}, "range": None},
+                "b": {"xyz": {"x": 3.0, "y": 4.0, "z": 1.0}, "range": None}}
+    positions, residuals = multilateration.solve_rounds([fallback], anchor_positions, cache)
+    np.testing.assert_allclose(positions[0], [2.0, 3.0, 0.5])
+    assert np.isnan(residuals[0])
@@ -0,0 +1,63 @@
+# test_position_store.py
+# Time-range queries of the position history when records are written out
+# of time order, as they are when rounds complete out of order or nodes
+# replay their outbox.
+
+import random
+
+import numpy as np
+
+import position_store
+
+
+def write_shuffled(path, tags, count, seed):
+    rng = random.Random(seed)
+    store = position_store.PositionStore(path, block_records=8, grow_blocks=4)
+    written = {tag: [] for tag in tags}
+    for i in range(count):
+        tag = rng.choice(tags)
+        # Mostly increasing, with late fixes and replayed old ones mixed in
+        t = 1000.0 + i + rng.choice([0.0, 0.0, -rng.uniform(0, 50), -rng.uniform(0, count)])
+        store.append_fix(tag, t, i, 0.0, 0.0)
+        written[tag].append(t)
+    store.close()
+    return written
+
+
+def check_queries(store, written, seed):
+    rng = random.Random(seed)
+    for _ in range(500):
+        tag = rng.choice(list(written))
+        t0 = rng.uniform(900.0, 1700.0)
+        t1 = t0 + rng.uniform(0.0, 200.0)
+        views = store.query(tag, t0, t1)
+        found = sorted(np.concatenate(views)["time"].tolist()) if views else []
+        assert found == sorted(t for t in written[tag] if t0 <= t <= t1)
+
+
+def test_out_of_order_appends(tmp_path):
+    path = str(tmp_path / "history.log")
+    written = write_shuffled(path, ["tag_a", "tag_b", "tag_c"], 600, seed=1)
+
+    store = position_store.PositionStore(path)
+    check_queries(store, written, seed=2)
+    store.close()
+
+    # A read-only store rebuilds the index from the file
+    reader = position_store.PositionStore(path, readonly=True)
+    check_queries(reader, written, seed=3)
+    reader.close()
+
+
+def test_ordered_blocks_are_views(tmp_path):
+    path = str(tmp_path / "history.log")
+    store = position_store.PositionStore(path, block_records=8, grow_blocks=4)
+    for i in range(20):
+        store.append_fix("tag", 1000.0 + i, i, 0.0, 0.0)
+    store.close()
+
+    reader = position_store.PositionStore(path, readonly=True)
+    views = reader.query("tag", 1003.0, 1012.0)
+    assert [t for view in views for t in view["time"].tolist()] == [1000.0 + i for i in range(3, 13)]
+    assert all(view.base is not None for view in views)
+    reader.close()
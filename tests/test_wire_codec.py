@@ -0,0 +1,105 @@
+# test_wire_codec.py
+# Round trips of the node message formats, single and batched, with and
+# without the tracing time, and sessions cut to the 32-bit wire counter.
+
+import pytest
+
+import round_buffer
+import wire_codec
+
+TAG = "5f0c8a3e-8f4b-4c1e-9a7d-2b6e1f3c4d5a"
+FORMATS = [wire_codec.FORMAT_BINARY, wire_codec.FORMAT_JSON, wire_codec.FORMAT_SLASH]
+
+
+def sample(session, published=None, distance=4.25):
+    return wire_codec.make_sample(None, TAG, session, 1.5, -2.25, 0.75, distance,
+                                  timestamp=1700000000.5, published=published)
+
+
+def assert_same(decoded, original, fmt):
+    assert decoded['tag'] == original['tag']
+    assert decoded['session_id'] == original['session_id']
+    for axis in "xyz":
+        assert decoded['xyz'][axis] == pytest.approx(original['xyz'][axis], abs=1e-2)
+    if original['range'] is None:
+        assert decoded['range'] is None
+    else:
+        assert decoded['range'] == pytest.approx(original['range'], abs=1e-3)
+    if fmt != wire_codec.FORMAT_SLASH:
+        # The string format carries no times
+        assert decoded['timestamp'] == original['timestamp']
+        assert decoded['published'] == original['published']
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_single_round_trip(fmt):
+    original = sample(42)
+    payload = wire_codec.encode(original, fmt)
+    assert wire_codec.detect_format(payload) == fmt
+    assert_same(wire_codec.decode(payload), original, fmt)
+    assert [s['session_id'] for s in wire_codec.decode_many(payload)] == [42]
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_batch_round_trip(fmt):
+    originals = [sample(session, distance=None if session % 2 else 3.0) for session in range(5)]
+    decoded = wire_codec.decode_many(wire_codec.encode_batch(originals, fmt))
+    assert len(decoded) == len(originals)
+    for one, original in zip(decoded, originals):
+        assert_same(one, original, fmt)
+
+
+def test_traced_binary_records():
+    traced = sample(7, published=1700000000.75)
+    payload = wire_codec.encode(traced)
+    assert len(payload) == wire_codec.TRACED_SIZE
+    assert payload[1] == wire_codec.BINARY_VERSION | wire_codec.TRACE_FLAG
+    assert wire_codec.decode(payload)['published'] == 1700000000.75
+    assert len(wire_codec.encode(sample(7))) == wire_codec.BINARY_SIZE
+
+
+def test_traced_batch_flag():
+    # One traced sample makes the whole batch traced; the others decode
+    # without a publish time
+    samples = [sample(1), sample(2, published=1700000001.0), sample(3)]
+    payload = wire_codec.encode_batch(samples)
+    magic, version, count = wire_codec.BATCH_HEADER.unpack_from(payload)
+    assert (magic, count) == (wire_codec.BATCH_MAGIC, 3)
+    assert version == wire_codec.BINARY_VERSION | wire_codec.TRACE_FLAG
+    assert len(payload) == wire_codec.BATCH_HEADER.size + 3 * wire_codec.TRACED_SIZE
+    assert [s['published'] for s in wire_codec.decode_many(payload)] == [None, 1700000001.0, None]
+
+    plain = wire_codec.encode_batch([sample(1), sample(2)])
+    assert plain[1] == wire_codec.BINARY_VERSION
+    assert len(plain) == wire_codec.BATCH_HEADER.size + 2 * wire_codec.BINARY_SIZE
+
+    # The array path of the master reads the same records
+    records = round_buffer.decode_records(payload)
+    assert records['session'].tolist() == [1, 2, 3]
+    assert round_buffer.record_tags(records) == [TAG] * 3
+
+
+def test_sessions_are_cut_to_32_bits():
+    session = 0x1_0000_0005
+    assert wire_codec.session_counter(session) == 5
+    assert wire_codec.session_counter(str(session)) == 5
+    # Every format decodes the same session, so the rounds of nodes using
+    # different formats fuse
+    decoded = {fmt: wire_codec.decode(wire_codec.encode(sample(session), fmt))['session_id'] for fmt in FORMATS}
+    assert decoded == {fmt: 5 for fmt in FORMATS}
+    # Names that are not numbers hash to a stable counter on the wire and
+    # stay names in the text formats
+    assert wire_codec.session_counter("walk-1") == wire_codec.session_counter("walk-1") < 2 ** 32
+    assert wire_codec.decode(wire_codec.encode(sample("walk-1"), wire_codec.FORMAT_JSON))['session_id'] == "walk-1"
+
+
+def test_invalid_payloads():
+    payload = wire_codec.encode(sample(1))
+    with pytest.raises(ValueError):
+        wire_codec.decode(payload[:-1])
+    with pytest.raises(ValueError):
+        wire_codec.decode_many(wire_codec.encode_batch([sample(1), sample(2)])[:-4])
+    with pytest.raises(ValueError):
+        wire_codec.decode(b"tag/1/1.0,2.0")
+    with pytest.raises(ValueError):
+        wire_codec.decode_many(b"")
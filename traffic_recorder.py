@@ -0,0 +1,118 @@
+# traffic_recorder.py
+# This program records the raw node traffic seen by the broker to a file, so
+# it can be replayed into a master later (see replay_bench.py) without any
+# UWB hardware or nodes running.
+#
+# Recording file format: the 8-byte header b"UWBREC1\n", then one record per
+# message: a little-endian (float64 receive time, uint16 topic length,
+# uint32 payload length) header followed by the topic and the raw payload.
+
+import paho.mqtt.client as mqtt
+import struct
+import time
+
+# --- MQTT Broker Configuration ---
+broker_address = "192.168.106.249"
+broker_port = 1883
+
+# --- Recorder Configuration ---
+# Raw data topics of both master variants. "#" also takes the partition
+# topics (<topic>/<partition>/<node>) of a cluster.
+record_topics = ["home/nodes/#", "uwb/raw_data/#"]
+recording_file = "uwb_traffic.rec"
+
+# --- File Format ---
+FILE_HEADER = b"UWBREC1\n"
+_record_header = struct.Struct("<dHI")
+
+
+class RecordingWriter:
+    """
+    This class appends messages to a recording file.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "wb")
+        self._file.write(FILE_HEADER)
+        self.count = 0
+
+    def write(self, topic, payload, timestamp=None):
+        """
+        This function appends one message to the recording.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        topic_bytes = topic.encode()
+        self._file.write(_record_header.pack(timestamp, len(topic_bytes), len(payload)))
+        self._file.write(topic_bytes)
+        self._file.write(payload)
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+
+def read_recording(path):
+    """
+    This function reads a recording file and yields (timestamp, topic, payload)
+    for every message in it.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(FILE_HEADER)) != FILE_HEADER:
+            raise ValueError(f"'{path}' is not a UWB traffic recording")
+        while True:
+            header = f.read(_record_header.size)
+            if len(header) < _record_header.size:
+                return
+            timestamp, topic_length, payload_length = _record_header.unpack(header)
+            topic = f.read(topic_length).decode()
+            payload = f.read(payload_length)
+            yield timestamp, topic, payload
+
+
+# --- MQTT Callback Functions ---
+def on_connect(client, userdata, flags, rc):
+    """
+    Callback function for when the recorder connects to the MQTT broker.
+    """
+    if rc == 0:
+        print("Recorder connected to MQTT Broker!")
+        for topic in record_topics:
+            client.subscribe(topic)
+            print(f"Recording topic: {topic}")
+    else:
+        print(f"Failed to connect, return code {rc}")
+
+def on_message(client, userdata, msg):
+    """
+    Callback function for when a message is received. It appends the message
+    to the recording.
+    """
+    writer = userdata
+    writer.write(msg.topic, msg.payload)
+    if writer.count % 1000 == 0:
+        print(f"Recorded {writer.count} messages")
+
+# --- Main Program ---
+def main():
+    """
+    Records traffic until interrupted.
+    """
+    writer = RecordingWriter(recording_file)
+    client = mqtt.Client(userdata=writer)
+    client.on_connect = on_connect
+    client.on_message = on_message
+
+    try:
+        client.connect(broker_address, broker_port, 60)
+        client.loop_forever()
+
+    except KeyboardInterrupt:
+        print("Exiting...")
+    finally:
+        client.disconnect()
+        writer.close()
+        print(f"Saved {writer.count} messages to '{recording_file}'")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# uart_reader.py
+# This module reads ranging reports from the UWB module on the node's serial
+# port (UART), replacing the simulated get_uwb_data() of the node programs.
+#
+# Frame format sent by the UWB module (little-endian):
+#   0xAA 0x55          sync
+#   type     uint8     FRAME_RANGE for a ranging report
+#   length   uint8     number of payload bytes
+#   payload  length bytes
+#   crc      uint16    CRC-16/CCITT-FALSE of type, length and payload
+# The payload of a ranging report is
+#   tag address uint64, sequence uint32, x, y, z, range float32
+# where x, y, z are NaN when the module does not compute a position, and the
+# sequence is the tag's ranging round number, which is the same at every
+# anchor and therefore used as the session ID.
+#
+# Bytes are read straight into a preallocated buffer and frames are found,
+# checked and unpacked in place (bytearray.find, struct.unpack_from and a CRC
+# over a memoryview), so no bytes are copied or sliced per frame.
+#
+# Running this file without arguments sends frames (with some corrupted ones)
+# through a pseudo-terminal pair and reads them back; with a port argument it
+# prints the frames arriving on that port:
+#   python uart_reader.py
+#   python uart_reader.py /dev/ttyS0 --baudrate 921600
+
+import argparse
+import binascii
+import math
+import os
+import select
+import struct
+import termios
+import threading
+import time
+import tty
+
+import wire_codec
+
+# --- Frame Format ---
+SYNC = b"\xaa\x55"
+FRAME_RANGE = 0x01
+_header = struct.Struct("<2sBB")
+_range_payload = struct.Struct("<QIffff")
+_crc = struct.Struct("<H")
+# Longest possible frame: header, 255 payload bytes and the CRC
+MAX_FRAME = _header.size + 255 + _crc.size
+
+_BAUD_RATES = {
+    9600: termios.B9600, 19200: termios.B19200, 38400: termios.B38400,
+    57600: termios.B57600, 115200: termios.B115200, 230400: termios.B230400,
+    460800: getattr(termios, "B460800", termios.B230400),
+    921600: getattr(termios, "B921600", termios.B230400),
+}
+
+
+def frame_crc(data):
+    """
+    This function returns the CRC-16/CCITT-FALSE of a bytes-like object.
+    """
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode_range_frame(address, sequence, x, y, z, distance):
+    """
+    This function builds a ranging report frame, as the UWB module sends it.
+    Used to test the reader.
+    """
+    body = struct.pack("<BB", FRAME_RANGE, _range_payload.size) + _range_payload.pack(
+        address, sequence & 0xFFFFFFFF, x, y, z, distance)
+    return SYNC + body + _crc.pack(frame_crc(body))
+
+
+def open_serial(path, baudrate=115200):
+    """
+    This function opens a serial port in raw mode at the given baud rate and
+    returns its file descriptor.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    tty.setraw(fd)
+    if baudrate in _BAUD_RATES and os.isatty(fd):
+        attributes = termios.tcgetattr(fd)
+        attributes[4] = attributes[5] = _BAUD_RATES[baudrate]
+        termios.tcsetattr(fd, termios.TCSANOW, attributes)
+    return fd
+
+
+# --- Reader ---
+class UartReader:
+    """
+    This class turns the byte stream of a serial port into ranging reports.
+
+    read() waits up to timeout seconds for data, reads everything available
+    into the buffer in one system call, and returns the list of complete,
+    valid frames as tuples (address, sequence, x, y, z, range). Bytes before
+    a sync pattern and frames with a bad CRC are skipped and counted, and
+    parsing resumes at the next sync pattern.
+
+    The buffer is a ring of buffer_size bytes. Complete frames are consumed
+    where they lie; when the free space at the end gets shorter than one
+    frame, the unparsed rest (less than one frame) moves to the front.
+    """
+
+    def __init__(self, fd, buffer_size=65536):
+        self.fd = fd
+        self._buffer = bytearray(max(buffer_size, 2 * MAX_FRAME))
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+        # Counters for monitoring
+        self.frames = 0
+        self.crc_errors = 0
+        self.skipped_bytes = 0
+        self.unknown_frames = 0
+
+    def read(self, timeout=0.1):
+        """
+        This function returns the frames that arrived within timeout seconds
+        (an empty list if none did).
+        """
+        if len(self._buffer) - self._end < MAX_FRAME:
+            self._compact()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                count = os.readv(self.fd, [self._view[self._end:]])
+            except BlockingIOError:
+                count = 0
+            self._end += count
+        return self._parse()
+
+    def _compact(self):
+        remaining = self._end - self._start
+        self._buffer[:remaining] = self._view[self._start:self._end]
+        self._start = 0
+        self._end = remaining
+
+    def _parse(self):
+        frames = []
+        buffer = self._buffer
+        view = self._view
+        position = self._start
+        end = self._end
+
+        while end - position >= _header.size:
+            sync = buffer.find(SYNC, position, end)
+            if sync < 0:
+                # Keep a last byte that may be the start of a sync pattern
+                keep = end - 1 if buffer[end - 1] == SYNC[0] else end
+                self.skipped_bytes += keep - position
+                position = keep
+                break
+            self.skipped_bytes += sync - position
+            position = sync
+            if end - position < _header.size:
+                break
+
+            _, frame_type, length = _header.unpack_from(buffer, position)
+            frame_end = position + _header.size + length + _crc.size
+            if frame_end > end:
+                break
+
+            body = view[position + len(SYNC):frame_end - _crc.size]
+            (crc,) = _crc.unpack_from(buffer, frame_end - _crc.size)
+            if frame_crc(body) != crc:
+                # Not a real frame (or a corrupted one): look for the next sync
+                self.crc_errors += 1
+                self.skipped_bytes += len(SYNC)
+                position += len(SYNC)
+                continue
+
+            if frame_type == FRAME_RANGE and length == _range_payload.size:
+                frames.append(_range_payload.unpack_from(buffer, position + _header.size))
+                self.frames += 1
+            else:
+                self.unknown_frames += 1
+            position = frame_end
+
+        self._start = position
+        if position == end:
+            self._start = self._end = 0
+        return frames
+
+    def stats(self):
+        """
+        This function returns the counters as a printable line.
+        """
+        return (f"UART: {self.frames} frames, {self.crc_errors} CRC errors, "
+                f"{self.skipped_bytes} bytes skipped, {self.unknown_frames} unknown frames")
+
+
+def to_sample(frame, node_uuid, tag_names=None, timestamp=None):
+    """
+    This function turns a ranging report into a sample dictionary (see
+    wire_codec.make_sample). tag_names maps tag addresses to tag UUIDs;
+    other addresses are named by their hexadecimal address.
+    """
+    address, sequence, x, y, z, distance = frame
+    tag = (tag_names or {}).get(address) or f"{address:016x}"
+    return wire_codec.make_sample(
+        node_uuid, tag, sequence, x, y, z,
+        None if math.isnan(distance) else distance,
+        time.time() if timestamp is None else timestamp)
+
+
+# --- Test Program ---
+def _pty_test(frames=20000):
+    """
+    This function writes frames, garbage and corrupted frames into one end of
+    a pseudo-terminal pair and checks that the reader on the other end gets
+    every good frame.
+    """
+    master_fd, slave_fd = os.openpty()
+    tty.setraw(slave_fd)
+    reader = UartReader(open_serial(os.ttyname(slave_fd)))
+
+    def writer():
+        chunk = bytearray()
+        for i in range(frames):
+            chunk += encode_range_frame(0x1234, i, 1.0, 2.0, 0.5, i * 0.001)
+            if i % 1000 == 0:
+                chunk += b"\x00\xaa\x13garbage"
+                bad = bytearray(encode_range_frame(0x1234, i, 0, 0, 0, 0))
+                bad[10] ^= 0xFF
+                chunk += bad
+            if len(chunk) > 4096:
+                os.write(master_fd, chunk)
+                chunk = bytearray()
+        os.write(master_fd, chunk)
+
+    thread = threading.Thread(target=writer, daemon=True)
+    started = time.perf_counter()
+    thread.start()
+    received = []
+    while len(received) < frames:
+        batch = reader.read(1.0)
+        if not batch and not thread.is_alive():
+            break
+        received.extend(batch)
+    elapsed = time.perf_counter() - started
+
+    in_order = [frame[1] for frame in received] == list(range(len(received)))
+    print(f"Received {len(received)}/{frames} frames in {elapsed:.2f} s "
+          f"({len(received) / elapsed:.0f} frames/s), in order: {in_order}")
+    print(reader.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read UWB ranging frames from a serial port.")
+    parser.add_argument("port", nargs="?", help="serial port; without one, run the pseudo-terminal test")
+    parser.add_argument("--baudrate", type=int, default=115200, help="baud rate of the port")
+    args = parser.parse_args()
+
+    if args.port is None:
+        _pty_test()
+        return
+
+    reader = UartReader(open_serial(args.port, args.baudrate))
+    try:
+        while True:
+            for frame in reader.read(1.0):
+                print(frame)
+    except KeyboardInterrupt:
+        print(reader.stats())
+
+if __name__ == "__main__":
+    main()
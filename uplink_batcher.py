@@ -0,0 +1,81 @@
+# uplink_batcher.py
+# This module lets a node send several samples in one MQTT message.
+# At high sample rates the fixed cost of every MQTT publish dominates, both on
+# the node and on the broker, so samples are collected into a batch and sent
+# together once the batch is full or its oldest sample has waited long enough.
+
+import time
+
+import wire_codec
+
+
+# --- Uplink Batcher ---
+class UplinkBatcher:
+    """
+    This class collects samples and returns a framed batch payload when the
+    batch should be sent.
+
+    A batch is sent as soon as it holds max_samples samples, or when its
+    oldest sample is max_delay_ms milliseconds old. With max_samples = 1
+    every sample is sent on its own in the plain single-sample format, which
+    is exactly what the nodes did before batching existed.
+
+    With trace=True every sample is stamped with its publish time when the
+    batch is encoded (see latency_tracing.py).
+    """
+
+    def __init__(self, max_samples=1, max_delay_ms=100, fmt=wire_codec.FORMAT_BINARY, trace=False):
+        self.max_samples = max(1, min(max_samples, wire_codec.BATCH_MAX_SAMPLES))
+        self.max_delay = max_delay_ms / 1000.0
+        self.fmt = fmt
+        self.trace = trace
+
+        self._samples = []
+        self._first_time = 0.0
+
+    def add(self, sample, now=None):
+        """
+        This function adds one sample. Returns the payload to publish if the
+        batch is now due, otherwise None.
+        """
+        if now is None:
+            now = time.monotonic()
+        if not self._samples:
+            self._first_time = now
+        self._samples.append(sample)
+        if len(self._samples) >= self.max_samples:
+            return self.flush()
+        return self.poll(now)
+
+    def poll(self, now=None):
+        """
+        This function returns the payload to publish if the oldest waiting
+        sample has reached the delay limit, otherwise None. Call it regularly
+        so a quiet node still sends its last samples in time.
+        """
+        if not self._samples:
+            return None
+        if now is None:
+            now = time.monotonic()
+        if now - self._first_time >= self.max_delay:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """
+        This function returns the payload for everything waiting (or None if
+        nothing is waiting) and starts a new batch.
+        """
+        if not self._samples:
+            return None
+        samples, self._samples = self._samples, []
+        if self.trace:
+            published = time.time()
+            for sample in samples:
+                sample['published'] = published
+        if len(samples) == 1 and self.max_samples == 1:
+            return wire_codec.encode(samples[0], self.fmt)
+        return wire_codec.encode_batch(samples, self.fmt)
+
+    def __len__(self):
+        return len(self._samples)
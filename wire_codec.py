@@ -0,0 +1,312 @@
+# wire_codec.py
+# This module defines the message formats that the nodes publish and the
+# masters read. Every program encodes and decodes samples through here.
+#
+# Three formats are understood:
+#   binary - a fixed 46-byte struct (the default for new nodes)
+#   json   - the original rpi_node.py dictionary
+#   slash  - the original "TAG_UUID/session_ID/X,Y,Z[,RANGE]" string
+# decode() detects the format from the payload itself, so old and new nodes
+# can publish to the same master while the fleet is migrated.
+#
+# A node may also send several samples in one message (a batch). A binary
+# batch is a small header followed by binary records, a JSON batch is a list
+# of JSON messages and a string batch has one message per line.
+# decode_many() accepts both single messages and batches.
+
+import functools
+import json
+import math
+import struct
+import uuid
+import zlib
+
+# --- Format Names ---
+FORMAT_BINARY = "binary"
+FORMAT_JSON = "json"
+FORMAT_SLASH = "slash"
+
+# --- Binary Layout ---
+# All fields are little-endian:
+#   B    magic byte (0xB5), never the first byte of the text formats
+#   B    format version
+#   16s  tag UUID
+#   I    session counter
+#   4f   x, y, z and range as float32 (range is NaN when not measured)
+#   d    sample timestamp in seconds since the epoch (NaN when unknown)
+BINARY_MAGIC = 0xB5
+BINARY_VERSION = 1
+_record = struct.Struct("<BB16sIffffd")
+BINARY_SIZE = _record.size
+
+# With latency tracing on, the version byte has TRACE_FLAG set and the record
+# ends with one more float64: the time the node published it.
+TRACE_FLAG = 0x80
+_traced_record = struct.Struct("<BB16sIffffdd")
+TRACED_SIZE = _traced_record.size
+
+# A binary batch starts with its own magic byte (0xB6), the format version and
+# the number of records as uint16 (BATCH_HEADER), followed by that many binary
+# records.
+BATCH_MAGIC = 0xB6
+BATCH_HEADER = struct.Struct("<BBH")
+BATCH_MAX_SAMPLES = 0xFFFF
+
+# Namespace used to turn non-UUID names (e.g. "iphone_tracked_device") into
+# the 16 bytes the binary format needs. The same name always gives the same
+# UUID, but the master will see the UUID string instead of the name.
+_name_namespace = uuid.UUID("2b0d6a43-51c9-4b8e-9a3f-6d1e0c7b5a21")
+_nil_uuid = bytes(16)
+
+
+# --- Helpers ---
+@functools.lru_cache(maxsize=4096)
+def _uuid_bytes(name):
+    if not name:
+        return _nil_uuid
+    try:
+        return uuid.UUID(name).bytes
+    except ValueError:
+        return uuid.uuid5(_name_namespace, name).bytes
+
+
+@functools.lru_cache(maxsize=4096)
+def uuid_string(raw):
+    """
+    This function turns the 16 tag bytes of a binary record back into a UUID
+    string, or None for a record without a tag.
+    """
+    if raw == _nil_uuid:
+        return None
+    return str(uuid.UUID(bytes=raw))
+
+
+def session_counter(session_id):
+    """
+    This function returns the 32-bit session counter sent on the wire for a
+    session id. Decimal strings from the text formats convert directly;
+    anything else is hashed to a stable number.
+    """
+    if isinstance(session_id, int):
+        return session_id & 0xFFFFFFFF
+    session_id = str(session_id)
+    if session_id.isdigit():
+        return int(session_id) & 0xFFFFFFFF
+    return zlib.crc32(session_id.encode())
+
+
+def _session_value(session_id):
+    # Text formats carry the session as a string (or a JSON number). Numeric
+    # ones become ints, cut to 32 bits like the binary field, so they match
+    # the same session arriving in binary from another node.
+    if isinstance(session_id, int):
+        return session_id & 0xFFFFFFFF
+    if isinstance(session_id, str) and session_id.isdigit():
+        return int(session_id) & 0xFFFFFFFF
+    return session_id
+
+
+def make_sample(node_uuid, tag_uuid, session_id, x, y, z, distance=None, timestamp=None, published=None):
+    """
+    This function builds the sample dictionary used by every program.
+
+    It has the same keys as the original JSON message, plus "range",
+    "timestamp" and the tracing time "published", which are None when not
+    known. The binary and string formats
+    do not carry the node UUID ("uuid" decodes as None), because every node
+    already publishes to its own topic.
+    """
+    return {
+        "uuid": node_uuid,
+        "tag": tag_uuid,
+        "session_id": session_id,
+        "xyz": {"x": x, "y": y, "z": z},
+        "range": distance,
+        "timestamp": timestamp,
+        "published": published,
+    }
+
+
+# --- Encoding ---
+def encode(sample, fmt=FORMAT_BINARY):
+    """
+    This function turns a sample dictionary into a message payload (bytes).
+    """
+    xyz = sample['xyz']
+    distance = sample.get('range')
+
+    if fmt == FORMAT_BINARY:
+        timestamp = sample.get('timestamp')
+        published = sample.get('published')
+        fields = (
+            _uuid_bytes(sample.get('tag')),
+            session_counter(sample['session_id']),
+            xyz['x'], xyz['y'], xyz['z'],
+            math.nan if distance is None else distance,
+            math.nan if timestamp is None else timestamp,
+        )
+        if published is None:
+            return _record.pack(BINARY_MAGIC, BINARY_VERSION, *fields)
+        return _traced_record.pack(BINARY_MAGIC, BINARY_VERSION | TRACE_FLAG, *fields, published)
+
+    if fmt == FORMAT_JSON:
+        data = {
+            "uuid": sample.get('uuid'),
+            "tag": sample.get('tag'),
+            "session_id": sample['session_id'],
+            "xyz": {"x": round(xyz['x'], 2), "y": round(xyz['y'], 2), "z": round(xyz['z'], 2)},
+        }
+        if distance is not None:
+            data["range"] = round(distance, 3)
+        if sample.get('timestamp') is not None:
+            data["timestamp"] = sample['timestamp']
+        if sample.get('published') is not None:
+            data["published"] = sample['published']
+        return json.dumps(data).encode()
+
+    if fmt == FORMAT_SLASH:
+        text = f"{sample.get('tag')}/{sample['session_id']}/{xyz['x']:.2f},{xyz['y']:.2f},{xyz['z']:.2f}"
+        if distance is not None:
+            text += f",{distance:.3f}"
+        return text.encode()
+
+    raise ValueError(f"Unknown wire format: {fmt}")
+
+
+def encode_batch(samples, fmt=FORMAT_BINARY):
+    """
+    This function turns a list of sample dictionaries into one batch payload.
+    """
+    if len(samples) > BATCH_MAX_SAMPLES:
+        raise ValueError(f"a batch holds at most {BATCH_MAX_SAMPLES} samples")
+
+    if fmt == FORMAT_BINARY:
+        # Records in a batch must all have the same size, so either every
+        # record carries a publish time or none does
+        traced = any(sample.get('published') is not None for sample in samples)
+        if traced:
+            samples = [dict(sample, published=sample.get('published') or math.nan) for sample in samples]
+        version = BINARY_VERSION | TRACE_FLAG if traced else BINARY_VERSION
+        parts = [BATCH_HEADER.pack(BATCH_MAGIC, version, len(samples))]
+        parts.extend(encode(sample, fmt) for sample in samples)
+        return b"".join(parts)
+
+    if fmt == FORMAT_JSON:
+        return b"[" + b",".join(encode(sample, fmt) for sample in samples) + b"]"
+
+    if fmt == FORMAT_SLASH:
+        return b"\n".join(encode(sample, fmt) for sample in samples)
+
+    raise ValueError(f"Unknown wire format: {fmt}")
+
+
+# --- Decoding ---
+def _sample_from_json(data):
+    try:
+        xyz = data['xyz']
+        return make_sample(
+            data.get('uuid'), data.get('tag'), _session_value(data['session_id']),
+            float(xyz['x']), float(xyz['y']), float(xyz['z']),
+            data.get('range'), data.get('timestamp'), data.get('published'),
+        )
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"missing or invalid field in JSON sample: {e}")
+
+
+def detect_format(payload):
+    """
+    This function tells which format a payload uses from its first byte.
+    """
+    if not payload:
+        raise ValueError("empty payload")
+    first = payload[0]
+    if first == BINARY_MAGIC or first == BATCH_MAGIC:
+        return FORMAT_BINARY
+    if first == ord('{') or first == ord('['):
+        return FORMAT_JSON
+    return FORMAT_SLASH
+
+
+def decode(payload):
+    """
+    This function turns a message payload in any known format into a sample
+    dictionary. Raises ValueError if the payload cannot be parsed.
+    """
+    fmt = detect_format(payload)
+
+    if fmt == FORMAT_BINARY:
+        published = None
+        if len(payload) > 1 and payload[1] == BINARY_VERSION | TRACE_FLAG:
+            if len(payload) != TRACED_SIZE:
+                raise ValueError(f"traced binary sample must be {TRACED_SIZE} bytes, got {len(payload)}")
+            (_, version, tag_raw, session_id,
+             x, y, z, distance, timestamp, published) = _traced_record.unpack(payload)
+            if published != published:
+                published = None
+        else:
+            if len(payload) != BINARY_SIZE:
+                raise ValueError(f"binary sample must be {BINARY_SIZE} bytes, got {len(payload)}")
+            (_, version, tag_raw, session_id,
+             x, y, z, distance, timestamp) = _record.unpack(payload)
+            if version != BINARY_VERSION:
+                raise ValueError(f"unsupported binary version {version}")
+        return make_sample(
+            None, uuid_string(tag_raw), session_id, x, y, z,
+            None if distance != distance else distance,
+            None if timestamp != timestamp else timestamp,
+            published,
+        )
+
+    text = bytes(payload).decode()
+
+    if fmt == FORMAT_JSON:
+        return _sample_from_json(json.loads(text))
+
+    parts = text.split('/')
+    if len(parts) != 3:
+        raise ValueError(f"expected 'TAG/session/X,Y,Z[,RANGE]', got {text!r}")
+    tag_uuid, session_id, xyz_string = parts
+    # Nodes append the measured range as an optional fourth value
+    values = list(map(float, xyz_string.split(',')))
+    if len(values) not in (3, 4):
+        raise ValueError(f"expected 3 or 4 values, got {len(values)}")
+    return make_sample(
+        None, tag_uuid, _session_value(session_id), values[0], values[1], values[2],
+        values[3] if len(values) == 4 else None,
+    )
+
+
+def decode_many(payload):
+    """
+    This function turns a single message or a batch, in any known format,
+    into a list of sample dictionaries. Raises ValueError if the payload
+    cannot be parsed.
+    """
+    if not payload:
+        raise ValueError("empty payload")
+    first = payload[0]
+
+    if first == BATCH_MAGIC:
+        if len(payload) < BATCH_HEADER.size:
+            raise ValueError("truncated binary batch header")
+        _, version, count = BATCH_HEADER.unpack_from(payload)
+        if version & ~TRACE_FLAG != BINARY_VERSION:
+            raise ValueError(f"unsupported binary version {version}")
+        size = TRACED_SIZE if version & TRACE_FLAG else BINARY_SIZE
+        if len(payload) != BATCH_HEADER.size + count * size:
+            raise ValueError(f"binary batch of {count} samples has the wrong length {len(payload)}")
+        view = memoryview(payload)
+        offsets = range(BATCH_HEADER.size, len(payload), size)
+        return [decode(view[offset:offset + size]) for offset in offsets]
+
+    if first == ord('['):
+        items = json.loads(bytes(payload).decode())
+        if not isinstance(items, list):
+            raise ValueError("JSON batch must be a list")
+        return [_sample_from_json(item) for item in items]
+
+    if first == BINARY_MAGIC or first == ord('{'):
+        return [decode(payload)]
+
+    # String messages, one per line
+    return [decode(line) for line in bytes(payload).split(b"\n") if line]